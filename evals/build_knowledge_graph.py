@@ -2,6 +2,9 @@ import pandas as pd
 import typing as t
 from langchain_core.documents import Document
 from util.document_utils import df_to_documents
+from util.embedding_store import EmbeddingStore
+from util.util_main import drop_embedding_columns
+from load.document_index import DocumentIndex
 from ragas.testset.graph import KnowledgeGraph, Node, NodeType, Relationship
 from ragas.testset.transforms import apply_transforms
 from ragas.testset.transforms.base import BaseGraphTransformation
@@ -22,16 +25,30 @@ from evals.evals_utils import (
 from langsmith import tracing_context
 
 
-def construct_kg_nodes(docs: list[Document]) -> KnowledgeGraph:
+def construct_kg_nodes(
+    docs: list[Document], embedding_store: EmbeddingStore | None = None
+) -> KnowledgeGraph:
     """Apply the following columns from df to nodes.properties:
     - entities: List[str]
     - themes: List[str]
     - title_embedding: List[float]
     - technical_summary: str
     - technical_summary_embedding: List[float]
+
+    With an embedding_store the embeddings are sliced from it by doc id instead of being
+    read from doc.metadata.
     """
+    embeddings = {}
+    if embedding_store is not None:
+        ids = [doc.id for doc in docs]
+        for column in ["title_embedding", "technical_summary_embedding"]:
+            embeddings[column] = [
+                [] if vector is None else vector.tolist()
+                for vector in embedding_store.get_vectors(column, ids)
+            ]
+
     knowledge_graph = KnowledgeGraph()
-    for doc in docs:
+    for i, doc in enumerate(docs):
         # Convert entities from comma-separated string to list if it's a string
         entities = doc.metadata["entities"]
         if isinstance(entities, str):
@@ -45,10 +62,16 @@ def construct_kg_nodes(docs: list[Document]) -> KnowledgeGraph:
                     "document_metadata": doc.metadata,
                     "entities": entities,
                     "themes": doc.metadata.get("themes", []),
-                    "title_embedding": doc.metadata.get("title_embedding", []),
+                    "title_embedding": (
+                        embeddings["title_embedding"][i]
+                        if embeddings
+                        else doc.metadata.get("title_embedding", [])
+                    ),
                     "technical_summary": doc.metadata.get("technical_summary", ""),
-                    "technical_summary_embedding": doc.metadata.get(
-                        "technical_summary_embedding", []
+                    "technical_summary_embedding": (
+                        embeddings["technical_summary_embedding"][i]
+                        if embeddings
+                        else doc.metadata.get("technical_summary_embedding", [])
                     ),
                 },
             )
@@ -177,12 +200,19 @@ def merge_kg_relationships(kg: KnowledgeGraph):
     return kg
 
 
-def create_kg(df: pd.DataFrame, transforms: list[BaseGraphTransformation]) -> None:
+def create_kg(
+    df: pd.DataFrame,
+    transforms: list[BaseGraphTransformation],
+    embedding_store: EmbeddingStore | None = None,
+) -> None:
+    if embedding_store is not None:
+        # Vectors come from the store, don't copy them into every node's metadata
+        df = drop_embedding_columns(df)
     docs = df_to_documents(df)
     docs = [clean_meta(doc) for doc in docs]
     num_docs = len(docs)
     print(f"\nConstructing KG with {num_docs} docs", flush=True)
-    kg = construct_kg_nodes(docs)
+    kg = construct_kg_nodes(docs, embedding_store)
     print(f"KG has {len(kg.nodes)} nodes", flush=True)
     apply_transforms(kg, transforms)
     print(f"Transformed KG has {len(kg.nodes)} nodes", flush=True)
@@ -297,4 +327,4 @@ with tracing_context(enabled=False):
         return transforms  # type: ignore
 
     input_data_df = pd.read_parquet(kg_input_data_path)
-    create_kg(input_data_df, get_transforms())
+    create_kg(input_data_df, get_transforms(), DocumentIndex.get_embedding_store())
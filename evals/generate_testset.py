@@ -11,7 +11,7 @@ from langchain.prompts import (
 from pydantic import BaseModel, Field
 import json
 from evals.evals_utils import output_nodes_path, output_relationships_path
-from util.util_main import count_tokens
+from util.token_counting import get_token_counter
 import shutil
 from prompts import load_prompts
 from langchain_core.rate_limiters import InMemoryRateLimiter
@@ -325,7 +325,9 @@ class GenerateTestSet:
         Returns:
             Boolean indicating whether token count exceeds the threshold.
         """
-        token_count = nodes_df[self.doc_text_column].apply(count_tokens).sum()
+        token_count = (
+            get_token_counter().count_column(nodes_df, self.doc_text_column).sum()
+        )
         is_under_threshold = token_count < self.max_context_token_count
         if not is_under_threshold:
             print(
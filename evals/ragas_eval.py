@@ -69,10 +69,21 @@ class RagasEval:
             evals_dir / "testsets" / testset_name / "__nodes.parquet"
         )
         # Merge nodes_df with kg_input_data.parquet on 'id'
-        document_index = DocumentIndex.get_document_index()
+        document_index = DocumentIndex.get_document_index(include_embeddings=False)
         nodes_df = pd.merge(
             nodes_df, document_index, on="id", how="inner", suffixes=("", "_di")
         )
+        # Only the testset's nodes need vectors, so slice them out of the embedding store
+        embedding_store = DocumentIndex.get_embedding_store()
+        for column in [
+            "page_content_embedding",
+            "technical_summary_embedding",
+            "primary_content_embedding",
+        ]:
+            nodes_df[column] = [
+                None if vector is None else vector.tolist()
+                for vector in embedding_store.get_vectors(column, nodes_df["id"])
+            ]
         self.runs_dir = evals_dir / "experiments"
         self.output_dir = self.runs_dir / run_name
         self.output_file_path = self.output_dir / f"{run_name}.parquet"
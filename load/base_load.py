@@ -1,21 +1,28 @@
-import tiktoken
 from config import global_config, ConfigType
 import pandas as pd
 from pathlib import Path
 from langchain_core.documents import Document
-from langchain_openai import OpenAIEmbeddings
+from util.embedding_cache import CachedEmbeddings
+from util.embedding_scheduler import embed_columns
 from config.logger import RotatingFileLogger
 from uuid import uuid4
+from itertools import batched
+from typing import Iterator
+from collections import Counter
 from util.deduplication_pipeline import DeduplicationPipeline
+from util.streaming_deduplication import StreamingDeduplicationPipeline
 from util.document_utils import df_to_documents
 from langchain.text_splitter import TextSplitter, RecursiveCharacterTextSplitter
-import spacy
-from load.html.html_util import get_settings_entities
+from load.ner import NerEngine, NerModelTier
+from load.resources import get_batch_manager, get_cached_embedding_model
+from util.parquet_cache import ParquetCache
+from util.token_counting import get_token_counter
 from load.batch_manager import BatchManager
+from load.batch_retry import get_retry_reason
 from util.util_main import (
     to_serialized_parquet,
+    to_serialized_parquet_batches,
     drop_embedding_columns,
-    get_chunk_size,
 )
 import json
 
@@ -99,19 +106,30 @@ class BaseLoad:
         self.staging_folder: Path = self.this_dir / self.folder_name
         self.staging_path: Path = self.staging_folder / "staging.parquet"
         self.synth_data_path: Path = self.staging_folder / "synth_data.parquet"
-        deduplication_lock_path: Path = (
+        self.deduplication_lock_path: Path = (
             self.staging_folder / "deduplication_lock.parquet"
         )
         self.deduplication_pipeline = (
-            DeduplicationLockPipeline(deduplication_lock_path)
-            if deduplication_lock_path.exists()
-            else DeduplicationPipeline(self.folder_name)
-        )
-        self.embedding_model: OpenAIEmbeddings = OpenAIEmbeddings(
-            model="text-embedding-3-large"
+            DeduplicationLockPipeline(self.deduplication_lock_path)
+            if self.deduplication_lock_path.exists()
+            else DeduplicationPipeline(
+                self.folder_name,
+                cache_dir=self.staging_folder / "dedup_cache",
+                index_dir=self.staging_folder / "dedup_index",
+            )
         )
-        self.batch_manager: BatchManager = BatchManager(self.staging_folder)
-        self.init_spacy()
+        self._ner_engine: NerEngine | None = None
+        self._ner_options: dict = {}
+
+    @property
+    def embedding_model(self) -> CachedEmbeddings:
+        """Shared across loaders and created on first use. Only cache misses hit the API."""
+        return get_cached_embedding_model("text-embedding-3-large")
+
+    @property
+    def batch_manager(self) -> BatchManager:
+        """Created on first use, so loaders that only read artifacts need no OPENAI_API_KEY."""
+        return get_batch_manager(self.staging_folder)
 
     def apply_synth_data_to_staging(self):
         """Apply the generated data from LLM to the staging file."""
@@ -128,60 +146,75 @@ class BaseLoad:
         staging.drop(columns=synthetic_data.columns, inplace=True, errors="ignore")
 
         merged = pd.merge(staging, synthetic_data, left_index=True, right_index=True)
-        # generate the title embeddings
-        merged = self._generate_embeddings(merged, "title")
-        merged = self._generate_embeddings(merged, "technical_summary")
-        merged = self._generate_embeddings(merged, "primary_content")
+        # generate the embeddings, all three columns share one request pipeline
+        merged = self._generate_embeddings(
+            merged, "title", "technical_summary", "primary_content"
+        )
+        self.embedding_model.print_stats()
         to_serialized_parquet(merged, self.staging_path)
 
-    def create_synth_data_from_batch_results(self) -> None:
+    def _iter_synth_records(self, skipped: Counter) -> Iterator[dict]:
         """
-        Create a parquet file from the batch results JSON file.
-        Extracts content from each result and flattens into a dataframe structure.
+        Parse the batch results file line by line into {"id": ..., **content} records.
+        Unusable results are logged and counted in skipped by reason (get_retry_reason).
         """
-        output_file_name = self.batch_manager.output_file_name
-        if not output_file_name.exists():
-            raise FileNotFoundError(f"Results file not found at {output_file_name}")
-
-        with open(output_file_name) as f:
-            data = json.load(f)
+        for item in self.batch_manager.iter_results():
+            reason = get_retry_reason(item)
+            if reason:
+                self.logger.error(
+                    f"Skipping {reason} result for item {item.get('custom_id', 'unknown')}"
+                )
+                skipped[reason] += 1
+                continue
 
-        # Extract and process the data
-        processed_data = []
-        for item in data:
             record = {
                 "id": item["custom_id"],
             }
+            message = item["response"]["body"]["choices"][0]["message"]
+            record.update(json.loads(message["content"]))
+            yield record
 
-            # Extract message content and parse it
-            try:
-                message = item["response"]["body"]["choices"][0]["message"]
-                content = json.loads(message["content"])
-                record.update(content)
-            except (KeyError, json.JSONDecodeError) as e:
-                self.logger.error(
-                    f"Error processing item {item.get('custom_id', 'unknown')}: {e}"
-                )
-                continue
-
-            processed_data.append(record)
+    def create_synth_data_from_batch_results(self, batch_size: int = 10_000) -> None:
+        """
+        Create a parquet file from the batch results file.
+        Results are parsed line by line and written batch_size rows at a time, so memory
+        use is bounded by batch_size rather than the size of the results file.
 
-        # Create DataFrame and save as parquet
-        df = pd.DataFrame(processed_data)
-        df = df.set_index("id", verify_integrity=True)
-        to_serialized_parquet(df, self.synth_data_path)
+        Failed items are retried by BatchOrchestrator before its results are merged, the
+        ones that still fail are skipped and reported here.
+        """
+        seen_ids = set()
+        skipped = Counter()
+
+        def frames() -> Iterator[pd.DataFrame]:
+            for records in batched(self._iter_synth_records(skipped), batch_size):
+                df = pd.DataFrame(records).set_index("id", verify_integrity=True)
+                duplicates = seen_ids.intersection(df.index)
+                if duplicates:
+                    raise ValueError(f"Duplicate result ids: {sorted(duplicates)[:5]}")
+                seen_ids.update(df.index)
+                yield df
+
+        to_serialized_parquet_batches(frames(), self.synth_data_path)
+        if skipped:
+            print(
+                f"Skipped {sum(skipped.values())} unusable results {dict(skipped)}, "
+                f"see the log for their ids"
+            )
 
     def _generate_embeddings(
-        self, df: pd.DataFrame, column_name: str, chunk_size: int = 1000
+        self, df: pd.DataFrame, *column_names: str
     ) -> pd.DataFrame:
-        """Generate embeddings for a specific column in a dataframe."""
-        texts = df[column_name].tolist()
-        optimal_chunk_size = get_chunk_size(texts)
-        print(f"Using chunk size {optimal_chunk_size}")
-        chunk_size = min(chunk_size, optimal_chunk_size)
-
-        embeddings = self.embedding_model.embed_documents(texts, chunk_size=chunk_size)
-        df[f"{column_name}_embedding"] = embeddings
+        """
+        Generate embeddings for columns of a dataframe. The columns are embedded
+        concurrently under the scheduler's shared token budget.
+        """
+        embeddings = embed_columns(
+            self.embedding_model,
+            {column_name: df[column_name].tolist() for column_name in column_names},
+        )
+        for column_name, column_embeddings in embeddings.items():
+            df[f"{column_name}_embedding"] = column_embeddings
         return df
 
     @property
@@ -196,47 +229,42 @@ class BaseLoad:
     @staticmethod
     def count_tokens(text: str) -> int:
         """Count the tokens in a text."""
-        tokenizer = tiktoken.get_encoding("cl100k_base")
-        return len(tokenizer.encode(str(text)))
+        return get_token_counter().count(text)
 
     def load_docs(self, documents: list[Document]) -> list[Document]:
         """Perform final operations like text splitting, synthetic data generation, and knowledge_graph final product for upload to vector store."""
         return documents
 
-    def init_spacy(self):
-        """Initialize SpaCy model."""
-        nlp = spacy.load("en_core_web_trf")
-        ruler = nlp.add_pipe("entity_ruler", before="ner")
-        all_entities = get_settings_entities()
-        patterns = [
-            {"label": "PEPWAVE_SETTINGS_ENTITY", "pattern": entity, "id": "LOWER"}
-            for entity in all_entities
-        ]
-        ruler.add_patterns(patterns)
-        self.nlp = nlp
+    def init_spacy(self, tier: NerModelTier | None = None, **kwargs):
+        """
+        Initialize the SpaCy NER engine.
+
+        Args:
+            tier: "trf" (default) or "sm" for fast re-runs. Falls back to the NER_MODEL_TIER
+                env var.
+            kwargs: batch_size and n_process for NerEngine
+        """
+        tier = tier or self.config.get("NER_MODEL_TIER", "trf")
+        self._ner_options = {"tier": tier, **kwargs}
+        self._ner_engine = NerEngine(
+            tier,
+            cache=ParquetCache(self.staging_folder / "ner_cache" / "entities.parquet"),
+            logger=self.logger,
+            **kwargs,
+        )
+        self.nlp = self._ner_engine.nlp
+
+    @property
+    def ner_engine(self) -> NerEngine:
+        """Loaded on first use. ner() refreshes its EntityRuler once per call."""
+        if self._ner_engine is None:
+            self.init_spacy(**self._ner_options)
+        return self._ner_engine
 
     def extract_entities(self, text: str) -> list[str]:
         """Use SpaCy NER to extract entities from text, including custom PEPWAVE_SETTINGS_ENTITY."""
-        if not text or pd.isna(text):
-            return []
-
-        # Process the text with the pipeline that includes our EntityRuler
-        doc = self.nlp(text)
-        entities: set[str] = {
-            ent.text
-            for ent in doc.ents
-            if ent.label_
-            in {
-                "URL",
-                "FAC",
-                "ORG",
-                "PRODUCT",
-                "PEPWAVE_SETTINGS_ENTITY",  # Our custom entity type from user manual settings entities
-            }
-            and any(c.isalpha() for c in ent.text)
-        }
-
-        return list(entities)
+        # Cached entities are written by the next ner() call, not one shard per text
+        return self.ner_engine.extract_entities([text], save=False)[0]
 
     def ner(
         self,
@@ -257,30 +285,23 @@ class BaseLoad:
             DataFrame with added entities column
         """
         df = df.copy()
-        # Process primary content column
-        df["primary_entities"] = df[primary_content_col].apply(self.extract_entities)
-
-        # Process lead content column if it exists
+        # HtmlLoad rewrites settings_entities.json right before running NER
+        self.ner_engine.refresh_ruler()
+        # Both columns go through one nlp.pipe call so they share batches
+        texts = df[primary_content_col].tolist()
         if lead_content_col in df.columns:
-            df["lead_entities"] = df[lead_content_col].apply(self.extract_entities)
-        else:
-            df["lead_entities"] = df.apply(lambda _: [], axis=1)
+            texts += df[lead_content_col].tolist()
+        entities = self.ner_engine.extract_entities(texts, save=False)
+        # Also writes entries left pending by extract_entities
+        self.ner_engine.save_cache()
 
         # Combine entities from both columns, removing duplicates
-        def combine_entities(row: pd.Series) -> list[str]:
-            all_entities = []
-            if row["primary_entities"]:
-                all_entities.extend(row["primary_entities"])
-            if row["lead_entities"]:
-                all_entities.extend(row["lead_entities"])
-
-            return list(set(all_entities))
-
-        df["entities"] = df.apply(combine_entities, axis=1)
-
-        # Drop intermediate columns
-        df = df.drop(columns=["primary_entities", "lead_entities"])
-
+        primary_entities = entities[: len(df)]
+        lead_entities = entities[len(df) :] or [[] for _ in range(len(df))]
+        df["entities"] = [
+            list(set(primary + lead))
+            for primary, lead in zip(primary_entities, lead_entities)
+        ]
         return df
 
     @staticmethod
@@ -380,6 +401,21 @@ class BaseLoad:
         staging_docs = self.load_docs(all_documents)
         self._stage_documents(staging_docs)
 
+    def create_deduplication_lock_streaming(self, **kwargs) -> None:
+        """
+        Deduplicate data/<folder>/documents out of core and write deduplication_lock.parquet,
+        so load() filters with the lock instead of running DeduplicationPipeline in memory.
+        Use for sources too large to dedupe in RAM. kwargs go to StreamingDeduplicationPipeline.
+        """
+        documents_dir = self.config.root_dir / "data" / self.folder_name / "documents"
+        pipeline = StreamingDeduplicationPipeline(
+            self.folder_name, self.staging_folder / "dedup_spill", **kwargs
+        )
+        pipeline.run(documents_dir, lock_path=self.deduplication_lock_path)
+        self.deduplication_pipeline = DeduplicationLockPipeline(
+            self.deduplication_lock_path
+        )
+
     def normalize_columns(
         self,
         df: pd.DataFrame,
@@ -0,0 +1,278 @@
+import json
+from itertools import batched
+from pathlib import Path
+from typing import Any, Callable, Iterable
+from pydantic import BaseModel
+from util.token_counting import get_encoder, get_model_encoding_name
+
+# Batch API limits per input file
+BATCH_FILE_REQUEST_LIMIT = 50_000
+BATCH_FILE_BYTE_LIMIT = 200 * 1024 * 1024
+# Prompt plus max_tokens per file, leaves room under the org's enqueued token limit
+BATCH_FILE_TOKEN_LIMIT = 8_000_000
+
+# Chat format overhead: each message is wrapped in 3 tokens plus its role,
+# and every reply is primed with 3 tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+# Batch API prices in USD per 1M (input, output) tokens, half the synchronous price
+BATCH_PRICES = {
+    "gpt-4.1": (1.00, 4.00),
+    "gpt-4.1-mini": (0.20, 0.80),
+    "gpt-4.1-nano": (0.05, 0.20),
+    "gpt-4o-mini": (0.075, 0.30),
+}
+
+
+def get_model_token_counter(model: str) -> Callable[[list[str]], list[int]]:
+    """Batch token counter with the tiktoken encoding of model."""
+    return lambda texts: [
+        len(tokens)
+        for tokens in get_encoder(get_model_encoding_name(model)).encode_ordinary_batch(
+            texts
+        )
+    ]
+
+
+def count_batch_file_tokens(
+    batch_file: Path,
+    count_tokens: Callable[[list[str]], list[int]] | None = None,
+    count_batch_size: int = 1000,
+) -> int:
+    """
+    Prompt tokens in chat format plus max_tokens of every request in a batch file, the
+    same count BatchFileBuilder limits files by (BatchFileStats.tokens).
+
+    Args:
+        batch_file: JSONL file of chat completion tasks
+        count_tokens: Batch token counter. Defaults to each task's model encoding.
+        count_batch_size: Tasks read and tokenized at a time
+    """
+    tokens = 0
+    with open(batch_file) as f:
+        for lines in batched(f, count_batch_size):
+            contents: dict[str, list[str]] = {}
+            for line in lines:
+                if not line.strip():
+                    continue
+                body = json.loads(line)["body"]
+                messages = body.get("messages", [])
+                tokens += (
+                    len(messages) * MESSAGE_OVERHEAD_TOKENS
+                    + REPLY_PRIMING_TOKENS
+                    + body.get("max_tokens", 0)
+                )
+                contents.setdefault(body.get("model", ""), []).extend(
+                    str(message["content"]) for message in messages
+                )
+            for model, texts in contents.items():
+                counter = count_tokens or get_model_token_counter(model)
+                tokens += sum(counter(texts))
+    return tokens
+
+
+class BatchFileStats(BaseModel):
+    """Size and projected cost of one batch file."""
+
+    path: str
+    requests: int = 0
+    bytes: int = 0
+    input_tokens: int = 0
+    max_output_tokens: int = 0
+    input_cost: float | None = None
+    max_output_cost: float | None = None
+
+    @property
+    def tokens(self) -> int:
+        """What the enqueued token limit counts, same as count_batch_file_tokens."""
+        return self.input_tokens + self.max_output_tokens
+
+    def report(self) -> str:
+        cost = (
+            f"${self.input_cost:.2f} input + up to ${self.max_output_cost:.2f} output"
+            if self.input_cost is not None
+            else "unknown cost"
+        )
+        return (
+            f"{Path(self.path).name}: {self.requests} requests, "
+            f"{self.bytes / 1024 / 1024:.1f} MB, {self.input_tokens} input tokens, "
+            f"{cost}"
+        )
+
+
+class BatchFileBuilder:
+    """
+    Streams chat completion tasks that share one system prompt into rolling
+    <prefix>_<n>.jsonl files.
+
+    A file is closed before it would exceed max_file_tokens (prompt tokens plus
+    max_tokens, as the enqueued token limit counts them), max_file_requests or
+    max_file_bytes. The system prompt is tokenized once and user prompts are counted
+    count_batch_size at a time with tiktoken's batched encoder, so only one batch of
+    tasks is in memory.
+    """
+
+    def __init__(
+        self,
+        batch_path: Path,
+        endpoint: str,
+        system_prompt: str,
+        *,
+        model: str = "gpt-4.1-nano",
+        temperature: float = 0.2,
+        max_tokens: int = 500,
+        response_format: dict | None = None,
+        file_prefix: str = "batchfile",
+        max_file_tokens: int = BATCH_FILE_TOKEN_LIMIT,
+        max_file_requests: int = BATCH_FILE_REQUEST_LIMIT,
+        max_file_bytes: int = BATCH_FILE_BYTE_LIMIT,
+        count_batch_size: int = 1000,
+        count_tokens: Callable[[list[str]], list[int]] | None = None,
+        task_filter: Callable[[dict], bool] | None = None,
+    ):
+        """
+        Args:
+            batch_path: Folder the batch files are written to
+            endpoint: Batch endpoint of every task
+            system_prompt: System message shared by all tasks
+            model: Model of every task, also selects the tokenizer and prices
+            temperature: Sampling temperature
+            max_tokens: Max response tokens, counted against max_file_tokens
+            response_format: Optional response_format of every task body
+            file_prefix: Files are named <file_prefix>_<n>.jsonl
+            max_file_tokens: Max prompt plus response tokens per file
+            max_file_requests: Max tasks per file
+            max_file_bytes: Max size per file
+            count_batch_size: User prompts tokenized at a time
+            count_tokens: Batch token counter. Defaults to the model's tiktoken encoding.
+            task_filter: Tasks it returns False for are skipped, e.g.
+                BatchManager.result_cache_session's is_miss
+        """
+        self.batch_path = batch_path
+        self.endpoint = endpoint
+        self.model = model
+        self.max_tokens = max_tokens
+        self.file_prefix = file_prefix
+        self.max_file_tokens = max_file_tokens
+        self.max_file_requests = max_file_requests
+        self.max_file_bytes = max_file_bytes
+        self.count_batch_size = count_batch_size
+        self.task_filter = task_filter
+        self.count_tokens = count_tokens or get_model_token_counter(model)
+
+        self.body = {
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if response_format:
+            self.body["response_format"] = response_format
+        self.system_message = {"role": "system", "content": system_prompt}
+        # Everything but the user prompt is the same for every task
+        self.fixed_prompt_tokens = (
+            self.count_tokens([system_prompt])[0]
+            + 2 * MESSAGE_OVERHEAD_TOKENS
+            + REPLY_PRIMING_TOKENS
+        )
+
+        self.files: list[BatchFileStats] = []
+        self._file = None
+        self._current: BatchFileStats | None = None
+
+    def _task(self, custom_id: str, prompt: str) -> dict:
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": self.endpoint,
+            "body": {
+                **self.body,
+                "messages": [self.system_message, {"role": "user", "content": prompt}],
+            },
+        }
+
+    def _fits(self, line: bytes, tokens: int) -> bool:
+        current = self._current
+        return (
+            current.tokens + tokens <= self.max_file_tokens
+            and current.requests < self.max_file_requests
+            and current.bytes + len(line) <= self.max_file_bytes
+        )
+
+    def _close_file(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        prices = BATCH_PRICES.get(self.model)
+        if prices:
+            self._current.input_cost = self._current.input_tokens * prices[0] / 1e6
+            self._current.max_output_cost = (
+                self._current.max_output_tokens * prices[1] / 1e6
+            )
+        print(self._current.report())
+        self._file, self._current = None, None
+
+    def _open_file(self) -> None:
+        path = self.batch_path / f"{self.file_prefix}_{len(self.files)}.jsonl"
+        self._current = BatchFileStats(path=str(path))
+        self.files.append(self._current)
+        self._file = open(path, "wb")
+
+    def _write(self, line: bytes, input_tokens: int) -> None:
+        if len(line) > self.max_file_bytes:
+            raise ValueError(
+                f"A single task is {len(line)} bytes, over the {self.max_file_bytes} byte file limit"
+            )
+        tokens = input_tokens + self.max_tokens
+        if (
+            self._current is not None
+            and self._current.requests
+            and not self._fits(line, tokens)
+        ):
+            self._close_file()
+        if self._current is None:
+            self._open_file()
+        self._file.write(line)
+        self._current.requests += 1
+        self._current.bytes += len(line)
+        self._current.input_tokens += input_tokens
+        self._current.max_output_tokens += self.max_tokens
+
+    def add_many(self, items: Iterable[dict[str, str]]) -> None:
+        """Write {"id": ..., "prompt": ...} items as tasks, in order."""
+        for chunk in batched(items, self.count_batch_size):
+            tasks = [self._task(item["id"], item["prompt"]) for item in chunk]
+            if self.task_filter:
+                tasks = [task for task in tasks if self.task_filter(task)]
+            if not tasks:
+                continue
+            counts = self.count_tokens(
+                [task["body"]["messages"][1]["content"] for task in tasks]
+            )
+            for task, count in zip(tasks, counts):
+                self._write(
+                    (json.dumps(task) + "\n").encode(), self.fixed_prompt_tokens + count
+                )
+
+    def close(self) -> list[BatchFileStats]:
+        """Close the last file and print the totals. Returns the stats of every file."""
+        self._close_file()
+        if self.files:
+            input_costs = [file.input_cost for file in self.files]
+            total = (
+                f", ${sum(input_costs):.2f} input + up to "
+                f"${sum(file.max_output_cost for file in self.files):.2f} output"
+                if None not in input_costs
+                else ""
+            )
+            print(
+                f"Wrote {sum(file.requests for file in self.files)} tasks to "
+                f"{len(self.files)} batch files{total}"
+            )
+        return self.files
+
+    def __enter__(self) -> "BatchFileBuilder":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
@@ -2,10 +2,12 @@ import os
 import json
 import time
 import shutil
-from typing import Any, Literal
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Literal
 from pathlib import Path
 from pydantic import BaseModel
 from openai import OpenAI
+from load.batch_result_cache import BatchResultCache
 
 # noinspection PyProtectedMember
 from openai.lib._parsing._completions import type_to_response_format_param
@@ -13,6 +15,9 @@ from openai.lib._parsing._completions import type_to_response_format_param
 # Define ValidEndpoints type
 ValidEndpoints = Literal["/v1/chat/completions", "/v1/embeddings", "/v1/completions"]
 
+# Result files are downloaded and copied in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class BatchManager:
     """
@@ -24,6 +29,11 @@ class BatchManager:
     Step 2, Start the batch job: self.create_batch_job()
     Step 3: Wait until the batch job is completed.
     Step 4, Get results: self.check_batch_and_get_results() or self.get_content_if_ready()
+
+    For many batch files (create_capped_batchfiles) use load.batch_orchestrator.BatchOrchestrator.
+
+    With a result_cache, only requests without a cached result are written to batch files and
+    the cached results are merged into the results file when the fresh ones arrive.
     """
 
     def __init__(
@@ -32,6 +42,7 @@ class BatchManager:
         endpoint: ValidEndpoints = "/v1/chat/completions",
         batch_name: str = "batch",
         schema: type[BaseModel] | None = None,
+        result_cache: BatchResultCache | None = None,
     ):
         """
         Initialize the BatchManager with OpenAI client and a base path for file operations.
@@ -39,6 +50,7 @@ class BatchManager:
         Args:
             base_path: Directory path to use for storing batch files and results
             endpoint: API endpoint to use for the batch (must be one of '/v1/chat/completions', '/v1/embeddings', '/v1/completions')
+            result_cache: Results of earlier runs to reuse instead of resubmitting
         """
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
@@ -52,10 +64,14 @@ class BatchManager:
 
         self.batch_path = batch_path
         self.file_name = batch_path / "batchfile.jsonl"
-        self.output_file_name = batch_path / "batch_results.json"
+        # One result per line, read back with iter_results()
+        self.output_file_name = batch_path / "batch_results.jsonl"
+        # Written by older versions as one JSON array
+        self.legacy_output_file_name = batch_path / "batch_results.json"
         self.status_file_name = batch_path / "batch_status.json"
         self.endpoint: ValidEndpoints = endpoint
         self.schema = schema
+        self.result_cache = result_cache
 
         # Load batch_id from status file if it exists
         if self.status_file_name.exists():
@@ -129,6 +145,18 @@ class BatchManager:
             task["body"]["response_format"] = type_to_response_format_param(schema)  # type: ignore
         return task
 
+    @contextmanager
+    def result_cache_session(self) -> Iterator[Callable[[dict], bool]]:
+        """
+        Yields is_miss(task) for filtering tasks while building batch files, see
+        BatchResultCache.session. Every task is a miss without a result_cache.
+        """
+        if self.result_cache is None:
+            yield lambda task: True
+            return
+        with self.result_cache.session(self.batch_path) as is_miss:
+            yield is_miss
+
     def create_batch_tasks_to_batchfile(
         self,
         items: list[dict[str, str]],
@@ -139,10 +167,11 @@ class BatchManager:
         max_tokens: int = 5000,
     ) -> list[dict]:
         """
-        Create a list of batch tasks from item dictionaries.
+        Create a list of batch tasks from item dictionaries and write those without a
+        cached result to the batch file.
 
         Returns:
-            List of task dictionaries ready for batch processing
+            List of task dictionaries written to the batch file
         """
         tasks = [
             self.create_batch_task(
@@ -157,6 +186,9 @@ class BatchManager:
             for item in items
         ]
 
+        with self.result_cache_session() as is_miss:
+            tasks = [task for task in tasks if is_miss(task)]
+
         with open(self.file_name, "w") as file:
             for task in tasks:
                 file.write(json.dumps(task) + "\n")
@@ -178,8 +210,15 @@ class BatchManager:
         Create a batch job using a JSONL file.
 
         Returns:
-            Batch job object
+            Batch job object, or None if every result was cached
         """
+        if self.file_name.stat().st_size == 0:
+            # Nothing to submit, the results file is made of cached results only
+            self.output_file_name.write_text("")
+            self._merge_cached_results()
+            print("All results are cached, no batch job created")
+            return None
+
         # Upload the file
         batch_file = self.client.files.create(
             file=open(self.file_name, "rb"), purpose="batch"
@@ -236,11 +275,10 @@ class BatchManager:
         # If job completed, fetch and save results
         if batch_job.status == "completed":
             try:
-                results = self._get_results(batch_job)
+                self._get_results(batch_job)
                 return {
                     "status": "completed",
                     "batch_id": batch_id,
-                    "results": results,
                     "output_file": str(self.output_file_name),
                 }
             except Exception as e:
@@ -264,20 +302,18 @@ class BatchManager:
             }
 
     def get_content_if_ready(self) -> dict[str, str]:
-        # If results file exists, load and return its contents
-        if self.output_file_name.exists():
-            with open(self.output_file_name, "r") as f:
-                results = json.load(f)
-            return self._map_custom_id_to_content(results)
+        # If results file exists, return its contents
+        if self.has_results():
+            return self._map_custom_id_to_content(self.iter_results())
         # Otherwise, check status and fetch from API if completed
         batch_job = self._get_batch_status()
         if batch_job.status == "completed":
-            results = self._get_results(batch_job)
-            return self._map_custom_id_to_content(results)
+            self._get_results(batch_job)
+            return self._map_custom_id_to_content(self.iter_results())
         print(f"**Batch job status: {batch_job.status}")
         raise ValueError("Batch job is not completed")
 
-    def _map_custom_id_to_content(self, results: list[dict]) -> dict[str, str]:
+    def _map_custom_id_to_content(self, results: Iterator[dict]) -> dict[str, str]:
         """
         Map a list of result dicts to a {custom_id: content} dictionary.
         """
@@ -288,31 +324,81 @@ class BatchManager:
             for item in results
         }
 
-    def _get_results(self, batch_job: Any) -> list[dict[str, Any]]:
+    def _get_results(self, batch_job: Any) -> Path:
         """
-        Retrieve and parse results from a completed batch job.
+        Stream the output file of a completed batch job to output_file_name (JSONL) in
+        DOWNLOAD_CHUNK_SIZE chunks, so the whole file is never held in memory.
 
         Args:
             batch_job: Completed batch job object
 
         Returns:
-            List of result dictionaries
+            Path of the results file
         """
-        # Get the result file content
-        result_file_id = batch_job.output_file_id
-        result_content = self.client.files.content(result_file_id).content
+        with self.client.files.with_streaming_response.content(
+            batch_job.output_file_id
+        ) as response:
+            response.stream_to_file(
+                self.output_file_name, chunk_size=DOWNLOAD_CHUNK_SIZE
+            )
+        print(f"Downloaded batch results to {self.output_file_name}")
+        self._merge_cached_results()
+        return self.output_file_name
 
-        # Parse the results
-        results = []
-        for line in result_content.decode("utf-8").strip().split("\n"):
-            if line:
-                results.append(json.loads(line))
+    def _merge_cached_results(self) -> None:
+        """
+        Cache the fresh results in output_file_name, then append the cached results of
+        the requests that were not submitted.
+        """
+        if self.result_cache is None:
+            return
+        stored = self.result_cache.store_results(self.output_file_name, self.batch_path)
+        merged = self.result_cache.merge_cached_results(
+            self.output_file_name, self.batch_path
+        )
+        print(f"Cached {stored} fresh results, merged {merged} cached results")
 
-        # Save as JSON file
-        with open(self.output_file_name, "w") as file:
-            json.dump(results, file, indent=2)
+    def has_results(self) -> bool:
+        return self.output_file_name.exists() or self.legacy_output_file_name.exists()
 
-        return results
+    def iter_results(self) -> Iterator[dict[str, Any]]:
+        """
+        Parse the results file one line at a time. Falls back to the JSON array written
+        by older versions, which has to be loaded whole.
+        """
+        if self.output_file_name.exists():
+            with open(self.output_file_name) as file:
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+        elif self.legacy_output_file_name.exists():
+            with open(self.legacy_output_file_name) as file:
+                yield from json.load(file)
+        else:
+            raise FileNotFoundError(
+                f"Results file not found at {self.output_file_name}"
+            )
+
+    def merge_result_files(self, result_files: list[Path]) -> None:
+        """
+        Combine JSONL result files (one per batch job) into output_file_name. When a
+        custom_id is in several files (retry batches) the result from the last file wins.
+        Files are read line by line and only the custom_ids are kept in memory.
+        """
+        seen = set()
+        with open(self.output_file_name, "w") as outfile:
+            for result_file in reversed(result_files):
+                with open(result_file) as infile:
+                    for line in infile:
+                        if not line.strip():
+                            continue
+                        custom_id = json.loads(line)["custom_id"]
+                        if custom_id in seen:
+                            continue
+                        seen.add(custom_id)
+                        outfile.write(line.rstrip("\n") + "\n")
+        print(f"Merged {len(result_files)} result files into {self.output_file_name}")
+        self._merge_cached_results()
 
     def get_batchfile(self) -> tuple[list[dict], list[list[dict]]]:
         # Check if batch file exists
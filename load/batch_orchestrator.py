@@ -0,0 +1,299 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Iterable
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+from load.batch_file_builder import count_batch_file_tokens
+from load.batch_manager import DOWNLOAD_CHUNK_SIZE, BatchManager
+from load.batch_retry import collect_retry_reasons, write_retry_files
+from util.async_runner import run_sync
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchFileState(BaseModel):
+    """Progress of one batch file, persisted in the manifest."""
+
+    batch_file: str
+    # Size and mtime of the batch file, a rewritten file starts over
+    fingerprint: str
+    tokens: int
+    input_file_id: str | None = None
+    batch_id: str | None = None
+    # "pending" until submitted, then the OpenAI batch status, "downloaded" when done
+    status: str = "pending"
+    output_file_id: str | None = None
+    error_file_id: str | None = None
+    result_file: str | None = None
+    # Requests that errored or expired, from the batch's error file
+    error_file: str | None = None
+    error: str | None = None
+
+
+class BatchManifest:
+    """
+    batch_manifest.json in the batch folder, one BatchFileState per batch file.
+    It is rewritten atomically after every change, so a restarted run resumes from it.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: dict[str, BatchFileState] = {}
+        if path.exists():
+            with open(path) as f:
+                self.entries = {
+                    name: BatchFileState(**state)
+                    for name, state in json.load(f).items()
+                }
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {name: state.model_dump() for name, state in self.entries.items()},
+                f,
+                indent=2,
+            )
+        tmp_path.replace(self.path)
+
+
+def get_fingerprint(batch_file: Path) -> str:
+    stat = batch_file.stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+class BatchOrchestrator:
+    """
+    Runs many batch files (e.g. from SyntheticDataLoader.create_capped_batchfiles) as
+    concurrent Batch API jobs.
+
+    Files are submitted as soon as the tokens of all unfinished jobs (count_batch_file_tokens)
+    stay within the organization's enqueued token limit for the model. Each job is polled with
+    exponential backoff and its output is downloaded to batch_results_<file>.jsonl as soon
+    as it completes (or expires, keeping the finished part). Progress is kept in
+    batch_manifest.json, so rerunning after a crash resumes polling submitted jobs instead
+    of resubmitting them. Jobs rejected for exceeding the enqueued token limit go back to
+    pending and are resubmitted later, other failed or cancelled jobs on the next run.
+
+    Errored, expired, truncated and unparseable items are then resubmitted in retry
+    batches (see load.batch_retry) until all succeed, a round fixes nothing or max_retries
+    rounds ran. Later results replace earlier ones when they are merged.
+    """
+
+    def __init__(
+        self,
+        batch_manager: BatchManager,
+        *,
+        enqueued_token_limit: int = 20_000_000,
+        poll_interval: float = 30,
+        max_poll_interval: float = 600,
+        client_factory: Callable[[], AsyncOpenAI] | None = None,
+        count_tokens: Callable[[Path], int] = count_batch_file_tokens,
+        max_retries: int = 2,
+        retry_max_tokens_multiplier: float = 2,
+        retry_max_tokens_limit: int = 8000,
+    ):
+        """
+        Args:
+            batch_manager: Supplies the batch folder, endpoint and output file name
+            enqueued_token_limit: Max tokens enqueued at once (org limit per model)
+            poll_interval: First wait between status checks, in seconds
+            max_poll_interval: Backoff cap, in seconds
+            client_factory: Creates the AsyncOpenAI client
+            count_tokens: Token count of a batch file, stored in the manifest
+            max_retries: Max retry rounds for failed items
+            retry_max_tokens_multiplier: max_tokens factor for items cut off at max_tokens
+            retry_max_tokens_limit: Upper bound for the increased max_tokens
+        """
+        self.batch_manager = batch_manager
+        self.enqueued_token_limit = enqueued_token_limit
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.client_factory = client_factory or (
+            lambda: AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        )
+        self.count_tokens = count_tokens
+        self.max_retries = max_retries
+        self.retry_max_tokens_multiplier = retry_max_tokens_multiplier
+        self.retry_max_tokens_limit = retry_max_tokens_limit
+        self.manifest = BatchManifest(batch_manager.batch_path / "batch_manifest.json")
+        self._capacity: asyncio.Condition | None = None
+        self._client: AsyncOpenAI | None = None
+
+    def _enqueued_tokens(self) -> int:
+        return sum(
+            state.tokens
+            for state in self.manifest.entries.values()
+            if state.batch_id and state.status not in TERMINAL_STATUSES | {"downloaded"}
+        )
+
+    def _has_capacity(self, state: BatchFileState) -> bool:
+        enqueued = self._enqueued_tokens()
+        # A file over the limit on its own is still submitted once nothing else is queued
+        return enqueued == 0 or enqueued + state.tokens <= self.enqueued_token_limit
+
+    async def _release_capacity(self) -> None:
+        async with self._capacity:
+            self._capacity.notify_all()
+
+    async def _submit(self, state: BatchFileState) -> None:
+        # Uploads don't count against the enqueued token limit, so they run concurrently
+        if state.input_file_id is None:
+            with open(state.batch_file, "rb") as f:
+                uploaded = await self._client.files.create(file=f, purpose="batch")
+            state.input_file_id = uploaded.id
+            self.manifest.save()
+        async with self._capacity:
+            await self._capacity.wait_for(lambda: self._has_capacity(state))
+            batch = await self._client.batches.create(
+                input_file_id=state.input_file_id,
+                endpoint=self.batch_manager.endpoint,
+                completion_window="24h",
+            )
+            state.batch_id, state.status, state.error = batch.id, batch.status, None
+            self.manifest.save()
+        print(
+            f"Submitted {Path(state.batch_file).name} ({state.tokens} tokens): {batch.id}"
+        )
+
+    async def _poll(self, state: BatchFileState) -> Any:
+        interval = self.poll_interval
+        while True:
+            batch = await self._client.batches.retrieve(state.batch_id)
+            if batch.status != state.status:
+                state.status = batch.status
+                self.manifest.save()
+                print(f"{Path(state.batch_file).name}: {batch.status}")
+            if batch.status in TERMINAL_STATUSES:
+                return batch
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+
+    async def _download_file(self, file_id: str, path: Path) -> None:
+        async with self._client.files.with_streaming_response.content(
+            file_id
+        ) as response:
+            await response.stream_to_file(path, chunk_size=DOWNLOAD_CHUNK_SIZE)
+
+    async def _download(self, state: BatchFileState, batch: Any) -> None:
+        state.output_file_id = batch.output_file_id
+        state.error_file_id = batch.error_file_id
+        stem = Path(state.batch_file).stem
+        result_file = self.batch_manager.batch_path / f"batch_results_{stem}.jsonl"
+        if batch.output_file_id:
+            await self._download_file(batch.output_file_id, result_file)
+        else:
+            result_file.touch()
+        state.result_file = str(result_file)
+        if batch.error_file_id:
+            error_file = self.batch_manager.batch_path / f"batch_errors_{stem}.jsonl"
+            await self._download_file(batch.error_file_id, error_file)
+            state.error_file = str(error_file)
+        state.status = "downloaded"
+        self.manifest.save()
+
+    @staticmethod
+    def _is_token_limit_error(batch: Any) -> bool:
+        errors = getattr(getattr(batch, "errors", None), "data", None) or []
+        return any(error.code == "token_limit_exceeded" for error in errors)
+
+    async def _run_file(self, state: BatchFileState) -> None:
+        while state.status != "downloaded":
+            if state.batch_id is None:
+                await self._submit(state)
+            batch = await self._poll(state)
+            await self._release_capacity()
+            if batch.status in ("completed", "expired"):
+                # Requests an expired batch did not finish are in its error file
+                await self._download(state, batch)
+            elif batch.status == "failed" and self._is_token_limit_error(batch):
+                # Rejected because too much was enqueued, try again when there is room
+                state.batch_id, state.status = None, "pending"
+                self.manifest.save()
+            else:
+                state.error = f"Batch {batch.status}: {batch.errors}"
+                self.manifest.save()
+                print(f"{Path(state.batch_file).name}: {state.error}")
+                return
+
+    async def _run_round(self, batch_files: Iterable[Path | str]) -> list[Path]:
+        """Run batch files to completion. Returns their result and error files."""
+        states = []
+        for batch_file in batch_files:
+            batch_file = Path(batch_file)
+            fingerprint = get_fingerprint(batch_file)
+            state = self.manifest.entries.get(batch_file.name)
+            if state is None or state.fingerprint != fingerprint:
+                state = BatchFileState(
+                    batch_file=str(batch_file),
+                    fingerprint=fingerprint,
+                    tokens=self.count_tokens(batch_file),
+                )
+                self.manifest.entries[batch_file.name] = state
+            elif state.error:
+                # Failed or cancelled in an earlier run, the uploaded file is reused
+                print(f"Resubmitting {batch_file.name} after: {state.error}")
+                state.batch_id, state.status, state.error = None, "pending", None
+            states.append(state)
+        self.manifest.save()
+
+        await asyncio.gather(*(self._run_file(state) for state in states))
+        failed = [Path(state.batch_file).name for state in states if state.error]
+        if failed:
+            print(f"Batch files without results: {failed}")
+        return [
+            Path(path)
+            for state in states
+            for path in (state.result_file, state.error_file)
+            if path
+        ]
+
+    async def arun(self, batch_files: Iterable[Path | str]) -> list[Path]:
+        """
+        Run all batch files to completion, then retry failed items. Returns the result
+        and error files of every round in order, later ones superseding earlier ones.
+        """
+        self._client = self.client_factory()
+        self._capacity = asyncio.Condition()
+        round_files = [Path(batch_file) for batch_file in batch_files]
+        round_results = await self._run_round(round_files)
+        result_files = list(round_results)
+
+        previous_failures = None
+        for retry_round in range(1, self.max_retries + 1):
+            reasons = collect_retry_reasons(round_results)
+            if not reasons:
+                break
+            if previous_failures is not None and len(reasons) >= previous_failures:
+                print(f"Retry round {retry_round - 1} fixed nothing, stopping retries")
+                break
+            previous_failures = len(reasons)
+            round_files = write_retry_files(
+                round_files,
+                reasons,
+                self.batch_manager.batch_path,
+                retry_round,
+                self.retry_max_tokens_multiplier,
+                self.retry_max_tokens_limit,
+            )
+            round_results = await self._run_round(round_files)
+            result_files.extend(round_results)
+
+        unresolved = collect_retry_reasons(round_results)
+        if unresolved:
+            print(
+                f"{len(unresolved)} items still failed after retries, "
+                f"e.g. {list(unresolved.items())[:5]}"
+            )
+        return result_files
+
+    def run(self, batch_files: Iterable[Path | str]) -> list[Path]:
+        """
+        Run all batch files to completion, retry failed items and merge the results into
+        the batch manager's output file.
+        """
+        result_files = run_sync(self.arun(batch_files))
+        self.batch_manager.merge_result_files(result_files)
+        return result_files
@@ -0,0 +1,122 @@
+import json
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator
+from load.batch_retry import get_retry_reason
+from itertools import batched
+from util.parquet_cache import ParquetCache, hash_text
+
+# Written to the batch folder when batch files are built, read when results are merged
+CACHED_RESULTS_FILE = "cached_results.jsonl"
+REQUEST_KEYS_FILE = "request_keys.jsonl"
+# Results read from or written to the cache at a time, each write is one new shard
+CACHE_CHUNK_SIZE = 10_000
+
+
+def request_key(task: dict) -> str:
+    """Hash of everything that determines a batch result: custom_id, endpoint and body."""
+    return hash_text(
+        json.dumps(
+            {"custom_id": task["custom_id"], "url": task["url"], "body": task["body"]},
+            sort_keys=True,
+        )
+    )
+
+
+def is_reusable_result(item: dict) -> bool:
+    """Only complete, successful responses are cached, failures are worth retrying."""
+    return get_retry_reason(item) is None
+
+
+class BatchResultCache:
+    """
+    Batch API results from earlier runs keyed by request_key, so rebuilding batch files
+    only submits requests whose custom_id, model, prompt or schema changed.
+
+    Building batch files runs in a session(): cached results are written to
+    cached_results.jsonl in the batch folder and only misses are submitted, with their
+    keys in request_keys.jsonl. When the fresh results arrive, store_results() caches
+    them and merge_cached_results() appends the cached ones, so the results file holds
+    every request.
+
+    Only the keys are kept in memory, results are read from and appended to the cache
+    in chunks of CACHE_CHUNK_SIZE.
+    """
+
+    def __init__(self, path: Path):
+        self.cache = ParquetCache(path, load_values=False)
+
+    @contextmanager
+    def session(self, batch_path: Path) -> Iterator[Callable[[dict], bool]]:
+        """
+        Yields is_miss(task), which returns True for tasks that have to be submitted
+        and records cached results for the others.
+        """
+        hit_keys: list[str] = []
+        misses = 0
+        with open(batch_path / REQUEST_KEYS_FILE, "w") as keys_file:
+
+            def is_miss(task: dict) -> bool:
+                nonlocal misses
+                key = request_key(task)
+                if key in self.cache:
+                    hit_keys.append(key)
+                    return False
+                misses += 1
+                keys_file.write(
+                    json.dumps({"custom_id": task["custom_id"], "key": key}) + "\n"
+                )
+                return True
+
+            yield is_miss
+
+        with open(batch_path / CACHED_RESULTS_FILE, "w") as cached_file:
+            for chunk in batched(hit_keys, CACHE_CHUNK_SIZE):
+                for result in self.cache.get_many(chunk).values():
+                    cached_file.write(result + "\n")
+        print(
+            f"Batch result cache: {len(hit_keys)}/{len(hit_keys) + misses} hits, "
+            f"{misses} requests to submit"
+        )
+
+    def store_results(self, result_file: Path, batch_path: Path) -> int:
+        """Cache the reusable results of a fresh results file. Returns how many."""
+        keys_path = batch_path / REQUEST_KEYS_FILE
+        if not keys_path.exists() or not result_file.exists():
+            return 0
+        with open(keys_path) as f:
+            keys = {entry["custom_id"]: entry["key"] for entry in map(json.loads, f)}
+        stored = 0
+        with open(result_file) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                key = keys.get(item.get("custom_id"))
+                if key and is_reusable_result(item):
+                    self.cache.set(key, line.strip())
+                    stored += 1
+                if self.cache.pending_count >= CACHE_CHUNK_SIZE:
+                    self.cache.save()
+        self.cache.save()
+        return stored
+
+    def merge_cached_results(self, output_file: Path, batch_path: Path) -> int:
+        """Append the cached results of the session to output_file. Returns how many."""
+        cached_path = batch_path / CACHED_RESULTS_FILE
+        if not cached_path.exists():
+            return 0
+        merged = 0
+        needs_newline = False
+        if output_file.exists() and output_file.stat().st_size:
+            with open(output_file, "rb") as f:
+                f.seek(-1, 2)
+                needs_newline = f.read(1) != b"\n"
+        with open(cached_path) as infile, open(output_file, "a") as outfile:
+            if needs_newline:
+                outfile.write("\n")
+            for line in infile:
+                if line.strip():
+                    outfile.write(line)
+                    merged += 1
+        return merged
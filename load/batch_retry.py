@@ -0,0 +1,113 @@
+import filecmp
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Iterable
+from load.batch_file_builder import BATCH_FILE_BYTE_LIMIT, BATCH_FILE_REQUEST_LIMIT
+
+
+def get_retry_reason(item: dict) -> str | None:
+    """
+    Why a batch result line (from an output or error file) is not usable, or None.
+
+    "error" for request errors and expired requests, "length" for responses cut off at
+    max_tokens and "unparseable" for content that is not the expected JSON object
+    (every chat batch in this repo uses a structured response_format).
+    """
+    response = item.get("response") or {}
+    if item.get("error") or response.get("status_code") != 200:
+        return "error"
+    choices = (response.get("body") or {}).get("choices")
+    if choices is None:
+        # Not a chat completion, e.g. /v1/embeddings
+        return None
+    if not choices:
+        return "error"
+    if choices[0].get("finish_reason") == "length":
+        return "length"
+    try:
+        content = json.loads(choices[0]["message"]["content"])
+    except (KeyError, TypeError, json.JSONDecodeError):
+        return "unparseable"
+    return None if isinstance(content, dict) else "unparseable"
+
+
+def collect_retry_reasons(result_files: Iterable[Path]) -> dict[str, str]:
+    """{custom_id: reason} of the unusable results in output and error files."""
+    reasons = {}
+    for result_file in result_files:
+        with open(result_file) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                reason = get_retry_reason(item)
+                if reason:
+                    reasons[item["custom_id"]] = reason
+    return reasons
+
+
+def _write_if_changed(path: Path, lines: list[str]) -> None:
+    """Leave an identical file untouched, so a resumed run finds its manifest entry."""
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        f.writelines(lines)
+    if path.exists() and filecmp.cmp(tmp_path, path, shallow=False):
+        tmp_path.unlink()
+    else:
+        tmp_path.replace(path)
+
+
+def write_retry_files(
+    batch_files: Iterable[Path],
+    reasons: dict[str, str],
+    batch_path: Path,
+    retry_round: int,
+    max_tokens_multiplier: float = 2,
+    max_tokens_limit: int = 8000,
+) -> list[Path]:
+    """
+    Write the tasks of the custom_ids in reasons, taken from the batch files they were
+    last submitted in, to retry_<round>_<n>.jsonl. Tasks cut off at max_tokens get
+    max_tokens * max_tokens_multiplier (up to max_tokens_limit).
+    """
+    lines = []
+    for batch_file in batch_files:
+        with open(batch_file) as f:
+            for line in f:
+                task = json.loads(line)
+                reason = reasons.get(task["custom_id"])
+                if reason is None:
+                    continue
+                body = task["body"]
+                if reason == "length" and "max_tokens" in body:
+                    body["max_tokens"] = min(
+                        int(body["max_tokens"] * max_tokens_multiplier),
+                        max(max_tokens_limit, body["max_tokens"]),
+                    )
+                lines.append(json.dumps(task) + "\n")
+
+    # Same per-file limits as BatchFileBuilder
+    chunks: list[list[str]] = []
+    size = 0
+    for line in lines:
+        if (
+            not chunks
+            or len(chunks[-1]) >= BATCH_FILE_REQUEST_LIMIT
+            or size + len(line.encode()) > BATCH_FILE_BYTE_LIMIT
+        ):
+            chunks.append([])
+            size = 0
+        chunks[-1].append(line)
+        size += len(line.encode())
+
+    retry_files = []
+    for i, chunk in enumerate(chunks):
+        retry_file = batch_path / f"retry_{retry_round}_{i}.jsonl"
+        _write_if_changed(retry_file, chunk)
+        retry_files.append(retry_file)
+    print(
+        f"Retry round {retry_round}: {len(lines)} tasks "
+        f"({dict(Counter(reasons.values()))}) in {len(retry_files)} files"
+    )
+    return retry_files
@@ -1,39 +1,26 @@
-import re
-from langchain_openai import OpenAIEmbeddings
+from load.base_load import BaseLoad
 from load.html.html_load import HtmlLoad
 from load.mongo.mongo_load import MongoLoad
 from load.reddit.reddit_load import RedditLoad
 from load.reddit_general.reddit_general_load import RedditGeneralLoad
 from load.youtube.youtube_load import YoutubeLoad
+from load.resources import get_cached_embedding_model
 from util.nlp import normalize_entities_and_themes
-from util.util_main import (
-    count_tokens,
-    clean_text_for_embedding,
-    collapse_blank_lines,
-    get_chunk_size,
-    to_serialized_parquet,
-)
+from util.embedding_cache import CachedEmbeddings
+from util.embedding_store import EmbeddingStore
+from util.parquet_schema import is_embedding_column, read_parquet
+from util.text_cleaning import clean_column, clean_text
+from util.token_counting import get_encoder, get_token_counter
+from util.semantic_deduplication import SemanticDeduplicationPipeline
+from util.util_main import to_serialized_parquet
 import pandas as pd
-import tiktoken
+import pyarrow.parquet as pq
 from pathlib import Path
-import json
 
 
 def clean_text_for_inference(text: str) -> str:
-    if not text or not isinstance(text, str):
-        return ""
-
-    # Remove Markdown image insertions: ![alt](url)
-    text = re.sub(r"!\[[^\]]*\]\([^\)]*\)", "", text)
-
-    # Remove entire lines containing [IMG]... image inserts
-    text = re.sub(r"^.*\[IMG\]\S*.*$\n?", "", text, flags=re.MULTILINE)
-
-    # Collapse experiments of 3+ blank lines (optionally with whitespace) into exactly 2 newlines
-    text = collapse_blank_lines(text)
-
-    text = text.strip()
-    return text
+    """Remove image inserts and extra blank lines. Use clean_column for whole columns."""
+    return clean_text(text, "inference")
 
 
 class DocumentIndex:
@@ -45,80 +32,98 @@ class DocumentIndex:
 
     this_dir = Path(__file__).parent
     document_index_path = this_dir / "document_index.parquet"
+    # Memory-mapped copies of the index's embedding columns (util.embedding_store)
+    embedding_store_path = this_dir / "embedding_store"
 
     def __init__(self):
-        self.tokenizer = tiktoken.get_encoding("cl100k_base")
-        self.embedding_model: OpenAIEmbeddings = OpenAIEmbeddings(
-            model="text-embedding-3-large"
-        )
-        self.loaders = [
-            RedditLoad(),
-            RedditGeneralLoad(),
-            MongoLoad(),
-            YoutubeLoad(),
-            HtmlLoad(),
+        self.tokenizer = get_encoder("cl100k_base")
+        # get_artifact is a classmethod, reading artifacts needs no loader instances
+        self.loaders: list[type[BaseLoad]] = [
+            RedditLoad,
+            RedditGeneralLoad,
+            MongoLoad,
+            YoutubeLoad,
+            HtmlLoad,
         ]
         self.artifacts = [loader.get_artifact() for loader in self.loaders]
         self.staging_data = pd.concat(self.artifacts, verify_integrity=True)
 
+    @property
+    def embedding_model(self) -> CachedEmbeddings:
+        return get_cached_embedding_model("text-embedding-3-large")
+
     def _generate_embeddings_for_column(
         self, df: pd.DataFrame, column_name: str
     ) -> pd.DataFrame:
         # remove markdown headers, xml/html tags, and other content that should be in
         # page_content for LLM inference but carries no semantic meaning when embedded
         clean_column_name = f"{column_name}_embedding_clean"  # should be "page_content_clean_for_embedding" instead
-        df[clean_column_name] = df[column_name].apply(clean_text_for_embedding)
+        df[clean_column_name] = clean_column(df[column_name], "embedding")
         texts = df[clean_column_name].tolist()
 
-        # Determine optimal chunk size
-        optimal_chunk_size = get_chunk_size(texts)
-        print(f"Using chunk size {optimal_chunk_size}")
-
-        embeddings = self.embedding_model.embed_documents(
-            texts, chunk_size=optimal_chunk_size
-        )
+        # The embedding scheduler packs requests by token count
+        embeddings = self.embedding_model.embed_documents(texts)
         df[f"{column_name}_embedding"] = embeddings
         return df
 
     def _clean_page_content(self, df: pd.DataFrame) -> pd.DataFrame:
         df = df.copy()
+        # Remove text that is of no use for LLM inference
+        df["page_content_dirty"] = df["page_content"]
+        df["page_content"] = clean_column(df["page_content"], "inference")
+        # Persisted in the index so later stages reuse it (TokenCounter.count_column)
+        df["token_count"] = get_token_counter().count_batch(df["page_content"])
+
         # Drop the 10 or so rows where page_content is > 4000 tokens because they have
         # wacky content that isn't worth the effort
         before_count = len(df)
-        df = df[df["page_content"].apply(lambda x: count_tokens(x) <= 4000)]
+        df = df[df["token_count"] <= 4000]
         dropped_count = before_count - len(df)
         print(f"Dropped {dropped_count} rows where page_content > 4000 tokens.")
-
-        # Remove text that is of no use for LLM inference
-        df["page_content_dirty"] = df["page_content"]
-        df["page_content"] = df["page_content"].apply(clean_text_for_inference)
-
         return df
 
-    def create(self) -> None:
+    def create(self, semantic_dedup_threshold: float | None = 0.95) -> None:
+        """
+        Args:
+            semantic_dedup_threshold: Drop cross-source docs whose page_content embeddings
+                are more similar than this (cosine). None disables semantic dedup.
+        """
         df = self._clean_page_content(self.staging_data)
-        df["token_count"] = df["page_content"].apply(count_tokens)
         df = self._generate_embeddings_for_column(df, "page_content")
-        df = normalize_entities_and_themes(df)
+        self.embedding_model.print_stats()
+        if semantic_dedup_threshold is not None:
+            df = SemanticDeduplicationPipeline("document_index").run(
+                df, threshold=semantic_dedup_threshold
+            )
+        df = normalize_entities_and_themes(
+            df, mapping_path=self.this_dir / "entity_canonical_map.parquet"
+        )
 
         # Save with columns in alphabetical order
         df = df[sorted(df.columns)]
         df = df.drop(columns=["id"])
         to_serialized_parquet(df, self.document_index_path)
+        EmbeddingStore.from_parquet(self.document_index_path, self.embedding_store_path)
 
     @classmethod
-    def get_document_index(cls) -> pd.DataFrame:
-        df = pd.read_parquet(cls.document_index_path)
-        for col in [
-            "page_content_embedding",
-            "technical_summary_embedding",
-            "primary_content_embedding",
-            "title_embedding",
-            "entities",
-            "entities_pre_normalization",
-            "themes",
-        ]:
-            df[col] = df[col].apply(
-                lambda x: json.loads(x) if isinstance(x, str) else x
-            )
-        return df
+    def get_document_index(cls, include_embeddings: bool = True) -> pd.DataFrame:
+        """
+        Entities and themes come back as lists and each embedding cell is a float32 row
+        view of its column's matrix. Pass include_embeddings=False and use
+        get_embedding_store for vectors when only some rows need them.
+        """
+        columns = None
+        if not include_embeddings:
+            columns = [
+                name
+                for name in pq.read_schema(cls.document_index_path).names
+                if not is_embedding_column(name)
+            ]
+        return read_parquet(cls.document_index_path, columns=columns)
+
+    @classmethod
+    def get_embedding_store(cls) -> EmbeddingStore:
+        """Built from the document index on first use or when the index is newer."""
+        return EmbeddingStore.open_or_build(
+            cls.document_index_path, cls.embedding_store_path
+        )
@@ -3,6 +3,7 @@ import pandas as pd
 import re
 import json
 from bs4 import BeautifulSoup
+from util.text_cleaning import clean_column
 
 
 class HtmlLoad(BaseLoad):
@@ -49,8 +50,7 @@ class HtmlLoad(BaseLoad):
         )
 
         df = self.normalize_columns(df)
-        # need to init spacy since we just created the settings_entities.json file it uses
-        self.init_spacy()
+        # The NER engine picks up the settings_entities.json we just wrote (see BaseLoad.ner)
         # Run NER to create the "entities" column
         df = self.ner(df)
         # Merge the newly created "entities" column with "settings_entity_list"
@@ -59,22 +59,8 @@ class HtmlLoad(BaseLoad):
             axis=1,
         )
 
-        # Remove <table> elements from primary_content column
-        df["primary_content"] = df["primary_content"].apply(
-            lambda text: (
-                re.sub(r'<table.*?</table>', '', text, flags=re.DOTALL)
-                if isinstance(text, str)
-                else text
-            )
-        )
-        # Remove all HTML tags from primary_content
-        df["primary_content"] = df["primary_content"].apply(
-            lambda text: (
-                re.sub(r'<.*?>', '', text, flags=re.DOTALL)
-                if isinstance(text, str)
-                else text
-            )
-        )
+        # Remove <table> elements and all other HTML tags from primary_content
+        df["primary_content"] = clean_column(df["primary_content"], "html_primary")
         df = self._generate_embeddings(df, "primary_content")
         return df
 
@@ -1,30 +1,13 @@
 # %%
+from load.batch_orchestrator import BatchOrchestrator
 from load.mongo.mongo_load import MongoLoad
 
 m_loader = MongoLoad()
-output_file = m_loader.batch_manager.output_file_name
 
-
-def merge_batch_results() -> None:
-    """Merge all batch_results_*.jsonl files into a single JSONL file."""
-    batch_files = sorted(m_loader.batch_manager.batch_path.glob("batch_results_*.jsonl"))
-
-    with open(output_file, 'w') as outfile:
-        outfile.write('[')
-        is_first = True
-        for batch_file in batch_files:
-            with open(batch_file) as infile:
-                for line in infile:
-                    if not is_first:
-                        outfile.write(',')
-                    else:
-                        is_first = False
-                    outfile.write('\n' + line.strip())
-        outfile.write('\n]')
-
-
-# %%
-merge_batch_results()
+# %% Submit every batchfile_*.jsonl, poll until done, retry failed items and merge the results.
+# Safe to rerun after a crash, batch_manifest.json keeps track of submitted jobs.
+batch_files = sorted(m_loader.batch_manager.batch_path.glob("batchfile_*.jsonl"))
+BatchOrchestrator(m_loader.batch_manager).run(batch_files)
 
 #%%
 m_loader.create_synth_data_from_batch_results()
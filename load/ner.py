@@ -0,0 +1,189 @@
+import json
+import logging
+from typing import List, Literal, Sequence
+import spacy
+from spacy.language import Language
+from load.html.html_util import get_settings_entities
+from load.resources import get_shared
+from util.parquet_cache import ParquetCache, hash_text
+
+NerModelTier = Literal["trf", "sm"]
+
+NER_MODELS: dict[NerModelTier, str] = {
+    "trf": "en_core_web_trf",
+    "sm": "en_core_web_sm",
+}
+
+# Pipeline components the ner component depends on. Tagger, parser, lemmatizer etc. are
+# removed since only doc.ents is read.
+NER_COMPONENTS = {"transformer", "tok2vec", "ner"}
+
+# Transformer batches are padded to their longest text so they are kept small
+DEFAULT_BATCH_SIZES: dict[NerModelTier, int] = {"trf": 64, "sm": 1000}
+
+NER_ENTITY_LABELS = {
+    "URL",
+    "FAC",
+    "ORG",
+    "PRODUCT",
+    "PEPWAVE_SETTINGS_ENTITY",  # Our custom entity type from user manual settings entities
+}
+
+# Bump when the entity filtering in NerEngine changes so cached entities are invalidated
+NER_CACHE_VERSION = "v1"
+
+
+def get_ruler_patterns() -> List[dict]:
+    """EntityRuler patterns for the settings entities in settings_entities.json."""
+    return [
+        {"label": "PEPWAVE_SETTINGS_ENTITY", "pattern": entity, "id": "LOWER"}
+        for entity in get_settings_entities()
+    ]
+
+
+def get_ruler_version(patterns: List[dict]) -> str:
+    return hash_text(json.dumps(patterns, sort_keys=True))[:16]
+
+
+def set_ruler_patterns(nlp: Language, patterns: List[dict]) -> None:
+    """Replace the EntityRuler patterns of a pipeline without reloading the model."""
+    ruler = nlp.get_pipe("entity_ruler")
+    ruler.clear()
+    ruler.add_patterns(patterns)
+    nlp.meta["ruler_version"] = get_ruler_version(patterns)
+
+
+def load_ner_pipeline(
+    tier: NerModelTier = "trf", patterns: List[dict] | None = None
+) -> Language:
+    """
+    Load the spaCy model of the tier with only the NER components, plus an EntityRuler
+    for the settings entities (default: get_ruler_patterns()).
+    """
+    nlp = spacy.load(NER_MODELS[tier])
+    for name in list(nlp.pipe_names):
+        if name not in NER_COMPONENTS:
+            nlp.remove_pipe(name)
+    nlp.add_pipe("entity_ruler", before="ner")
+    set_ruler_patterns(nlp, get_ruler_patterns() if patterns is None else patterns)
+    return nlp
+
+
+class NerEngine:
+    """
+    Batched entity extraction with nlp.pipe.
+
+    Texts are sorted by length before batching so each batch holds texts of similar
+    length, which cuts the padding the transformer computes on. Results are returned in
+    input order.
+
+    With a cache, entities are stored per hash of (cache version, model name and version,
+    ruler patterns version, text), so repeated loads only run spaCy on new or changed text
+    and a change of model or settings entities invalidates the entries.
+    """
+
+    def __init__(
+        self,
+        tier: NerModelTier = "trf",
+        *,
+        batch_size: int | None = None,
+        n_process: int = 1,
+        cache: ParquetCache | None = None,
+        logger: logging.Logger | None = None,
+    ):
+        """
+        Args:
+            tier: "trf" for en_core_web_trf, "sm" for the much faster en_core_web_sm
+            batch_size: Texts per nlp.pipe batch (default per tier, see DEFAULT_BATCH_SIZES)
+            n_process: Worker processes for nlp.pipe
+            cache: On-disk entity cache. No caching if None.
+            logger: Where cache stats go (default: this module's logger)
+        """
+        self.tier = tier
+        self.batch_size = batch_size or DEFAULT_BATCH_SIZES[tier]
+        self.n_process = n_process
+        self.cache = cache
+        self.logger = logger or logging.getLogger(__name__)
+        patterns = get_ruler_patterns()
+        # The spaCy pipeline is shared by all engines of the tier
+        self.nlp = get_shared(
+            ("ner_pipeline", tier), lambda: load_ner_pipeline(tier, patterns)
+        )
+        if get_ruler_version(patterns) != self.ruler_version:
+            set_ruler_patterns(self.nlp, patterns)
+        self.model_version = f"{NER_MODELS[tier]}-{self.nlp.meta.get('version')}"
+
+    @property
+    def ruler_version(self) -> str:
+        """Version of the patterns the shared pipeline's EntityRuler currently holds."""
+        return self.nlp.meta["ruler_version"]
+
+    def refresh_ruler(self) -> bool:
+        """
+        Rebuild only the EntityRuler if settings_entities.json changed since it was built.
+        Reads the file, so call it once per run rather than per text. Returns True if rebuilt.
+        """
+        patterns = get_ruler_patterns()
+        if get_ruler_version(patterns) == self.ruler_version:
+            return False
+        set_ruler_patterns(self.nlp, patterns)
+        return True
+
+    def _cache_key(self, text: str) -> str:
+        return hash_text(
+            "\n".join([NER_CACHE_VERSION, self.model_version, self.ruler_version, text])
+        )
+
+    def extract_entities(
+        self, texts: Sequence[str | None], *, save: bool = True
+    ) -> List[List[str]]:
+        """
+        Entities of each text with a label in NER_ENTITY_LABELS. Empty list for empty/NaN texts.
+
+        Args:
+            texts: Texts to run NER on
+            save: Write new cache entries to disk. Pass False for per-text calls and
+                call save_cache() afterwards, so each call does not write a new shard.
+        """
+        results: List[List[str]] = [[] for _ in texts]
+        indices = [i for i, text in enumerate(texts) if isinstance(text, str) and text]
+
+        keys: dict[int, str] = {}
+        if self.cache is not None:
+            keys = {i: self._cache_key(texts[i]) for i in indices}
+            cached = self.cache.get_many(keys.values())
+            for i in indices:
+                if keys[i] in cached:
+                    results[i] = [str(entity) for entity in cached[keys[i]]]
+            indices = [i for i in indices if keys[i] not in cached]
+            self.logger.info(
+                f"NER cache hits: {len(keys) - len(indices)}, to process: {len(indices)}"
+            )
+
+        indices.sort(key=lambda i: len(texts[i]))
+
+        docs = self.nlp.pipe(
+            (texts[i] for i in indices),
+            batch_size=self.batch_size,
+            n_process=self.n_process,
+        )
+        for i, doc in zip(indices, docs):
+            results[i] = list(
+                {
+                    ent.text
+                    for ent in doc.ents
+                    if ent.label_ in NER_ENTITY_LABELS
+                    and any(c.isalpha() for c in ent.text)
+                }
+            )
+
+        if self.cache is not None and indices:
+            self.cache.update({keys[i]: results[i] for i in indices})
+            if save:
+                self.save_cache()
+        return results
+
+    def save_cache(self) -> None:
+        """Write cache entries not yet on disk. A no-op without a cache or new entries."""
+        if self.cache is not None:
+            self.cache.save()
@@ -0,0 +1,19 @@
+# %% ########################################################################
+# One-time migration of parquet artifacts that store embeddings and entity/theme lists
+# as JSON strings to the native Arrow schema in util.parquet_schema. Also builds the
+# embedding store that vector_store and the evals read vectors from.
+
+from pathlib import Path
+from load.document_index import DocumentIndex
+from util.embedding_store import EmbeddingStore
+from util.parquet_schema import migrate_parquet_artifacts
+
+project_root = Path(__file__).parent.parent.parent
+for folder in ["load", "evals"]:
+    migrated = migrate_parquet_artifacts(project_root / folder)
+    print(f"{folder}: migrated {len(migrated)} files")
+
+if DocumentIndex.document_index_path.exists():
+    EmbeddingStore.from_parquet(
+        DocumentIndex.document_index_path, DocumentIndex.embedding_store_path
+    )
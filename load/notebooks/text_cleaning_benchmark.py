@@ -0,0 +1,37 @@
+# %% ########################################################################
+# Throughput of util.text_cleaning against the per-row re.sub functions it replaced,
+# on the full document index. tests/test_text_cleaning.py checks that both produce
+# identical output.
+
+import time
+import pandas as pd
+from load.document_index import DocumentIndex
+from tests.legacy_text_cleaning import LEGACY
+from util.text_cleaning import CleaningProfile, clean_texts
+
+df = DocumentIndex.get_document_index()
+texts = df["page_content_dirty"] if "page_content_dirty" in df else df["page_content"]
+texts = texts.tolist()
+print(f"Docs: {len(texts)}, chars: {sum(len(t) for t in texts if isinstance(t, str))}")
+
+# %%
+
+
+def bench(profile: CleaningProfile, workers: int | None) -> None:
+    start = time.perf_counter()
+    pd.Series(texts).apply(LEGACY[profile])
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    clean_texts(texts, profile, workers=workers)
+    engine_time = time.perf_counter() - start
+
+    print(
+        f"{profile:>12} workers={workers}: legacy {len(texts) / legacy_time:,.0f} docs/s, "
+        f"engine {len(texts) / engine_time:,.0f} docs/s ({legacy_time / engine_time:.1f}x)"
+    )
+
+
+for profile in LEGACY:
+    for workers in (1, None):
+        bench(profile, workers)
@@ -0,0 +1,101 @@
+import threading
+from pathlib import Path
+from typing import Any, Callable, Hashable, TypeVar
+from langchain_openai import OpenAIEmbeddings
+from load.batch_manager import BatchManager
+from load.batch_result_cache import BatchResultCache
+from util.embedding_cache import CachedEmbeddings
+from util.embedding_scheduler import EmbeddingScheduler
+from util.parquet_cache import ParquetCache
+
+T = TypeVar("T")
+
+EMBEDDING_CACHE_DIR = Path(__file__).parent / "embedding_cache"
+BATCH_RESULT_CACHE_DIR = Path(__file__).parent / "batch_result_cache"
+
+_resources: dict[Hashable, Any] = {}
+# Guards _resources and _key_locks only. Factories run under their key's lock, so a slow
+# load (e.g. a spaCy model) does not block requests for other keys.
+_lock = threading.Lock()
+_key_locks: dict[Hashable, threading.Lock] = {}
+
+
+def get_shared(key: Hashable, factory: Callable[[], T]) -> T:
+    """
+    Process-wide lazy registry for heavyweight resources (spaCy pipelines, API clients).
+    factory runs on the first request for key and every later request gets the same object,
+    so loaders that need the same resource share one instance. Concurrent requests for
+    the same key wait for one factory call, requests for other keys are not blocked.
+    """
+    with _lock:
+        if key in _resources:
+            return _resources[key]
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        with _lock:
+            if key in _resources:
+                return _resources[key]
+        resource = factory()
+        with _lock:
+            _resources[key] = resource
+        return resource
+
+
+def clear_shared() -> None:
+    """Drop all shared resources, e.g. to free a spaCy model after NER."""
+    with _lock:
+        _resources.clear()
+        _key_locks.clear()
+
+
+def get_embedding_model(model: str = "text-embedding-3-large") -> OpenAIEmbeddings:
+    return get_shared(("embeddings", model), lambda: OpenAIEmbeddings(model=model))
+
+
+def get_embedding_scheduler(
+    model: str = "text-embedding-3-large",
+) -> EmbeddingScheduler:
+    """Shared per model, so every caller draws on the same tokens-per-minute budget."""
+    return get_shared(("embedding_scheduler", model), lambda: EmbeddingScheduler(model))
+
+
+def get_embedding_cache() -> ParquetCache:
+    """One on-disk embedding cache for all loaders and the document index."""
+    return get_shared(
+        "embedding_cache",
+        lambda: ParquetCache(
+            EMBEDDING_CACHE_DIR / "embeddings.parquet", load_values=False
+        ),
+    )
+
+
+def get_cached_embedding_model(
+    model: str = "text-embedding-3-large",
+) -> CachedEmbeddings:
+    """get_embedding_scheduler behind the shared embedding cache."""
+    return get_shared(
+        ("cached_embeddings", model),
+        lambda: CachedEmbeddings(get_embedding_scheduler(model), get_embedding_cache()),
+    )
+
+
+def get_batch_result_cache() -> BatchResultCache:
+    """One on-disk Batch API result cache for all loaders."""
+    return get_shared(
+        "batch_result_cache",
+        lambda: BatchResultCache(BATCH_RESULT_CACHE_DIR / "batch_results.parquet"),
+    )
+
+
+def get_batch_manager(base_path: Path, **kwargs) -> BatchManager:
+    """
+    Shared BatchManager per base_path and BatchManager arguments, reusing results from
+    earlier runs through the shared batch result cache.
+    """
+    key = ("batch_manager", base_path.resolve(), tuple(sorted(kwargs.items())))
+    return get_shared(
+        key,
+        lambda: BatchManager(
+            base_path, result_cache=get_batch_result_cache(), **kwargs
+        ),
+    )
@@ -1,11 +1,10 @@
 from abc import ABC, abstractmethod
 from pydantic import BaseModel
 from langchain_core.documents import Document
+from typing import Iterator
 from load.batch_manager import BatchManager
+from load.batch_file_builder import BatchFileBuilder
 from openai.lib._parsing._completions import type_to_response_format_param
-from pathlib import Path
-import tiktoken
-import json
 
 
 class ModelResponse(BaseModel):
@@ -113,11 +112,14 @@ class SyntheticDataLoader(ABC):
         self, documents: list[Document], max_tokens: int = 500
     ) -> list[str]:
         """
-        Create batch files ensuring no file exceeds 18M tokens. Returns paths to created batch files.
+        Stream tasks into batchfile_<n>.jsonl files that stay under the per-file token cap
+        and the Batch API's request and size limits, printing the projected cost of each.
+        Stale batchfile_*.jsonl files from a previous run are removed first. Documents with a
+        cached result (BatchManager.result_cache) are skipped.
 
         Args:
             documents: List of documents to process
-            max_tokens: Maximum tokens for model response (default: 300)
+            max_tokens: Maximum tokens for model response (default: 500)
 
         Returns:
             List of paths to created batch files
@@ -125,88 +127,34 @@ class SyntheticDataLoader(ABC):
         if self.batch_manager is None:
             raise ValueError("batch_manager must be set before creating batch files")
 
-        # Create batch items from documents
-        batch_items = []
-        for doc in documents:
-            if not doc.id:
-                raise ValueError("Document ID is required for batch processing")
-            lead_content = doc.metadata.get("lead_content", "")
-            primary_content = doc.metadata.get("primary_content", "")
-
-            batch_items.append(
-                {
+        batch_path = self.batch_manager.batch_path
+        for stale_file in batch_path.glob("batchfile_*.jsonl"):
+            stale_file.unlink()
+
+        def batch_items() -> Iterator[dict[str, str]]:
+            for doc in documents:
+                if not doc.id:
+                    raise ValueError("Document ID is required for batch processing")
+                lead_content = doc.metadata.get("lead_content", "")
+                primary_content = doc.metadata.get("primary_content", "")
+                yield {
                     "id": doc.id,
                     "prompt": self.create_prompt(primary_content, lead_content),
                 }
-            )
-
-        if not batch_items:
-            return []
-
-        # Get system prompt
-        system_prompt = self.create_system_prompt_with_examples()
-
-        # Create tasks with full configuration
-        tasks = []
-        for item in batch_items:
-            task = {
-                "custom_id": item["id"],
-                "method": "POST",
-                "url": self.batch_manager.endpoint,
-                "body": {
-                    "model": "gpt-4.1-nano",
-                    "temperature": 0.2,
-                    "max_tokens": max_tokens,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": item["prompt"]},
-                    ],
-                    "response_format": type_to_response_format_param(ModelResponse),
-                },
-            }
-            tasks.append(task)
-
-        enc = tiktoken.get_encoding("cl100k_base")
-
-        # Split tasks into chunks that don't exceed 8M tokens
-        MAX_TOKENS = 8_000_000
-        current_chunk = []
-        current_tokens = 0
-        chunks = []
-
-        for task in tasks:
-            # Count tokens in this task
-            task_tokens = (
-                len(enc.encode(task["body"]["messages"][0]["content"]))  # System prompt
-                + len(enc.encode(task["body"]["messages"][1]["content"]))  # User prompt
-                + task["body"]["max_tokens"]  # Max response tokens
-            )
 
-            # If adding this task would exceed limit, save current chunk and start new one
-            if current_tokens + task_tokens > MAX_TOKENS:
-                if current_chunk:  # Only append if there are tasks in the chunk
-                    chunks.append(current_chunk)
-                current_chunk = [task]
-                current_tokens = task_tokens
-            else:
-                current_chunk.append(task)
-                current_tokens += task_tokens
-
-        # Add the last chunk if it has any tasks
-        if current_chunk:
-            chunks.append(current_chunk)
-
-        batch_files = []
-        batch_path = Path(self.batch_manager.file_name).parent
-
-        for i, chunk in enumerate(chunks):
-            file_path = batch_path / f"batchfile_{i}.jsonl"
-            with open(file_path, "w") as f:
-                for task in chunk:
-                    f.write(json.dumps(task) + "\n")
-            batch_files.append(str(file_path))
-
-        return batch_files
+        with self.batch_manager.result_cache_session() as is_miss, BatchFileBuilder(
+            batch_path,
+            self.batch_manager.endpoint,
+            self.create_system_prompt_with_examples(),
+            model="gpt-4.1-nano",
+            temperature=0.2,
+            max_tokens=max_tokens,
+            response_format=type_to_response_format_param(ModelResponse),  # type: ignore
+            task_filter=is_miss,
+        ) as builder:
+            builder.add_many(batch_items())
+
+        return [file.path for file in builder.files]
 
 
 class ForumSyntheticDataLoader(SyntheticDataLoader):
@@ -4,9 +4,10 @@ import pandas as pd
 from pathlib import Path
 from pinecone import Pinecone, ServerlessSpec
 from pinecone.data.index import Index
-from util.util_main import drop_embedding_columns
+from util.parquet_schema import read_parquet
 from load.document_index import DocumentIndex
-import json
+import numpy as np
+import pyarrow.parquet as pq
 
 
 class VectorStore:
@@ -33,15 +34,17 @@ class VectorStore:
         if not str(file_path).endswith(".parquet"):
             raise FileNotFoundError(f"File {file_path} is not a parquet file")
 
-        df = pd.read_parquet(file_path)
+        columns = None
+        if drop_embeddings:
+            columns = [
+                name for name in pq.read_schema(file_path).names if "embed" not in name
+            ]
+        df = read_parquet(file_path, columns=columns)
         df = df.set_index("id", drop=False, verify_integrity=True)
 
         if df.empty:
             raise ValueError(f"File {file_path} is empty")
 
-        if drop_embeddings:
-            df = drop_embedding_columns(df)
-
         return df
 
     def initialize_pinecone_index(self) -> None:
@@ -77,6 +80,7 @@ class VectorStore:
                 "page_content_dirty",
                 "token_count",
                 "entities_pre_normalization",
+                "themes_pre_normalization",
             ],
             errors="ignore",
         )
@@ -84,7 +88,7 @@ class VectorStore:
         df = df.fillna("")
         return df
 
-    def staging_to_vector_store(self) -> None:
+    def staging_to_vector_store(self, upload_chunk_size: int = 1000) -> None:
         """Upload staged documents to a new, versioned Pinecone index."""
         self.initialize_pinecone_index()
         if not self.postprocess_path.exists():
@@ -94,33 +98,38 @@ class VectorStore:
         if self.vector_store is None:
             raise ValueError("Vector store initialization failed")
 
-        df = self._parquet_to_df(self.postprocess_path)
         metadata_df = self._parquet_to_df(self.postprocess_path, drop_embeddings=True)
         metadata_df = self._clean_metadata_for_vector_store(metadata_df)
 
-        # Fill NA values in the embedding column with values from 'page_content_embedding'
-        if self.embedding_column != "page_content_embedding":
-            df[self.embedding_column] = df[self.embedding_column].fillna(
-                df["page_content_embedding"]
-            )
-
-        ids = df.index.tolist()
-        vectors = df[self.embedding_column].apply(json.loads).tolist()
+        embedding_store = DocumentIndex.get_embedding_store()
+        ids = metadata_df.index.astype(str).tolist()
         metadata_dict = metadata_df.to_dict(orient="records")
 
-        docs = []
-        for id, vector, metadata in zip(ids, vectors, metadata_dict):
-            docs.append(
+        # Vectors are read from the memory-mapped store one upload chunk at a time
+        print(f"Uploading {len(ids)}")
+        for start in range(0, len(ids), upload_chunk_size):
+            chunk_ids = ids[start : start + upload_chunk_size]
+            vectors = embedding_store.get(self.embedding_column, chunk_ids)
+            # Fill missing vectors in the embedding column with 'page_content_embedding'
+            missing = np.isnan(vectors).any(axis=1)
+            if missing.any() and self.embedding_column != "page_content_embedding":
+                fallback = embedding_store.get(
+                    "page_content_embedding", np.asarray(chunk_ids)[missing]
+                )
+                vectors[missing] = fallback
+
+            docs = [
                 {
-                    "id": str(id),
-                    "values": vector,
+                    "id": id,
+                    "values": vector.tolist(),
                     "metadata": metadata,
                 }
-            )
-
-        print(f"Uploading {len(docs)}")
-        self.vector_store.upsert(docs, batch_size=50)
-        print(f"Uploaded {len(docs)} documents to Pinecone index: {self.index_name}")
+                for id, vector, metadata in zip(
+                    chunk_ids, vectors, metadata_dict[start : start + upload_chunk_size]
+                )
+            ]
+            self.vector_store.upsert(docs, batch_size=50)
+        print(f"Uploaded {len(ids)} documents to Pinecone index: {self.index_name}")
 
     def validate_pinecone_index(self) -> None:
         """Validate that all staging IDs exist in the Pinecone index."""
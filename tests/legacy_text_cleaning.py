@@ -0,0 +1,44 @@
+"""
+The per-row re.sub functions that util.text_cleaning replaced. tests/test_text_cleaning.py
+checks the profiles against them and load/notebooks/text_cleaning_benchmark.py times them.
+"""
+
+import re
+
+
+def legacy_collapse_blank_lines(text: str) -> str:
+    return re.sub(r"((?:[ \t]*\n){3,})", "\n\n", text)
+
+
+def legacy_clean_text_for_embedding(text: str) -> str:
+    if not text or not isinstance(text, str):
+        return ""
+    text = re.sub(r"!\[[^\]]*\]\([^\)]*\)", "", text)
+    text = re.sub(r"^(?:(?!## Title: ).)#.*$", "", text, flags=re.MULTILINE)
+    text = re.sub(r"<[^>]+>", "", text)
+    text = re.sub(r"[ \t]+", " ", text)
+    text = legacy_collapse_blank_lines(text)
+    return text.strip()
+
+
+def legacy_clean_text_for_inference(text: str) -> str:
+    if not text or not isinstance(text, str):
+        return ""
+    text = re.sub(r"!\[[^\]]*\]\([^\)]*\)", "", text)
+    text = re.sub(r"^.*\[IMG\]\S*.*$\n?", "", text, flags=re.MULTILINE)
+    text = legacy_collapse_blank_lines(text)
+    return text.strip()
+
+
+def legacy_clean_html_primary(text):
+    if not isinstance(text, str):
+        return text
+    text = re.sub(r"<table.*?</table>", "", text, flags=re.DOTALL)
+    return re.sub(r"<.*?>", "", text, flags=re.DOTALL)
+
+
+LEGACY = {
+    "embedding": legacy_clean_text_for_embedding,
+    "inference": legacy_clean_text_for_inference,
+    "html_primary": legacy_clean_html_primary,
+}
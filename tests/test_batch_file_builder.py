@@ -0,0 +1,96 @@
+import json
+import pytest
+from load.batch_file_builder import (
+    MESSAGE_OVERHEAD_TOKENS,
+    REPLY_PRIMING_TOKENS,
+    BatchFileBuilder,
+    count_batch_file_tokens,
+)
+
+
+def count_words(texts):
+    return [len(text.split()) for text in texts]
+
+
+def make_builder(tmp_path, **kwargs):
+    return BatchFileBuilder(
+        tmp_path,
+        "/v1/chat/completions",
+        "one two three",
+        max_tokens=10,
+        count_tokens=count_words,
+        count_batch_size=3,
+        **kwargs,
+    )
+
+
+def items(count, words=5):
+    return [
+        {"id": f"doc-{i}", "prompt": " ".join(["word"] * words)} for i in range(count)
+    ]
+
+
+def read_tasks(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_token_cap_rolls_files(tmp_path):
+    # 3 system + 5 user + 11 overhead + 10 max_tokens = 29 tokens per task
+    with make_builder(tmp_path, max_file_tokens=60) as builder:
+        builder.add_many(items(5))
+
+    assert [file.requests for file in builder.files] == [2, 2, 1]
+    assert all(file.tokens <= 60 for file in builder.files)
+    overhead = 2 * MESSAGE_OVERHEAD_TOKENS + REPLY_PRIMING_TOKENS
+    assert builder.files[0].input_tokens == 2 * (3 + 5 + overhead)
+
+    tasks = [task for file in builder.files for task in read_tasks(file.path)]
+    assert [task["custom_id"] for task in tasks] == [f"doc-{i}" for i in range(5)]
+    assert tasks[0]["body"]["messages"][0] == {
+        "role": "system",
+        "content": "one two three",
+    }
+    assert tasks[0]["body"]["max_tokens"] == 10
+
+
+def test_request_and_byte_limits_roll_files(tmp_path):
+    with make_builder(tmp_path, max_file_requests=4) as builder:
+        builder.add_many(items(10))
+    assert [file.requests for file in builder.files] == [4, 4, 2]
+
+    # Every task has the same size
+    with open(builder.files[0].path, "rb") as f:
+        line_bytes = len(f.readline())
+    with make_builder(
+        tmp_path, file_prefix="sized", max_file_bytes=3 * line_bytes
+    ) as builder:
+        builder.add_many(items(7))
+    assert [file.requests for file in builder.files] == [3, 3, 1]
+    assert all(file.bytes <= 3 * line_bytes for file in builder.files)
+
+
+def test_projected_cost(tmp_path):
+    with make_builder(tmp_path, model="gpt-4.1-nano") as builder:
+        builder.add_many(items(2))
+    file = builder.files[0]
+    assert file.input_cost == pytest.approx(file.input_tokens * 0.05 / 1e6)
+    assert file.max_output_cost == pytest.approx(20 * 0.20 / 1e6)
+
+    with make_builder(tmp_path, model="unknown-model") as builder:
+        builder.add_many(items(1))
+    assert builder.files[0].input_cost is None
+
+
+def test_task_over_byte_limit_raises(tmp_path):
+    with pytest.raises(ValueError):
+        with make_builder(tmp_path, max_file_bytes=100) as builder:
+            builder.add_many(items(1, words=100))
+
+
+def test_file_tokens_match_count_batch_file_tokens(tmp_path):
+    with make_builder(tmp_path, max_file_tokens=60) as builder:
+        builder.add_many(items(5, words=4))
+
+    for file in builder.files:
+        assert file.tokens == count_batch_file_tokens(file.path, count_words)
@@ -0,0 +1,279 @@
+import asyncio
+import contextlib
+import json
+from types import SimpleNamespace
+import pytest
+from load.batch_manager import BatchManager
+from load.batch_orchestrator import BatchOrchestrator
+from load.batch_retry import get_retry_reason
+
+
+def make_result(custom_id, outcome="ok"):
+    if outcome == "error":
+        return {"custom_id": custom_id, "response": None, "error": {"code": "x"}}
+    content = "{not json" if outcome == "unparseable" else json.dumps({"id": custom_id})
+    return {
+        "custom_id": custom_id,
+        "response": {
+            "status_code": 200,
+            "body": {
+                "choices": [
+                    {
+                        "finish_reason": "length" if outcome == "length" else "stop",
+                        "message": {"content": content},
+                    }
+                ]
+            },
+        },
+        "error": None,
+    }
+
+
+class FakeBatchClient:
+    """
+    In-memory stand-in for the files and batches APIs of AsyncOpenAI. failures maps a
+    custom_id to the outcomes of its first attempts ("error", "length", "unparseable").
+    The first token_limit_failures batches fail with token_limit_exceeded, the next
+    batch_failures with another error.
+    """
+
+    def __init__(
+        self,
+        polls_until_done=2,
+        token_limit_failures=0,
+        failures=None,
+        batch_failures=0,
+    ):
+        self.polls_until_done = polls_until_done
+        self.token_limit_failures = token_limit_failures
+        self.batch_failures = batch_failures
+        self.failures = {key: list(value) for key, value in (failures or {}).items()}
+        self.uploads = {}
+        self.batches = SimpleNamespace(create=self._create, retrieve=self._retrieve)
+        self.files = SimpleNamespace(
+            create=self._upload,
+            with_streaming_response=SimpleNamespace(content=self._content),
+        )
+        self.jobs = {}
+        self.created = []
+        self.contents = {}
+
+    async def _upload(self, file, purpose):
+        file_id = f"file-{len(self.uploads)}"
+        self.uploads[file_id] = file.read()
+        return SimpleNamespace(id=file_id)
+
+    async def _create(self, input_file_id, endpoint, completion_window):
+        batch_id = f"batch-{len(self.created)}"
+        self.created.append(input_file_id)
+        failed = None
+        if self.token_limit_failures > 0:
+            self.token_limit_failures -= 1
+            failed = "token_limit_exceeded"
+        elif self.batch_failures > 0:
+            self.batch_failures -= 1
+            failed = "server_error"
+        self.jobs[batch_id] = {"input": input_file_id, "polls": 0, "failed": failed}
+        return SimpleNamespace(id=batch_id, status="validating")
+
+    def _complete(self, batch_id):
+        """Decide each request's outcome once, split into output and error files."""
+        output, errors = [], []
+        for line in self.uploads[self.jobs[batch_id]["input"]].decode().splitlines():
+            custom_id = json.loads(line)["custom_id"]
+            outcomes = self.failures.get(custom_id) or ["ok"]
+            result = make_result(custom_id, outcomes.pop(0))
+            (errors if result["error"] else output).append(json.dumps(result) + "\n")
+        self.contents[f"out-{batch_id}"] = "".join(output)
+        self.contents[f"err-{batch_id}"] = "".join(errors)
+        return f"out-{batch_id}", f"err-{batch_id}" if errors else None
+
+    async def _retrieve(self, batch_id):
+        job = self.jobs[batch_id]
+        job["polls"] += 1
+        errors = None
+        output_file_id = error_file_id = None
+        if job["failed"]:
+            status = "failed"
+            errors = SimpleNamespace(data=[SimpleNamespace(code=job["failed"])])
+        elif job["polls"] >= self.polls_until_done:
+            status = "completed"
+            output_file_id, error_file_id = job.setdefault(
+                "files", self._complete(batch_id)
+            )
+        else:
+            status = "in_progress"
+        return SimpleNamespace(
+            id=batch_id,
+            status=status,
+            errors=errors,
+            output_file_id=output_file_id,
+            error_file_id=error_file_id,
+        )
+
+    @contextlib.asynccontextmanager
+    async def _content(self, file_id):
+        async def stream_to_file(path, chunk_size=None):
+            with open(path, "w") as f:
+                f.write(self.contents[file_id])
+
+        yield SimpleNamespace(stream_to_file=stream_to_file)
+
+
+def write_batch_files(tmp_path, count):
+    batch_files = []
+    for i in range(count):
+        batch_file = tmp_path / f"batchfile_{i}.jsonl"
+        batch_file.write_text(
+            json.dumps(
+                {"custom_id": f"doc-{i}", "body": {"max_tokens": 500, "messages": []}}
+            )
+            + "\n"
+        )
+        batch_files.append(batch_file)
+    return batch_files
+
+
+def make_orchestrator(tmp_path, client, **kwargs):
+    batch_manager = SimpleNamespace(
+        batch_path=tmp_path, endpoint="/v1/chat/completions"
+    )
+    return BatchOrchestrator(
+        batch_manager,
+        poll_interval=0,
+        client_factory=lambda: client,
+        count_tokens=lambda batch_file: 10,
+        **kwargs,
+    )
+
+
+def test_enqueued_token_limit_gates_submission(tmp_path):
+    client = FakeBatchClient()
+    orchestrator = make_orchestrator(tmp_path, client, enqueued_token_limit=20)
+    max_enqueued = 0
+    create = client._create
+
+    async def tracking_create(**kwargs):
+        nonlocal max_enqueued
+        max_enqueued = max(max_enqueued, orchestrator._enqueued_tokens() + 10)
+        return await create(**kwargs)
+
+    client.batches.create = tracking_create
+    result_files = asyncio.run(orchestrator.arun(write_batch_files(tmp_path, 5)))
+
+    assert len(client.created) == 5
+    assert max_enqueued <= 20
+    assert [path.name for path in result_files] == [
+        f"batch_results_batchfile_{i}.jsonl" for i in range(5)
+    ]
+
+
+def test_resume_does_not_resubmit(tmp_path):
+    batch_files = write_batch_files(tmp_path, 2)
+    client = FakeBatchClient(polls_until_done=3)
+    orchestrator = make_orchestrator(tmp_path, client)
+
+    async def crash(batch_id):
+        raise ConnectionError("lost connection")
+
+    # Both files get submitted, then the run dies while polling
+    client.batches.retrieve = crash
+    with pytest.raises(ConnectionError):
+        asyncio.run(orchestrator.arun(batch_files))
+    client.batches.retrieve = client._retrieve
+
+    resumed = make_orchestrator(tmp_path, client)
+    result_files = asyncio.run(resumed.arun(batch_files))
+
+    assert len(client.created) == 2
+    assert len(result_files) == 2
+
+
+def test_token_limit_failure_is_resubmitted(tmp_path):
+    client = FakeBatchClient(token_limit_failures=1)
+    orchestrator = make_orchestrator(tmp_path, client)
+    result_files = asyncio.run(orchestrator.arun(write_batch_files(tmp_path, 1)))
+
+    assert len(client.created) == 2
+    assert len(result_files) == 1
+
+
+def test_failed_batch_is_resubmitted_on_rerun(tmp_path):
+    batch_files = write_batch_files(tmp_path, 1)
+    client = FakeBatchClient(batch_failures=1)
+    assert asyncio.run(make_orchestrator(tmp_path, client).arun(batch_files)) == []
+
+    result_files = asyncio.run(make_orchestrator(tmp_path, client).arun(batch_files))
+
+    assert len(client.created) == 2
+    assert len(client.uploads) == 1
+    assert [path.name for path in result_files] == ["batch_results_batchfile_0.jsonl"]
+
+
+def test_failed_items_are_retried(tmp_path):
+    client = FakeBatchClient(
+        failures={"doc-0": ["length"], "doc-1": ["error"], "doc-2": ["unparseable"]}
+    )
+    orchestrator = make_orchestrator(tmp_path, client)
+    result_files = asyncio.run(orchestrator.arun(write_batch_files(tmp_path, 4)))
+
+    # One retry file with the three failed items
+    assert len(client.created) == 5
+    with open(tmp_path / "retry_1_0.jsonl") as f:
+        retried = {task["custom_id"]: task for task in map(json.loads, f)}
+    assert sorted(retried) == ["doc-0", "doc-1", "doc-2"]
+    assert retried["doc-0"]["body"]["max_tokens"] == 1000
+    assert retried["doc-1"]["body"]["max_tokens"] == 500
+
+    # Retry results replace the failed ones when merged
+    batch_manager = SimpleNamespace(
+        output_file_name=tmp_path / "batch_results.jsonl",
+        _merge_cached_results=lambda: None,
+    )
+    BatchManager.merge_result_files(batch_manager, result_files)
+    with open(batch_manager.output_file_name) as f:
+        results = [json.loads(line) for line in f]
+    assert sorted(item["custom_id"] for item in results) == [
+        f"doc-{i}" for i in range(4)
+    ]
+    assert all(get_retry_reason(item) is None for item in results)
+
+
+def test_retries_stop_when_nothing_improves(tmp_path):
+    client = FakeBatchClient(failures={"doc-0": ["error"] * 10})
+    orchestrator = make_orchestrator(tmp_path, client, max_retries=5)
+    asyncio.run(orchestrator.arun(write_batch_files(tmp_path, 2)))
+
+    # The first retry round fixed nothing, so there is no second one
+    assert len(client.created) == 3
+
+
+def test_merge_result_files(tmp_path):
+    contents = [
+        '{"custom_id": "a0", "try": 1}\n{"custom_id": "b0", "try": 1}\n',
+        '{"custom_id": "a1", "try": 1}',
+        '{"custom_id": "a0", "try": 2}\n',
+    ]
+    result_files = []
+    for i, content in enumerate(contents):
+        result_file = tmp_path / f"batch_results_{i}.jsonl"
+        result_file.write_text(content)
+        result_files.append(result_file)
+    batch_manager = SimpleNamespace(
+        output_file_name=tmp_path / "batch_results.jsonl",
+        legacy_output_file_name=tmp_path / "batch_results.json",
+        result_cache=None,
+    )
+    batch_manager._merge_cached_results = lambda: BatchManager._merge_cached_results(
+        batch_manager
+    )
+
+    BatchManager.merge_result_files(batch_manager, result_files)
+
+    # The retry result of a0 in the last file wins
+    results = BatchManager.iter_results(batch_manager)
+    assert sorted((item["custom_id"], item["try"]) for item in results) == [
+        ("a0", 2),
+        ("a1", 1),
+        ("b0", 1),
+    ]
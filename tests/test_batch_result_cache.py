@@ -0,0 +1,95 @@
+import json
+from load.batch_result_cache import BatchResultCache, is_reusable_result
+
+
+def make_task(custom_id, prompt):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": "gpt-4.1-nano",
+            "messages": [{"role": "user", "content": prompt}],
+        },
+    }
+
+
+def make_result(custom_id, finish_reason="stop", status_code=200):
+    return {
+        "custom_id": custom_id,
+        "response": {
+            "status_code": status_code,
+            "body": {
+                "choices": [
+                    {
+                        "finish_reason": finish_reason,
+                        "message": {"content": json.dumps({"id": custom_id})},
+                    }
+                ]
+            },
+        },
+        "error": None,
+    }
+
+
+def run(cache, batch_path, tasks, results):
+    """Build a batch with the cache, then merge fake results for the submitted tasks."""
+    with cache.session(batch_path) as is_miss:
+        submitted = [task for task in tasks if is_miss(task)]
+    output_file = batch_path / "batch_results.jsonl"
+    with open(output_file, "w") as f:
+        for task in submitted:
+            f.write(
+                json.dumps(
+                    results.get(task["custom_id"], make_result(task["custom_id"]))
+                )
+                + "\n"
+            )
+    cache.store_results(output_file, batch_path)
+    cache.merge_cached_results(output_file, batch_path)
+    with open(output_file) as f:
+        merged = sorted(json.loads(line)["custom_id"] for line in f)
+    return [task["custom_id"] for task in submitted], merged
+
+
+def test_only_changed_requests_are_resubmitted(tmp_path):
+    cache = BatchResultCache(tmp_path / "cache.parquet")
+    tasks = [make_task(f"doc-{i}", f"prompt {i}") for i in range(4)]
+    # doc-3 was truncated, so it is not cached
+    submitted, merged = run(
+        cache, tmp_path, tasks, {"doc-3": make_result("doc-3", finish_reason="length")}
+    )
+    assert submitted == ["doc-0", "doc-1", "doc-2", "doc-3"]
+
+    tasks[1] = make_task("doc-1", "changed prompt")
+    reloaded = BatchResultCache(tmp_path / "cache.parquet")
+    submitted, merged = run(reloaded, tmp_path, tasks, {})
+
+    assert submitted == ["doc-1", "doc-3"]
+    assert merged == ["doc-0", "doc-1", "doc-2", "doc-3"]
+
+
+def test_is_reusable_result():
+    assert is_reusable_result(make_result("a"))
+    assert not is_reusable_result(make_result("a", finish_reason="length"))
+    assert not is_reusable_result(make_result("a", status_code=500))
+    unparseable = make_result("a")
+    unparseable["response"]["body"]["choices"][0]["message"]["content"] = "{oops"
+    assert not is_reusable_result(unparseable)
+    assert not is_reusable_result(
+        {"custom_id": "a", "response": None, "error": {"code": "x"}}
+    )
+
+
+def test_results_are_appended_in_chunks_and_read_lazily(tmp_path, monkeypatch):
+    monkeypatch.setattr("load.batch_result_cache.CACHE_CHUNK_SIZE", 2)
+    cache_path = tmp_path / "cache.parquet"
+    tasks = [make_task(f"doc-{i}", f"prompt {i}") for i in range(5)]
+    run(BatchResultCache(cache_path), tmp_path, tasks, {})
+    assert len(list(cache_path.glob("part-*.parquet"))) == 3
+
+    reloaded = BatchResultCache(cache_path)
+    assert reloaded.cache._entries == {}
+    submitted, merged = run(reloaded, tmp_path, tasks, {})
+    assert submitted == []
+    assert merged == [f"doc-{i}" for i in range(5)]
@@ -1,6 +1,28 @@
+import gc
+import weakref
 import pytest
-from util.nlp import TokenizedDoc
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+from util.nlp import (
+    MINHASH_MAX_HASH,
+    MINHASH_MERSENNE_PRIME,
+    DisjointSet,
+    TokenizedCorpus,
+    TokenizedDoc,
+    _get_minhash_permutations,
+    _mix64,
+    build_binary_token_matrix,
+    compute_simple_precision,
+    get_blocked_pairwise_scores,
+    get_duplicate_candidates_cosine,
+    get_simple_precision_join_pairs,
+)
 from util.deduplication_pipeline import DeduplicationPipeline
+from util.dedup_diagnostics import DedupDiagnostics
+from util.minhash_index import PersistentMinHashIndex
+from util.semantic_deduplication import SemanticDeduplicationPipeline
+from util.streaming_deduplication import StreamingDeduplicationPipeline
+import numpy as np
 import pandas as pd
 
 
@@ -61,17 +83,34 @@ def assert_ids_equal(docs: list[TokenizedDoc], expected_ids: list[str]):
     assert set(ids_list) == set(expected_ids)
 
 
-def test_filter_exact_duplicates_minhash(documents, pipeline):
+def words(start, stop):
+    return " ".join(f"kw{i}" for i in range(start, stop))
+
+
+@pytest.mark.parametrize(
+    "keep, expected",
+    [
+        ("first", ["base", "half", "other"]),
+        ("longest", ["prefixed", "half", "other"]),
+    ],
+)
+def test_filter_exact_duplicates_minhash(pipeline, keep, expected):
+    # Duplicates share >= 95% of their (shifted) bigrams and the rest <= 35%, far from
+    # the 0.8 threshold, so the result does not hinge on MinHash estimation error
+    documents = [
+        {"id": "base", "page_content": words(0, 40)},
+        {"id": "copy", "page_content": words(0, 40)},
+        {"id": "prefixed", "page_content": f"intro {words(0, 40)}"},
+        {"id": "extended", "page_content": words(0, 41)},
+        {"id": "half", "page_content": f"{words(0, 20)} {words(100, 120)}"},
+        {"id": "other", "page_content": words(200, 240)},
+    ]
     tokenized_docs = pipeline._tokenize_documents(pd.DataFrame(documents))
-    print("-" * 20)
-    for doc in tokenized_docs:
-        print(doc.tokens)
-    print("-" * 20)
 
     filtered_docs = pipeline.filter_exact_duplicates_minhash(
-        tokenized_docs, threshold=0.80, min_unique_tokens=1
+        tokenized_docs, threshold=0.80, min_unique_tokens=1, keep=keep
     )
-    assert_ids_equal(filtered_docs, ["doc_a", "doc_d", "doc_e"])
+    assert_ids_equal(filtered_docs, expected)
 
 
 def test_confirm_duplicates(documents, pipeline):
@@ -87,3 +126,406 @@ def test_confirm_duplicates(documents, pipeline):
         "doc_c_shifted",
         "doc_b_shifted_evenly",
     }
+
+
+def test_simple_precision_join_matches_pairwise(documents, pipeline):
+    tokenized_docs = pipeline._tokenize_documents(pd.DataFrame(documents))
+    for ngram in (1, 2):
+        token_sets = [set(doc.get_chunked_tokens(ngram)) for doc in tokenized_docs]
+        for threshold in (0.5, 0.8, 0.95):
+            expected = [
+                (i, j)
+                for i in range(len(tokenized_docs))
+                for j in range(i + 1, len(tokenized_docs))
+                if compute_simple_precision(
+                    tokenized_docs[i].get_chunked_tokens(ngram),
+                    tokenized_docs[j].get_chunked_tokens(ngram),
+                )
+                > threshold
+            ]
+            pairs = get_simple_precision_join_pairs(token_sets, threshold)
+            assert [(i, j) for i, j, _ in pairs] == expected
+
+
+def test_disjoint_set_groups_transitive_hits():
+    groups = DisjointSet(6)
+    groups.union(0, 2)
+    groups.union(4, 2)
+    groups.union(5, 3)
+    assert groups.groups() == [[0, 2, 4], [3, 5]]
+    assert groups.groups(min_size=1) == [[0, 2, 4], [1], [3, 5]]
+
+
+def test_diagnostics_off_never_renders_messages():
+    def fail(*args):
+        raise AssertionError("message rendered")
+
+    diagnostics = DedupDiagnostics("test", "off")
+    for channel in ("filter", "candidates", "duplicates"):
+        diagnostics.log(channel, fail, "a", "b")
+    diagnostics.close()
+    assert diagnostics.emitted == {"filter": 0, "candidates": 0, "duplicates": 0}
+
+
+def test_dropped_diagnostics_are_collected_and_flushed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+    diagnostics = DedupDiagnostics("gc-test", "debug")
+    diagnostics.log("duplicates", lambda a, b: f"pair {a} {b}", "x", "y")
+    ref = weakref.ref(diagnostics)
+
+    del diagnostics
+    gc.collect()
+
+    assert ref() is None
+    log = (tmp_path / "logs" / "dedupe-duplicates-gc-test.log").read_text()
+    assert "pair x y" in log
+
+
+def test_streaming_deduplication_across_files_and_batches(documents, tmp_path):
+    documents_dir = tmp_path / "documents"
+    documents_dir.mkdir()
+    pd.DataFrame(documents[:4]).to_parquet(documents_dir / "a.parquet")
+    pd.DataFrame(documents[4:]).to_parquet(documents_dir / "b.parquet")
+
+    pipeline = StreamingDeduplicationPipeline(
+        "test",
+        tmp_path / "work",
+        threshold=0.80,
+        min_unique_tokens=1,
+        batch_size=3,
+        num_partitions=4,
+        silent=True,
+    )
+    kept = pipeline.run(documents_dir, lock_path=tmp_path / "lock.parquet")
+    assert kept["id"].tolist() == ["doc_a", "doc_d", "doc_e"]
+    assert pd.read_parquet(tmp_path / "lock.parquet")["id"].tolist() == kept["id"].tolist()
+
+
+def test_streaming_deduplication_lock_has_unique_ids(tmp_path):
+    documents_dir = tmp_path / "documents"
+    documents_dir.mkdir()
+    short = {"id": "video_1", "page_content": "Short clip"}
+    other = {"id": "video_2", "page_content": "Another short clip"}
+    pd.DataFrame([short, other]).to_parquet(documents_dir / "a.parquet")
+    pd.DataFrame([short]).to_parquet(documents_dir / "b.parquet")
+
+    pipeline = StreamingDeduplicationPipeline(
+        "test", tmp_path / "work", min_unique_tokens=10, silent=True
+    )
+    kept = pipeline.run(documents_dir, lock_path=tmp_path / "lock.parquet")
+    assert kept["id"].tolist() == ["video_1", "video_2"]
+    # What DeduplicationLockPipeline does with the lock file
+    lock = pd.read_parquet(tmp_path / "lock.parquet")
+    assert lock.set_index("id", verify_integrity=True).index.tolist() == ["video_1", "video_2"]
+
+
+def test_semantic_deduplication_keeps_longest_cross_source():
+    df = pd.DataFrame(
+        {
+            "id": ["forum", "reddit", "reddit_a", "reddit_b", "web"],
+            "page_content": ["short answer", "longer copied answer", "a", "a", "x"],
+            "type": ["mongo", "reddit", "reddit", "reddit", "html"],
+            "page_content_embedding": [
+                [1.0, 0.0, 0.0],
+                [0.99, 0.05, 0.0],
+                # same-source duplicates are left to the lexical pipeline
+                [0.0, 1.0, 0.0],
+                [0.0, 1.0, 0.0],
+                [0.0, 0.0, 1.0],
+            ],
+        }
+    )
+    deduped = SemanticDeduplicationPipeline("test", silent=True).run(
+        df, threshold=0.95, block_size=2
+    )
+    assert deduped["id"].tolist() == ["reddit", "reddit_a", "reddit_b", "web"]
+
+
+def test_semantic_deduplication_chain_keeps_uncompared_same_source_docs():
+    # reddit_a ~ mongo ~ reddit_c, but reddit_a and reddit_c were never compared
+    angles = np.radians([0, 15, 30])
+    df = pd.DataFrame(
+        {
+            "id": ["reddit_a", "mongo", "reddit_c"],
+            "page_content": ["the longest of the three", "mid length", "short"],
+            "type": ["reddit", "mongo", "reddit"],
+            "page_content_embedding": [[np.cos(a), np.sin(a)] for a in angles],
+        }
+    )
+    pipeline = SemanticDeduplicationPipeline("test", silent=True)
+
+    deduped = pipeline.run(df, threshold=0.95)
+    assert deduped["id"].tolist() == ["reddit_a", "reddit_c"]
+
+    # With the middle doc kept, both of its direct duplicates go
+    df.loc[1, "page_content"] = "the middle doc is now the longest one"
+    deduped = pipeline.run(df, threshold=0.95)
+    assert deduped["id"].tolist() == ["mongo"]
+
+
+def test_minhash_index_persists_and_discards_on_parameter_change(tmp_path):
+    signature = np.arange(1024, dtype=np.uint64)
+    index = PersistentMinHashIndex(tmp_path, threshold=0.8, min_unique_tokens=1)
+    index.add_kept("kept", "hash_kept", signature)
+    index.add_removed("removed", "hash_removed", "kept")
+    index.save()
+
+    reloaded = PersistentMinHashIndex(tmp_path, threshold=0.8, min_unique_tokens=1)
+    assert reloaded.get_status("kept", "hash_kept") == "kept"
+    assert reloaded.get_status("removed", "hash_removed") == "removed"
+    assert reloaded.get_status("removed", "changed") is None
+    assert reloaded.query(signature) == ["kept"]
+
+    changed = [
+        {"threshold": 0.9, "min_unique_tokens": 1},
+        {"threshold": 0.8, "min_unique_tokens": 50},
+    ]
+    for params in changed:
+        assert len(PersistentMinHashIndex(tmp_path, **params)) == 0
+
+
+def test_minhash_index_reevaluates_removed_doc_when_partner_is_gone(tmp_path):
+    index = PersistentMinHashIndex(tmp_path, threshold=0.8, min_unique_tokens=1)
+    index.add_kept("kept", "hash_kept", np.arange(1024, dtype=np.uint64))
+    index.add_removed("removed", "hash_removed", "kept")
+
+    assert index.prune({"kept": "hash_kept", "removed": "hash_removed"}) == 0
+    assert index.get_status("removed", "hash_removed") == "removed"
+    # the partner changed content, so it is forgotten and the duplicate is decided again
+    assert index.prune({"kept": "hash_changed", "removed": "hash_removed"}) == 1
+    assert index.get_status("removed", "hash_removed") is None
+    assert index.query(np.arange(1024, dtype=np.uint64)) == []
+
+
+def test_minhash_index_keeps_docs_of_other_runs(tmp_path):
+    index = PersistentMinHashIndex(tmp_path, threshold=0.8, min_unique_tokens=1)
+    index.add_kept("kept", "hash_kept", np.arange(1024, dtype=np.uint64))
+    index.add_removed("removed", "hash_removed", "kept")
+
+    # a run over another frame forgets nothing
+    assert index.prune({"other": "hash_other"}) == 0
+    assert len(index) == 2
+    # a duplicate whose partner is not in the run is decided again
+    assert index.prune({"removed": "hash_removed"}) == 0
+    assert index.get_status("removed", "hash_removed") is None
+
+
+def test_filter_exact_duplicates_minhash_incremental(documents, tmp_path):
+    pipeline = DeduplicationPipeline("test", silent=True, index_dir=tmp_path)
+    df = pd.DataFrame(documents)
+    # doc_aa is an exact copy of doc_a
+    docs = pipeline._tokenize_documents(
+        df[df["id"].isin(["doc_a", "doc_aa", "doc_e"])]
+    )
+    filtered = pipeline.filter_exact_duplicates_minhash(docs, min_unique_tokens=1)
+    assert_ids_equal(filtered, ["doc_a", "doc_e"])
+
+    # a rerun keeps every decision without hashing again
+    docs = pipeline._tokenize_documents(
+        df[df["id"].isin(["doc_a", "doc_aa", "doc_e"])]
+    )
+    filtered = pipeline.filter_exact_duplicates_minhash(docs, min_unique_tokens=1)
+    assert_ids_equal(filtered, ["doc_a", "doc_e"])
+
+    # once doc_a is gone, the doc removed as its duplicate comes back
+    docs = pipeline._tokenize_documents(df[df["id"].isin(["doc_aa", "doc_e"])])
+    filtered = pipeline.filter_exact_duplicates_minhash(docs, min_unique_tokens=1)
+    assert_ids_equal(filtered, ["doc_aa", "doc_e"])
+
+
+def test_minhash_index_is_shared_by_runs_over_disjoint_frames(
+    documents, tmp_path, monkeypatch
+):
+    # e.g. WebLoad deduplicates each source file separately with one index_dir
+    pipeline = DeduplicationPipeline("test", silent=True, index_dir=tmp_path)
+    df = pd.DataFrame(documents)
+    first = df[df["id"].isin(["doc_a", "doc_aa", "doc_e"])]
+    second = df[df["id"].isin(["doc_d", "doc_like_b_not_a"])]
+    hashed = []
+    get_signatures = TokenizedCorpus.get_minhash_signatures
+
+    def recording_get_signatures(self, indices, **kwargs):
+        hashed.append(len(indices))
+        return get_signatures(self, indices, **kwargs)
+
+    monkeypatch.setattr(
+        TokenizedCorpus, "get_minhash_signatures", recording_get_signatures
+    )
+
+    for frame, expected in [
+        (first, ["doc_a", "doc_e"]),
+        (second, ["doc_d", "doc_like_b_not_a"]),
+        (first, ["doc_a", "doc_e"]),
+    ]:
+        docs = pipeline._tokenize_documents(frame)
+        filtered = pipeline.filter_exact_duplicates_minhash(docs, min_unique_tokens=1)
+        assert_ids_equal(filtered, expected)
+
+    # plain and shifted signatures per run; the rerun of the first frame hashes nothing
+    assert hashed == [3, 3, 2, 2, 0, 0]
+    assert len(PersistentMinHashIndex(tmp_path, threshold=0.98, min_unique_tokens=1)) == 5
+
+
+@pytest.fixture
+def random_corpus():
+    """Token lists over a small vocabulary, so many pairs overlap heavily."""
+    rng = np.random.default_rng(0)
+    base = [rng.choice(12, size=rng.integers(4, 10)).tolist() for _ in range(6)]
+    return [
+        [f"w{token}" for token in tokens[: len(tokens) - rng.integers(0, 3)]]
+        for tokens in base * 3
+    ]
+
+
+def test_binary_token_matrix_products_are_intersection_sizes(random_corpus):
+    token_sets = [set(tokens) for tokens in random_corpus]
+    matrix = build_binary_token_matrix(token_sets)
+
+    assert (matrix.toarray().sum(axis=1) == [len(s) for s in token_sets]).all()
+    intersections = (matrix @ matrix.T).toarray()
+    for i, set_a in enumerate(token_sets):
+        for j, set_b in enumerate(token_sets):
+            assert intersections[i, j] == len(set_a & set_b)
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 2048])
+def test_blocked_precision_matches_dense_pairwise(random_corpus, block_size):
+    token_sets = [set(tokens) for tokens in random_corpus]
+    for threshold in (0.5, 0.8, 0.95):
+        expected = [
+            (i, j)
+            for i in range(len(random_corpus))
+            for j in range(i + 1, len(random_corpus))
+            if compute_simple_precision(random_corpus[i], random_corpus[j])
+            > threshold
+        ]
+        pairs = get_blocked_pairwise_scores(
+            build_binary_token_matrix(token_sets),
+            threshold,
+            metric="precision",
+            block_size=block_size,
+        )
+        assert [(i, j) for i, j, _ in pairs] == expected
+        assert [(i, j) for i, j, _ in pairs] == [
+            (i, j) for i, j, _ in get_simple_precision_join_pairs(token_sets, threshold)
+        ]
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 2048])
+def test_blocked_cosine_matches_dense_cosine_similarity(random_corpus, block_size):
+    tfidf = TfidfVectorizer().fit_transform(" ".join(t) for t in random_corpus)
+    dense = cosine_similarity(tfidf.toarray())
+    rows, cols = np.triu_indices(len(random_corpus), k=1)
+    for threshold in (0.5, 0.8):
+        above = dense[rows, cols] > threshold
+        pairs = get_blocked_pairwise_scores(
+            tfidf, threshold, metric="dot", block_size=block_size
+        )
+        assert [(i, j) for i, j, _ in pairs] == list(
+            zip(rows[above].tolist(), cols[above].tolist())
+        )
+        assert np.allclose([score for _, _, score in pairs], dense[rows, cols][above])
+        assert get_duplicate_candidates_cosine(
+            random_corpus, threshold, block_size=block_size
+        ) == set(rows[above].tolist()) | set(cols[above].tolist())
+
+
+def test_sparse_backend_matches_index_backend(documents, pipeline):
+    tokenized_docs = pipeline._tokenize_documents(pd.DataFrame(documents))
+    for ngram in (1, 2):
+        for threshold in (0.5, 0.8):
+            candidates = {
+                backend: [
+                    (a.doc_id, b.doc_id)
+                    for a, b in pipeline.get_duplicate_candidates_simple_precision(
+                        tokenized_docs, ngram=ngram, threshold=threshold, backend=backend
+                    )
+                ]
+                for backend in ("index", "sparse")
+            }
+            assert candidates["sparse"] == candidates["index"]
+
+
+@pytest.fixture
+def token_corpus():
+    token_lists = [
+        ["a", "b", "c", "d", "e"],
+        ["x", "a", "b", "c", "d", "e"],
+        ["a", "b", "c", "d", "e"],
+        ["c", "d", "a", "b"],
+        [],
+    ]
+    return TokenizedCorpus(
+        [f"doc-{i}" for i in range(len(token_lists))],
+        [" ".join(tokens) for tokens in token_lists],
+        token_lists,
+    )
+
+
+@pytest.mark.parametrize("ngram, shift", [(1, None), (2, None), (2, 1), (3, 2)])
+def test_ngram_hashes_match_chunked_tokens(token_corpus, ngram, shift):
+    hashes, offsets = token_corpus.get_ngram_hashes(ngram, shift)
+    chunk_hashes = {}
+    for doc in token_corpus.docs():
+        chunks = doc.get_chunked_tokens(ngram, shift)
+        doc_hashes = hashes[offsets[doc.index] : offsets[doc.index + 1]].tolist()
+        assert len(doc_hashes) == len(chunks)
+        for chunk, chunk_hash in zip(chunks, doc_hashes):
+            assert chunk_hashes.setdefault(chunk, chunk_hash) == chunk_hash
+    # exact hashes: different chunks never share a hash
+    assert len(set(chunk_hashes.values())) == len(chunk_hashes)
+
+
+def test_stable_hashes_and_signatures_agree_across_corpora(token_corpus):
+    other = TokenizedCorpus(
+        ["z", "doc"], ["", ""], [["q", "e", "d"], ["a", "b", "c", "d", "e"]]
+    )
+    for ngram, shift in [(1, None), (2, None), (2, 1)]:
+        hashes, offsets = token_corpus.get_ngram_hashes(ngram, shift, stable=True)
+        other_hashes, other_offsets = other.get_ngram_hashes(ngram, shift, stable=True)
+        assert (
+            hashes[offsets[0] : offsets[1]] == other_hashes[other_offsets[1] :]
+        ).all()
+    assert (
+        token_corpus.get_minhash_signatures([0], num_perm=64)
+        == other.get_minhash_signatures([1], num_perm=64)
+    ).all()
+
+
+def test_minhash_signatures_match_reference(token_corpus):
+    num_perm = 16
+    a, b = _get_minhash_permutations(num_perm)
+    hashes, offsets = token_corpus.get_ngram_hashes(2, stable=True)
+    signatures = token_corpus.get_minhash_signatures(
+        range(len(token_corpus)), num_perm=num_perm, rows_per_step=1
+    )
+
+    for i in range(len(token_corpus)):
+        expected = [int(MINHASH_MAX_HASH)] * num_perm
+        for value in _mix64(hashes[offsets[i] : offsets[i + 1]]).tolist():
+            value &= int(MINHASH_MAX_HASH)
+            for k in range(num_perm):
+                # uint64 arithmetic wraps, as in datasketch's legacy MinHash
+                permuted = (value * int(a[k]) + int(b[k])) % 2**64
+                permuted %= int(MINHASH_MERSENNE_PRIME)
+                expected[k] = min(expected[k], permuted & int(MINHASH_MAX_HASH))
+        assert signatures[i].tolist() == expected
+
+    assert (signatures[0] == signatures[2]).all()
+    assert (signatures[4] == MINHASH_MAX_HASH).all()
+    assert (
+        token_corpus.get_minhash_signatures(range(len(token_corpus)), num_perm=num_perm)
+        == signatures
+    ).all()
+
+
+@pytest.mark.parametrize("ngram", [1, 2])
+def test_binary_ngram_matrix_matches_ngram_sets(token_corpus, ngram):
+    indices = [3, 0, 1, 4]
+    matrix = token_corpus.get_binary_ngram_matrix(indices, ngram)
+    expected = build_binary_token_matrix(token_corpus.get_ngram_sets(indices, ngram))
+
+    assert matrix.shape == expected.shape
+    assert set(np.unique(matrix.data).tolist()) <= {1}
+    assert ((matrix @ matrix.T) != (expected @ expected.T)).nnz == 0
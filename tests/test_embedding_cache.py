@@ -0,0 +1,67 @@
+import pytest
+from langchain_core.embeddings import Embeddings
+from util.embedding_cache import CachedEmbeddings
+from util.parquet_cache import ParquetCache
+
+
+class FakeEmbeddings(Embeddings):
+    """Records every batch it is asked to embed."""
+
+    def __init__(self, model="text-embedding-3-large", dimensions=None):
+        self.model = model
+        self.dimensions = dimensions
+        self.calls = []
+
+    def embed_documents(self, texts, chunk_size=None):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ParquetCache(tmp_path / "embeddings.parquet", load_values=False)
+
+
+def test_key_includes_model_and_dimensions(cache):
+    large = FakeEmbeddings()
+    CachedEmbeddings(large, cache).embed_documents(["a"])
+
+    for other in [
+        FakeEmbeddings(model="text-embedding-3-small"),
+        FakeEmbeddings(dimensions=256),
+    ]:
+        CachedEmbeddings(other, cache).embed_documents(["a"])
+        assert other.calls == [["a"]]
+
+    same = FakeEmbeddings()
+    CachedEmbeddings(same, cache).embed_documents(["a"])
+    assert same.calls == []
+    assert len(cache) == 3
+
+
+def test_duplicates_within_a_call_are_embedded_once(cache):
+    embeddings = FakeEmbeddings()
+
+    vectors = CachedEmbeddings(embeddings, cache).embed_documents(["a", "bb", "a"])
+
+    assert vectors == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert embeddings.calls == [["a", "bb"]]
+
+
+def test_hits_and_misses_are_counted_across_calls(cache, tmp_path):
+    cached = CachedEmbeddings(FakeEmbeddings(), cache)
+    cached.embed_documents(["a", "bb"])
+    cached.embed_documents(["a", "ccc"])
+    assert (cached.hits, cached.misses) == (1, 3)
+    assert cached.hit_rate() == 0.25
+
+    # a fresh process reads the vectors back from disk
+    reloaded = ParquetCache(tmp_path / "embeddings.parquet", load_values=False)
+    embeddings = FakeEmbeddings()
+    restarted = CachedEmbeddings(embeddings, reloaded)
+    assert restarted.embed_documents(["ccc", "bb"]) == [[3.0, 1.0], [2.0, 1.0]]
+    assert embeddings.calls == []
+    assert restarted.hits == 2
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from openai import AsyncOpenAI
+from util.parquet_cache import ParquetCache
+from util.embedding_cache import CachedEmbeddings
+from util.embedding_scheduler import (
+    EmbeddingScheduler,
+    PartialEmbeddingError,
+    TokenBudget,
+    embed_columns,
+    pack_requests,
+)
+
+
+def count_words(texts):
+    return [len(text.split()) for text in texts]
+
+
+@pytest.fixture
+def fake_server():
+    """Local stand-in for POST /v1/embeddings that records each request."""
+    state = {"requests": [], "in_flight": 0, "max_in_flight": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with lock:
+                state["requests"].append(body["input"])
+                state["in_flight"] += 1
+                state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            time.sleep(0.05)
+            with lock:
+                state["in_flight"] -= 1
+            if any("fail" in text for text in body["input"]):
+                self.send_response(500)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            data = [
+                {
+                    "object": "embedding",
+                    "index": i,
+                    "embedding": [float(len(text)), 1.0],
+                }
+                for i, text in enumerate(body["input"])
+            ]
+            payload = json.dumps(
+                {
+                    "object": "list",
+                    "data": data[::-1],
+                    "model": body["model"],
+                    "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["base_url"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    yield state
+    server.shutdown()
+
+
+def make_scheduler(fake_server, **kwargs) -> EmbeddingScheduler:
+    return EmbeddingScheduler(
+        client_factory=lambda: AsyncOpenAI(
+            base_url=fake_server["base_url"], api_key="test", max_retries=0
+        ),
+        count_tokens=count_words,
+        **kwargs,
+    )
+
+
+def test_pack_requests_respects_token_and_input_limits():
+    assert pack_requests([5, 5, 5, 20, 1], max_request_tokens=10, max_inputs=5) == [
+        [0, 1],
+        [2],
+        [3],
+        [4],
+    ]
+    assert pack_requests([1] * 5, max_request_tokens=100, max_inputs=2) == [
+        [0, 1],
+        [2, 3],
+        [4],
+    ]
+
+
+def test_scheduler_packs_by_tokens_and_runs_concurrently(fake_server):
+    texts = [" ".join(["word"] * 10) + f" {i}" for i in range(40)]
+    scheduler = make_scheduler(fake_server, max_request_tokens=55, max_concurrency=3)
+
+    embeddings = scheduler.embed_documents(texts)
+
+    assert embeddings == [[float(len(text)), 1.0] for text in texts]
+    assert all(sum(count_words(inputs)) <= 55 for inputs in fake_server["requests"])
+    assert len(fake_server["requests"]) == 8  # 11 tokens each, 5 per request
+    assert 1 < fake_server["max_in_flight"] <= 3
+
+
+def test_embed_columns_shares_one_scheduler(fake_server):
+    scheduler = make_scheduler(fake_server, max_concurrency=4)
+    columns = {"title": ["a b", "c"], "technical_summary": ["d e f", "", "g"]}
+
+    embeddings = embed_columns(scheduler, columns)
+
+    assert embeddings == {
+        column: [[float(len(text)), 1.0] for text in texts]
+        for column, texts in columns.items()
+    }
+
+
+def test_token_budget_waits_for_refill():
+    budget = TokenBudget(tokens_per_minute=600)  # 10 tokens per second
+
+    async def spend():
+        await budget.acquire(600)
+        start = time.perf_counter()
+        await budget.acquire(5)
+        return time.perf_counter() - start
+
+    assert asyncio.run(spend()) >= 0.4
+
+
+def test_sync_api_works_inside_a_running_event_loop(fake_server):
+    scheduler = make_scheduler(fake_server)
+
+    async def interactive_cell():
+        # e.g. a "# %%" cell in an IDE that already runs an event loop
+        return embed_columns(scheduler, {"title": ["a b"]}), scheduler.embed_query("c")
+
+    columns, query = asyncio.run(interactive_cell())
+    assert columns == {"title": [[3.0, 1.0]]}
+    assert query == [1.0, 1.0]
+
+
+def test_failed_request_keeps_and_caches_the_other_embeddings(fake_server, tmp_path):
+    scheduler = make_scheduler(fake_server, max_inputs_per_request=1)
+    cached = CachedEmbeddings(scheduler, ParquetCache(tmp_path / "cache.parquet"))
+
+    with pytest.raises(PartialEmbeddingError) as error:
+        cached.embed_documents(["a", "fail", "bb"])
+    assert error.value.embeddings == [[1.0, 1.0], None, [2.0, 1.0]]
+
+    fake_server["requests"].clear()
+    assert cached.embed_documents(["a", "bb"]) == [[1.0, 1.0], [2.0, 1.0]]
+    assert fake_server["requests"] == []
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+from rapidfuzz import distance
+from util.nlp import (
+    _min_length_ratio,
+    build_canonical_mapping,
+    normalize_entities_and_themes,
+)
+
+
+def test_mapping_clusters_by_frequency_with_shortest_canonical():
+    values = ["max transit"] * 3 + ["max transit duo"] + ["max transitt"] + ["balance"]
+
+    mapping = build_canonical_mapping(values, similarity_threshold=0.95)
+
+    assert mapping == {
+        "max transit": "max transit",
+        "max transitt": "max transit",
+        "max transit duo": "max transit duo",
+        "balance": "balance",
+    }
+
+
+def test_mapping_drops_stop_entities():
+    mapping = build_canonical_mapping(
+        ["pepwave", "pepwav", "speedfusion"], stop_entities=["pepwave"]
+    )
+    assert mapping == {"pepwave": None, "pepwav": None, "speedfusion": "speedfusion"}
+
+
+@pytest.mark.parametrize("threshold", [0.85, 0.9, 0.95])
+def test_length_ratio_bound_never_skips_a_match(threshold):
+    rng = np.random.default_rng(0)
+    min_ratio = _min_length_ratio(threshold)
+    for _ in range(2000):
+        shorter = "".join(rng.choice(list("ab"), size=rng.integers(1, 8)))
+        longer = shorter + "".join(rng.choice(list("ab"), size=rng.integers(1, 30)))
+        if len(shorter) / len(longer) < min_ratio:
+            similarity = distance.JaroWinkler.normalized_similarity(shorter, longer)
+            assert similarity < threshold
+
+
+def test_pruned_mapping_matches_brute_force():
+    rng = np.random.default_rng(1)
+    stems = ["balance", "max", "surf", "transit", "b one", "br1"]
+    values = [
+        stem + "".join(rng.choice(list("aex "), size=rng.integers(0, 3)))
+        for stem in stems
+        for _ in range(12)
+    ]
+    pruned = build_canonical_mapping(values, similarity_threshold=0.9, tile_size=3)
+    # No prefix blocks and no length pruning: every pair is scored
+    brute_force = build_canonical_mapping(
+        values, similarity_threshold=0.9, prefix_length=0, tile_size=len(values)
+    )
+    assert pruned == brute_force
+
+
+def test_normalize_entities_and_themes_keeps_originals(tmp_path):
+    df = pd.DataFrame(
+        {
+            "entities": [["Max Transit", "Pepwave"], ["max transitt"], None],
+            "themes": [["Failover"], '["failover", "failovers"]', []],
+        }
+    )
+    original = df.copy()
+
+    result = normalize_entities_and_themes(
+        df, mapping_path=tmp_path / "mapping.parquet"
+    )
+
+    assert result["entities"].tolist() == [["max transit"], ["max transit"], []]
+    assert result["themes"].tolist() == [["failover"], ["failover"], []]
+    assert (
+        result["entities_pre_normalization"].tolist() == original["entities"].tolist()
+    )
+    assert result["themes_pre_normalization"].tolist() == original["themes"].tolist()
+    assert "entities_pre_normalization" not in df.columns
+    mapping = pd.read_parquet(tmp_path / "mapping.parquet")
+    assert set(mapping["column"]) == {"entities", "themes"}
@@ -0,0 +1,142 @@
+import pytest
+import spacy
+import load.ner
+from load.ner import NerEngine
+from load.resources import clear_shared
+from util.parquet_cache import ParquetCache
+
+
+@pytest.fixture
+def settings_entities(monkeypatch):
+    entities = ["Balance 20X", "SpeedFusion"]
+    monkeypatch.setattr(load.ner, "get_settings_entities", lambda: list(entities))
+    return entities
+
+
+@pytest.fixture
+def model_loads(monkeypatch, settings_entities):
+    """Stand-in for spacy.load: a blank English pipeline with an untrained ner."""
+    loads = []
+
+    def fake_load(name):
+        loads.append(name)
+        nlp = spacy.blank("en")
+        nlp.add_pipe("ner").add_label("ORG")
+        nlp.add_pipe("sentencizer")  # removed by load_ner_pipeline
+        nlp.initialize()
+        return nlp
+
+    monkeypatch.setattr(load.ner.spacy, "load", fake_load)
+    clear_shared()
+    yield loads
+    clear_shared()
+
+
+def record_pipe(engine, monkeypatch) -> list:
+    """Record the texts and batch size of the engine's nlp.pipe calls."""
+    calls = []
+    pipe = engine.nlp.pipe
+
+    def recording_pipe(texts, **kwargs):
+        texts = list(texts)
+        # The EntityRuler also pipes its phrase patterns, without a batch size
+        if "batch_size" in kwargs:
+            calls.append((texts, kwargs["batch_size"]))
+        return pipe(texts, **kwargs)
+
+    monkeypatch.setattr(engine.nlp, "pipe", recording_pipe)
+    return calls
+
+
+def test_pipeline_keeps_only_ner_components(model_loads):
+    engine = NerEngine("sm")
+
+    assert model_loads == ["en_core_web_sm"]
+    assert engine.nlp.pipe_names == ["entity_ruler", "ner"]
+    assert engine.batch_size == 1000
+
+
+def test_engines_of_a_tier_share_one_pipeline(model_loads):
+    first = NerEngine("sm")
+    second = NerEngine("sm", batch_size=8)
+
+    assert second.nlp is first.nlp
+    assert model_loads == ["en_core_web_sm"]
+    NerEngine("trf")
+    assert model_loads == ["en_core_web_sm", "en_core_web_trf"]
+
+
+def test_extracts_in_input_order_from_length_sorted_batches(model_loads, monkeypatch):
+    engine = NerEngine("sm", batch_size=2)
+    calls = record_pipe(engine, monkeypatch)
+    texts = [
+        "Configure SpeedFusion on the Balance 20X router",
+        None,
+        "SpeedFusion",
+        "",
+        "A Balance 20X",
+    ]
+
+    results = engine.extract_entities(texts)
+
+    assert [sorted(entities) for entities in results] == [
+        ["Balance 20X", "SpeedFusion"],
+        [],
+        ["SpeedFusion"],
+        [],
+        ["Balance 20X"],
+    ]
+    assert calls == [
+        (["SpeedFusion", "A Balance 20X", texts[0]], 2),
+    ]
+
+
+def test_cache_skips_known_texts(model_loads, monkeypatch, tmp_path):
+    cache_path = tmp_path / "entities.parquet"
+    engine = NerEngine("sm", cache=ParquetCache(cache_path))
+    calls = record_pipe(engine, monkeypatch)
+
+    first = engine.extract_entities(["A Balance 20X", "SpeedFusion"])
+    engine = NerEngine("sm", cache=ParquetCache(cache_path))
+    second = engine.extract_entities(["SpeedFusion", "A Balance 20X", "No entities"])
+
+    assert second == [first[1], first[0], []]
+    assert [texts for texts, _ in calls] == [
+        ["SpeedFusion", "A Balance 20X"],
+        ["No entities"],
+    ]
+
+
+def test_cache_is_written_once_per_batch(model_loads, tmp_path):
+    cache_path = tmp_path / "entities.parquet"
+    engine = NerEngine("sm", cache=ParquetCache(cache_path))
+
+    for text in ["A Balance 20X", "SpeedFusion", "No entities"]:
+        engine.extract_entities([text], save=False)
+    assert not cache_path.exists()
+    engine.save_cache()
+    assert len(list(cache_path.glob("part-*.parquet"))) == 1
+
+    # All hits: nothing new to write
+    engine.extract_entities(["SpeedFusion", "No entities"])
+    assert len(list(cache_path.glob("part-*.parquet"))) == 1
+    assert len(ParquetCache(cache_path)) == 3
+
+
+def test_changed_settings_entities_refresh_ruler_and_cache_keys(
+    model_loads, settings_entities, monkeypatch, tmp_path
+):
+    engine = NerEngine("sm", cache=ParquetCache(tmp_path / "entities.parquet"))
+    calls = record_pipe(engine, monkeypatch)
+    assert engine.extract_entities(["MAX BR1 and SpeedFusion"]) == [["SpeedFusion"]]
+    assert not engine.refresh_ruler()
+
+    settings_entities.append("MAX BR1")
+    assert engine.refresh_ruler()
+
+    assert sorted(engine.extract_entities(["MAX BR1 and SpeedFusion"])[0]) == [
+        "MAX BR1",
+        "SpeedFusion",
+    ]
+    assert len(calls) == 2
+    assert model_loads == ["en_core_web_sm"]
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+from util.parquet_cache import ParquetCache
+
+
+@pytest.mark.parametrize("load_values", [True, False])
+def test_save_appends_a_shard_and_newest_value_wins(tmp_path, load_values):
+    path = tmp_path / "cache.parquet"
+    cache = ParquetCache(path, load_values=load_values)
+    cache.update({"a": "1", "b": "2"})
+    cache.save()
+    first_shard = next(path.glob("part-*.parquet"))
+    modified = first_shard.stat().st_mtime_ns
+
+    cache.update({"b": "3", "c": "4"})
+    cache.save()
+    cache.save()  # nothing pending
+
+    assert len(list(path.glob("part-*.parquet"))) == 2
+    assert first_shard.stat().st_mtime_ns == modified
+    reloaded = ParquetCache(path, load_values=load_values)
+    assert len(reloaded) == 3
+    assert reloaded.get_many(["a", "b", "c", "d"]) == {"a": "1", "b": "3", "c": "4"}
+    assert (reloaded.hits, reloaded.misses) == (3, 1)
+
+
+def test_lazy_cache_reads_only_matching_row_groups(tmp_path):
+    path = tmp_path / "cache.parquet"
+    cache = ParquetCache(path, load_values=False, row_group_size=10)
+    cache.update({f"{i:03d}": [float(i)] for i in range(100)})
+    cache.save()
+
+    reloaded = ParquetCache(path, load_values=False, row_group_size=10)
+    assert reloaded._entries == {}
+    assert "042" in reloaded and "100" not in reloaded
+    assert {
+        key: list(value)
+        for key, value in reloaded.get_many(["042", "007", "100"]).items()
+    } == {
+        "042": [42.0],
+        "007": [7.0],
+    }
+
+
+def test_legacy_single_file_is_migrated(tmp_path):
+    path = tmp_path / "cache.parquet"
+    pd.DataFrame({"key": ["a"], "value": ["1"]}).to_parquet(path, index=False)
+
+    cache = ParquetCache(path)
+
+    assert path.is_dir()
+    assert cache.get("a") == "1"
+
+
+def test_loaded_cache_compacts_above_max_shards(tmp_path):
+    path = tmp_path / "cache.parquet"
+    cache = ParquetCache(path, max_shards=3)
+    for i in range(4):
+        cache.set(str(i), str(i))
+        cache.save()
+
+    assert [shard.name for shard in path.glob("part-*.parquet")] == [
+        "part-00000.parquet"
+    ]
+    assert ParquetCache(path).get_many(["0", "3"]) == {"0": "0", "3": "3"}
@@ -0,0 +1,155 @@
+import json
+import os
+import pytest
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from util.embedding_store import EmbeddingStore
+from util.parquet_schema import (
+    migrate_parquet,
+    read_embedding_matrix,
+    read_parquet,
+    write_parquet,
+    write_parquet_batches,
+)
+
+
+def _frame(embedding, entities):
+    return pd.DataFrame(
+        {
+            "page_content": ["a", "b", "c"],
+            "page_content_embedding": embedding,
+            "entities": entities,
+        },
+        index=pd.Index(["x", "y", "z"], name="id"),
+    )
+
+
+def test_native_schema_round_trip(tmp_path):
+    path = tmp_path / "index.parquet"
+    embedding = [[0.5, 1.0, 1.5, 2.0], None, [3.0, 2.0, 1.0, 0.0]]
+    write_parquet(_frame(embedding, [["pepwave"], [], None]), path)
+
+    schema = pq.read_schema(path)
+    assert schema.field("page_content_embedding").type == pa.list_(pa.float32(), 4)
+    assert schema.field("entities").type == pa.list_(pa.string())
+
+    matrix = read_embedding_matrix(path, "page_content_embedding")
+    assert matrix.dtype == np.float32 and matrix.shape == (3, 4)
+    assert np.isnan(matrix[1]).all()
+    np.testing.assert_array_equal(matrix[[0, 2]], [embedding[0], embedding[2]])
+
+    df = read_parquet(path)
+    assert list(df.columns) == ["page_content", "page_content_embedding", "entities"]
+    assert df["entities"].tolist() == [["pepwave"], [], None]
+    assert df.loc["y", "page_content_embedding"] is None
+    np.testing.assert_array_equal(df.loc["z", "page_content_embedding"], embedding[2])
+
+
+def test_migrate_legacy_json_parquet(tmp_path):
+    path = tmp_path / "legacy.parquet"
+    embedding = [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]]
+    _frame(
+        [json.dumps(vector) for vector in embedding],
+        [json.dumps(["a"]), json.dumps(["b", "c"]), json.dumps([])],
+    ).to_parquet(path)
+
+    assert migrate_parquet(path)
+    assert not migrate_parquet(path)
+    np.testing.assert_array_equal(
+        read_embedding_matrix(path, "page_content_embedding"), embedding
+    )
+    assert read_parquet(path)["entities"].tolist() == [["a"], ["b", "c"], []]
+
+
+def test_embedding_store_slices_by_id(tmp_path):
+    vectors = np.arange(20, dtype=np.float32).reshape(5, 4)
+    df = pd.DataFrame(
+        {
+            "page_content": list("abcde"),
+            "page_content_embedding": list(vectors),
+            "title_embedding": [None, *vectors[1:]],
+        },
+        index=pd.Index([f"doc_{i}" for i in range(5)], name="id"),
+    )
+    write_parquet(df, tmp_path / "index.parquet")
+
+    store = EmbeddingStore.from_parquet(
+        tmp_path / "index.parquet", tmp_path / "store", batch_size=2
+    )
+    assert isinstance(store.matrix("page_content_embedding"), np.memmap)
+    np.testing.assert_array_equal(
+        store.get("page_content_embedding", ["doc_3", "doc_1"]), vectors[[3, 1]]
+    )
+    title_vectors = store.get_vectors("title_embedding", ["doc_0", "doc_4"])
+    assert title_vectors[0] is None
+    np.testing.assert_array_equal(title_vectors[1], vectors[4])
+    with pytest.raises(KeyError):
+        store.rows(["missing"])
+
+
+def test_embedding_store_is_built_when_missing_or_stale(tmp_path):
+    def write_index(ids):
+        df = pd.DataFrame(
+            {"page_content_embedding": [np.ones(4, dtype=np.float32)] * len(ids)},
+            index=pd.Index(ids, name="id"),
+        )
+        write_parquet(df, tmp_path / "index.parquet")
+
+    write_index(["doc_0", "doc_1"])
+    store = EmbeddingStore.open_or_build(tmp_path / "index.parquet", tmp_path / "store")
+    assert store.ids.tolist() == ["doc_0", "doc_1"]
+
+    reopened = EmbeddingStore.open_or_build(
+        tmp_path / "index.parquet", tmp_path / "store"
+    )
+    assert reopened.ids.tolist() == ["doc_0", "doc_1"]
+
+    write_index(["doc_2"])
+    # An index written after the store makes it stale
+    ids_path = tmp_path / "store" / "ids.parquet"
+    os.utime(ids_path, (0, 0))
+    rebuilt = EmbeddingStore.open_or_build(
+        tmp_path / "index.parquet", tmp_path / "store"
+    )
+    assert rebuilt.ids.tolist() == ["doc_2"]
+
+
+def test_write_parquet_batches(tmp_path):
+    path = tmp_path / "synth_data.parquet"
+    frames = [
+        pd.DataFrame(
+            {"is_useful": [True], "themes": [["a"]], "summary": [None]},
+            index=pd.Index(["x"], name="id"),
+        ),
+        pd.DataFrame(
+            {"summary": ["s", "t"], "is_useful": [False, True]},
+            index=pd.Index(["y", "z"], name="id"),
+        ),
+    ]
+
+    assert write_parquet_batches(frames, path) == 3
+    assert pq.ParquetFile(path).num_row_groups == 2
+
+    df = read_parquet(path)
+    assert df.index.tolist() == ["x", "y", "z"]
+    assert df["themes"].tolist() == [["a"], None, None]
+    assert df["summary"].isna().tolist() == [True, False, False]
+    assert df["summary"].tolist()[1:] == ["s", "t"]
+    assert df["is_useful"].tolist() == [True, False, True]
+
+
+def test_write_parquet_batches_rejects_new_columns_and_clears_stale_file(tmp_path):
+    path = tmp_path / "synth_data.parquet"
+    first = pd.DataFrame({"summary": ["s"]}, index=pd.Index(["x"], name="id"))
+    assert write_parquet_batches([first], path) == 1
+
+    with pytest.raises(ValueError, match="themes"):
+        write_parquet_batches([first, first.assign(themes=[["a"]])], path)
+    # a failed write leaves the previous file as it was
+    assert read_parquet(path).index.tolist() == ["x"]
+    assert not path.with_suffix(".tmp").exists()
+
+    assert write_parquet_batches([], path) == 0
+    assert not path.exists()
@@ -0,0 +1,65 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from load.resources import clear_shared, get_shared
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    clear_shared()
+    yield
+    clear_shared()
+
+
+def test_factory_runs_once_per_key():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        resources = list(executor.map(lambda _: get_shared("model", factory), range(8)))
+
+    assert len(calls) == 1
+    assert all(resource is resources[0] for resource in resources)
+
+
+def test_slow_factory_does_not_block_other_keys():
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_factory():
+        started.set()
+        release.wait(timeout=5)
+        return "slow"
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        slow = executor.submit(get_shared, "slow", slow_factory)
+        assert started.wait(timeout=5)
+        assert get_shared("fast", lambda: "fast") == "fast"
+        assert not slow.done()
+        release.set()
+        assert slow.result(timeout=5) == "slow"
+
+
+def test_factory_can_request_other_shared_resources():
+    inner = get_shared("outer", lambda: ("outer", get_shared("inner", object)))[1]
+    assert get_shared("inner", object) is inner
+
+
+def test_failed_factory_is_retried():
+    def failing():
+        raise RuntimeError("load failed")
+
+    with pytest.raises(RuntimeError):
+        get_shared("model", failing)
+    assert get_shared("model", lambda: "loaded") == "loaded"
+
+
+def test_clear_shared_drops_resources():
+    first = get_shared("model", object)
+    clear_shared()
+    assert get_shared("model", object) is not first
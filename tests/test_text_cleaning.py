@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+from tests.legacy_text_cleaning import LEGACY
+from util.text_cleaning import PROFILES, clean_column, clean_text, clean_texts
+
+TEXTS = [
+    None,
+    float("nan"),
+    "",
+    "   ",
+    "plain text without markup",
+    "## Title: Balance 20X\n### Setup\n# Overview\nText",
+    "#hashtag at line start\n a #b\n\t## not a title",
+    "see ![diagram](http://x/y.png) and ![](z.png) here",
+    "[IMG]http://x/y.png caption\nkept line\n text [IMG] inline\n",
+    "a\n\n\n\nb\n \t\n  \n\t\nc\n\nd",
+    "<p>para <b>bold</b></p><br/>\n<a href='x'>link</a> 1 < 2",
+    "before<table><tr><td>cell</td></tr>\n</table>middle<table>x</table>after<i>i</i>",
+    "tabs\t\tand    spaces \t mixed\n\n\n",
+    "unclosed <tag and ![alt](url",
+]
+
+
+@pytest.mark.parametrize("profile", list(PROFILES))
+def test_profiles_match_legacy_functions(profile):
+    for text in TEXTS:
+        expected = LEGACY[profile](text)
+        cleaned = clean_text(text, profile)
+        if isinstance(expected, float):
+            assert pd.isna(cleaned)
+        else:
+            assert cleaned == expected, repr(text)
+
+
+@pytest.mark.parametrize("profile", list(PROFILES))
+def test_clean_texts_in_process_pool_keeps_order(profile):
+    texts = [text for text in TEXTS if isinstance(text, str)] * 5
+
+    cleaned = clean_texts(texts, profile, workers=2, chunk_size=7)
+
+    assert cleaned == [LEGACY[profile](text) for text in texts]
+
+
+def test_clean_column_keeps_index_and_name():
+    series = pd.Series(
+        ["<b>x</b>", None, "![a](b) y"], index=["d1", "d2", "d3"], name="page_content"
+    )
+
+    cleaned = clean_column(series, "embedding", workers=1)
+
+    assert cleaned.index.tolist() == ["d1", "d2", "d3"]
+    assert cleaned.name == "page_content"
+    assert cleaned.tolist() == ["x", "", "y"]
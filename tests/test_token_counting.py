@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pytest
+import tiktoken
+import util.token_counting
+from util.token_counting import TokenCounter
+
+TEXTS = [
+    "the theme",
+    "",
+    "  spaced\tout\n\nlines ",
+    "scraped <|endoftext|> marker",
+    "unicode: café ✓",
+]
+
+
+class RecordingEncoder:
+    """Wraps a tiktoken encoding and records the texts it encodes."""
+
+    def __init__(self, encoding: tiktoken.Encoding):
+        self.encoding = encoding
+        self.encoded: list[str] = []
+
+    def encode_ordinary(self, text):
+        self.encoded.append(text)
+        return self.encoding.encode_ordinary(text)
+
+    def encode_ordinary_batch(self, texts, num_threads):
+        self.encoded.extend(texts)
+        return self.encoding.encode_ordinary_batch(texts, num_threads=num_threads)
+
+
+@pytest.fixture
+def encoding(monkeypatch) -> tiktoken.Encoding:
+    """Byte-level BPE with a few merges, so no encoding files need to be downloaded."""
+    ranks = {bytes([i]): i for i in range(256)}
+    ranks.update({b"th": 256, b"he": 257, b"the": 258, b"  ": 259})
+    encoding = tiktoken.Encoding(
+        name="test_bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks=ranks,
+        special_tokens={"<|endoftext|>": 260},
+    )
+    monkeypatch.setattr(util.token_counting, "get_encoder", lambda name: encoding)
+    return encoding
+
+
+@pytest.fixture
+def counter(encoding) -> TokenCounter:
+    counter = TokenCounter("test_bytes", memo_size=3)
+    counter.encoder = RecordingEncoder(encoding)
+    return counter
+
+
+def test_counts_match_tiktoken(encoding, counter):
+    expected = [len(encoding.encode_ordinary(text)) for text in TEXTS]
+    assert expected[0] == 5  # "the", " ", "the", "m", "e"
+    assert [counter.count(text) for text in TEXTS] == expected
+    assert TokenCounter("test_bytes").count_batch(TEXTS) == expected
+    assert counter.count(12345) == len(encoding.encode_ordinary("12345"))
+
+
+def test_memo_hits_skip_encoding(counter):
+    first = counter.count_batch(["a b", "c", "a b"])
+    assert counter.encoder.encoded == ["a b", "c"]
+
+    assert counter.count("a b") == first[0]
+    assert counter.count_batch(["c", "a b"]) == [first[1], first[0]]
+    assert counter.encoder.encoded == ["a b", "c"]
+
+
+def test_memo_evicts_least_recently_used(counter):
+    counter.count_batch(["a", "b", "c"])
+    counter.count("a")  # b is now the least recently used
+    counter.count("d")
+    counter.encoder.encoded.clear()
+
+    counter.count_batch(["a", "c", "d"])
+    assert counter.encoder.encoded == []
+    counter.count("b")
+    assert counter.encoder.encoded == ["b"]
+    assert len(counter._memo) == 3
+
+
+def test_count_column_reuses_persisted_counts(counter):
+    df = pd.DataFrame(
+        {"page_content": ["a b", "c d e", "f"], "token_count": [100, None, 7]},
+        index=["x", "y", "z"],
+    )
+
+    counts = counter.count_column(df)
+
+    assert counts.tolist() == [100, 5, 7]
+    assert counts.index.tolist() == ["x", "y", "z"]
+    assert counter.encoder.encoded == ["c d e"]
+
+
+def test_shared_counter_is_thread_safe(encoding):
+    counter = TokenCounter("test_bytes", memo_size=8)
+    texts = [f"text {i % 20} " * (i % 5 + 1) for i in range(400)]
+    expected = [len(encoding.encode_ordinary(text)) for text in texts]
+
+    def count(start):
+        chunk = texts[start : start + 10]
+        return [counter.count(text) for text in chunk] + counter.count_batch(chunk)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(count, range(0, len(texts), 10)))
+
+    for start, result in zip(range(0, len(texts), 10), results):
+        assert result == expected[start : start + 10] * 2
+    assert len(counter._memo) <= 8
+
+
+def test_counts_match_cl100k_base():
+    try:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        pytest.skip("cl100k_base could not be loaded")
+    counter = TokenCounter("cl100k_base")
+    expected = [len(encoding.encode_ordinary(text)) for text in TEXTS]
+    assert [counter.count(text) for text in TEXTS] == expected
+    assert counter.count_batch(TEXTS) == expected
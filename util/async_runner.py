@@ -0,0 +1,19 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Coroutine, TypeVar
+
+T = TypeVar("T")
+
+
+def run_sync(coroutine: Coroutine[object, object, T]) -> T:
+    """
+    asyncio.run that also works where an event loop is already running in this thread,
+    e.g. a Jupyter or "# %%" interactive cell. There the coroutine runs on a fresh loop
+    in a worker thread and this call blocks until it is done.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -0,0 +1,151 @@
+import logging
+import os
+import queue
+import random
+import weakref
+from difflib import SequenceMatcher
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Callable, Literal
+
+DiagnosticsMode = Literal["off", "sampled", "debug"]
+DiagnosticsChannel = Literal["filter", "candidates", "duplicates"]
+
+CHANNELS: tuple[DiagnosticsChannel, ...] = ("filter", "candidates", "duplicates")
+
+# Fraction of events written per channel. "debug" keeps the full per-pair detail,
+# "sampled" keeps enough examples to eyeball the thresholds on a production run.
+SAMPLE_RATES: dict[DiagnosticsMode, dict[DiagnosticsChannel, float]] = {
+    "off": {"filter": 0.0, "candidates": 0.0, "duplicates": 0.0},
+    "sampled": {"filter": 0.05, "candidates": 0.001, "duplicates": 0.02},
+    "debug": {"filter": 1.0, "candidates": 1.0, "duplicates": 1.0},
+}
+
+
+def format_sequence_matches(str1: str, str2: str) -> str:
+    matcher = SequenceMatcher(None, str1, str2)
+    matches = [
+        str1[block.a : block.a + block.size]
+        for block in matcher.get_matching_blocks()
+        if block.size > 0  # Only include non-empty matches
+    ]
+    joined_matches = "], [".join(matches) if matches else "No matches found"
+    return f"Matches: [ {joined_matches} ]"
+
+
+class _LazyMessage:
+    """Log message that is only rendered when a handler formats the record."""
+
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn: Callable[..., str], *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self) -> str:
+        return self.fn(*self.args)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that enqueues records as-is. The stock handler formats the message
+    before enqueueing, which would render lazy messages on the calling thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class DedupDiagnostics:
+    """
+    Sampled diagnostic logs for the deduplication pipeline.
+
+    Each channel writes to logs/dedupe-<channel>-<name>.log. Events are sampled per
+    channel before anything is formatted, and the records that are kept go through a
+    queue to a background QueueListener thread that renders the messages (pair texts,
+    difflib match blocks) and writes the files. With mode "off" no files are opened
+    and log() returns after a dict lookup.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        mode: DiagnosticsMode = "sampled",
+        *,
+        sample_rates: dict[DiagnosticsChannel, float] | None = None,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            name: Used to name the log files
+            mode: Default sample rates, see SAMPLE_RATES
+            sample_rates: Per-channel overrides of the mode's sample rates
+            seed: Seed of the sampling RNG so sampled runs log the same events
+        """
+        self.mode = mode
+        self.sample_rates = {**SAMPLE_RATES[mode], **(sample_rates or {})}
+        self.emitted = {channel: 0 for channel in CHANNELS}
+        self._random = random.Random(seed)
+        self._loggers: dict[DiagnosticsChannel, logging.Logger] = {}
+        self._listener: QueueListener | None = None
+        self._stop_listener: weakref.finalize | None = None
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._handlers: list[logging.Handler] = []
+
+        active = [channel for channel in CHANNELS if self.sample_rates[channel] > 0]
+        if not active:
+            return
+
+        log_dir = Path(__file__).parent.parent / "logs"
+        log_dir.mkdir(exist_ok=True)
+        formatter = logging.Formatter(
+            "%(asctime)s (%(name)s) %(levelname)s: %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+        queue_handler = _DeferredQueueHandler(self._queue)
+        for channel in active:
+            logger_name = f"dedupe-{channel}-{name}"
+            logger = logging.Logger(logger_name, logging.INFO)
+            logger.addHandler(queue_handler)
+            self._loggers[channel] = logger
+
+            file_handler = RotatingFileHandler(
+                os.path.join("logs", f"{logger_name}.log"),
+                maxBytes=40 * 1024 * 1024,  # 40 MB
+                backupCount=0,
+                delay=True,
+            )
+            file_handler.setFormatter(formatter)
+            file_handler.addFilter(logging.Filter(logger_name))
+            self._handlers.append(file_handler)
+
+    def sample(self, channel: DiagnosticsChannel) -> bool:
+        rate = self.sample_rates[channel]
+        if rate <= 0:
+            return False
+        return rate >= 1 or self._random.random() < rate
+
+    def log(self, channel: DiagnosticsChannel, fn: Callable[..., str], *args) -> None:
+        """
+        Log fn(*args) on the channel if the event is sampled.
+        fn runs on the writer thread, so pass raw inputs rather than formatted text.
+        """
+        if not self.sample(channel):
+            return
+        if self._listener is None:
+            self._listener = QueueListener(self._queue, *self._handlers)
+            self._listener.start()
+            # Stops the writer at exit or when this object is collected without close().
+            # It references only the listener, so the object itself is not kept alive.
+            self._stop_listener = weakref.finalize(self, self._listener.stop)
+        self.emitted[channel] += 1
+        self._loggers[channel].info(_LazyMessage(fn, *args))
+
+    def close(self) -> None:
+        """Wait for queued records to be written. Logging again restarts the writer."""
+        if self._listener is not None:
+            self._stop_listener()
+            self._listener = None
+            self._stop_listener = None
+        for handler in self._handlers:
+            handler.flush()
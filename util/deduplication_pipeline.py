@@ -1,18 +1,33 @@
-import itertools
+from collections import Counter
+from pathlib import Path
 from typing import List, Literal, Set, Tuple
 import pandas as pd
-from datasketch import MinHash, MinHashLSH
+import numpy as np
+from datasketch import MinHashLSH
 from rapidfuzz import fuzz, process
-from config.logger import RotatingFileLogger, RotatingFileLogWriter
+from config.logger import RotatingFileLogWriter
+from util.dedup_diagnostics import (
+    DedupDiagnostics,
+    DiagnosticsMode,
+    format_sequence_matches,
+)
 from util.util_main import dedupe_df_ids, print_replace
+from util.parquet_cache import ParquetCache, hash_text
+from util.minhash_index import PersistentMinHashIndex
 from util.viz import plot_number_dist
 from util.nlp import (
-    compute_simple_precision,
+    get_blocked_pairwise_scores,
+    get_docs_corpus_indices,
+    get_simple_precision_join_pairs,
     get_write_pair_log_text,
+    nltk_get_lemmatized_tokens_parallel,
+    DisjointSet,
     timer,
+    LEMMATIZER_VERSION,
+    MinHashSignature,
+    TokenizedCorpus,
     TokenizedDoc,
 )
-from difflib import SequenceMatcher
 import nltk
 
 
@@ -22,40 +37,164 @@ def prep_str_for_matching(s: str) -> str:
     return " ".join(tokens)
 
 
+def chunk_pairs_by_length(
+    lengths_a: np.ndarray,
+    lengths_b: np.ndarray,
+    *,
+    chunk_size: int = 1024,
+    max_chunk_cost: int = 2_000_000_000,
+) -> List[np.ndarray]:
+    """
+    Split pair indices into chunks of similar cost for fuzzy matching.
+
+    partial_ratio costs roughly len(a) * len(b), so pairs are sorted by that cost and
+    chunks are closed after chunk_size pairs or once their summed cost exceeds
+    max_chunk_cost. Cheap pairs share big chunks while long-vs-long transcript pairs
+    land in small chunks of their own, so no single pair stalls a worker holding a
+    large share of the work.
+    """
+    costs = lengths_a * lengths_b
+    order = np.argsort(costs, kind="stable")
+    chunks = []
+    current: List[int] = []
+    current_cost = 0
+    for i in order.tolist():
+        if current and (
+            len(current) >= chunk_size or current_cost + costs[i] > max_chunk_cost
+        ):
+            chunks.append(np.array(current, dtype=np.int64))
+            current, current_cost = [], 0
+        current.append(i)
+        current_cost += int(costs[i])
+    if current:
+        chunks.append(np.array(current, dtype=np.int64))
+    return chunks
+
+
+def _format_duplicate_group(group_docs: List[TokenizedDoc]) -> str:
+    texts = [doc.original_text.replace("\n", " ").strip() for doc in group_docs]
+    return "Group:\n" + "\n".join(texts)
+
+
+def _format_duplicate_pair(doc_a: TokenizedDoc, doc_b: TokenizedDoc) -> str:
+    tokens_a = " ".join(doc_a.tokens)
+    tokens_b = " ".join(doc_b.tokens)
+    return "\n".join(
+        [
+            get_write_pair_log_text(doc_a.original_text, doc_b.original_text),
+            format_sequence_matches(doc_a.original_text, doc_b.original_text),
+            get_write_pair_log_text(tokens_a, tokens_b, "Tokenized:"),
+            format_sequence_matches(tokens_a, tokens_b),
+        ]
+    )
+
+
 class DeduplicationPipeline:
-    def __init__(self, name: str, silent: bool = False):
+    def __init__(
+        self,
+        name: str,
+        silent: bool = False,
+        *,
+        cache_dir: Path | None = None,
+        index_dir: Path | None = None,
+        tokenize_workers: int | None = None,
+        diagnostics: DiagnosticsMode = "sampled",
+    ):
+        """
+        Args:
+            name: Used to name the log files
+            silent: Disable logging
+            cache_dir: Directory for on-disk caches (tokens keyed by page_content hash).
+                No caching if None.
+            index_dir: Directory of the persistent MinHash LSH index used for incremental
+                exact-duplicate filtering across runs. Not persisted if None.
+            tokenize_workers: Process pool size for tokenization (default: cpu count)
+            diagnostics: Sampling of the filter/candidate/duplicate logs. "debug" logs every
+                event with match visualizations, "off" logs nothing. Forced "off" if silent.
+        """
         self.logger = RotatingFileLogWriter(
             f"deduplication_pipeline-{name}", silent=silent
         )
-        self.filter_logger = RotatingFileLogger(
-            f"dedupe-filter-{name}", silent=silent, log_to_console=False
-        )
-        self.candidate_logger = RotatingFileLogger(
-            f"dedupe-candidates-{name}", silent=silent, log_to_console=False
-        )
-        self.duplicate_logger = RotatingFileLogger(
-            f"dedupe-duplicates-{name}", silent=silent, log_to_console=False
-        )
+        self.diagnostics = DedupDiagnostics(name, "off" if silent else diagnostics)
+        self.cache_dir = cache_dir
+        self.index_dir = index_dir
+        self.tokenize_workers = tokenize_workers
 
     @timer("Tokenize documents")
     def _tokenize_documents(self, df: pd.DataFrame) -> List[TokenizedDoc]:
-        """Tokenize all documents in the dataframe."""
+        """
+        Tokenize all documents in the dataframe.
+        Tokens are cached on disk by page_content hash so re-runs skip tokenization.
+        """
         self.logger.log_and_print_header(f"Tokenize {len(df)} docs")
-        tokenized_docs = []
-        for _, row in df.iterrows():
-            doc = TokenizedDoc(row)
-            tokenized_docs.append(doc)
+        texts = df["page_content"].tolist()
+        keys = [hash_text(text) for text in texts]
+
+        cache = (
+            ParquetCache(self.cache_dir / f"tokens_{LEMMATIZER_VERSION}.parquet")
+            if self.cache_dir
+            else None
+        )
+        cached = cache.get_many(keys) if cache is not None else {}
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        self.logger.log_and_print(
+            f"Token cache hits: {len(texts) - len(missing)}, to tokenize: {len(missing)}"
+        )
+        tokenized = nltk_get_lemmatized_tokens_parallel(
+            list(missing.values()), workers=self.tokenize_workers
+        )
+        fresh = dict(zip(missing.keys(), tokenized))
+        if cache is not None:
+            cache.update(fresh)
+            cache.save()
+
+        corpus = TokenizedCorpus(
+            df["id"].tolist(),
+            texts,
+            (fresh[key] if key in fresh else cached[key] for key in keys),
+        )
+        tokenized_docs = corpus.docs()
         self.logger.log_and_print(f"*Tokenization Complete: {len(tokenized_docs)}")
         return tokenized_docs
 
     def _log_duplicate_group(
         self, group: List[int] | Set[int], docs: List[TokenizedDoc]
     ) -> None:
-        group_docs = [docs[i] for i in group]
-        self.filter_logger.info(
-            f"Group:\n{'\n'.join([
-                doc.original_text.replace('\n', ' ').strip() for doc in group_docs
-            ])}"
+        self.diagnostics.log(
+            "filter", _format_duplicate_group, [docs[i] for i in group]
+        )
+
+    @staticmethod
+    def _choose_representative(
+        group: List[int], docs: List[TokenizedDoc], keep: Literal["first", "longest"]
+    ) -> int:
+        if keep == "longest":
+            return max(group, key=lambda i: (docs[i].token_count, -i))
+        return min(group)
+
+    def _log_group_sizes(self, groups: List[List[int]]) -> None:
+        if not groups:
+            return
+        size_counts = Counter(len(group) for group in groups)
+        self.logger.log_and_print(
+            f"Duplicate groups: {len(groups)}, docs in groups: {sum(map(len, groups))}, "
+            f"largest group: {max(size_counts)}"
+        )
+        self.logger.log_and_print(
+            f"Group sizes (size: count): {dict(sorted(size_counts.items()))}"
+        )
+
+    def _load_minhash_index(
+        self, threshold: float, min_unique_tokens: int
+    ) -> PersistentMinHashIndex | None:
+        if not self.index_dir:
+            return None
+        return PersistentMinHashIndex(
+            self.index_dir,
+            threshold=threshold,
+            min_unique_tokens=min_unique_tokens,
+            logger=self.logger,
         )
 
     @timer("Filter exact duplicates")
@@ -65,43 +204,100 @@ class DeduplicationPipeline:
         *,
         threshold: float = 0.98,
         min_unique_tokens: int = 50,
+        keep: Literal["first", "longest"] = "first",
     ) -> List[TokenizedDoc]:
         """
         Returns filtered corpus with exact duplicates removed.
         This is a set comparison but uses bigrams to account for some word order.
+        With an index_dir, decisions and signatures are persisted and only new docs are hashed.
+
+        LSH hits are merged into connected components, so transitive duplicates end up in
+        one group. keep="first" keeps the earliest doc of each group, keep="longest" keeps
+        the doc with the most tokens (earliest on ties).
         """
         self.logger.log_and_print_header(
             f"Filter exact duplicates for: {len(docs)} docs"
         )
         self.logger.log_and_print(f"N-Gram: 2, Threshold: {threshold}")
 
+        corpus, corpus_indices = get_docs_corpus_indices(docs)
+        if corpus is None:
+            return []
+
         # Ignore docs with too few unique tokens
-        valid_docs: List[TokenizedDoc] = []
-        valid_indices: List[int] = []
-        for i, doc in enumerate(docs):
-            # Convert to set to count unique tokens
-            if len(set(doc.tokens)) >= min_unique_tokens:
-                valid_docs.append(doc)
-                valid_indices.append(i)
+        unique_token_counts = corpus.get_unique_token_counts()[corpus_indices]
+        valid_indices: List[int] = np.flatnonzero(
+            unique_token_counts >= min_unique_tokens
+        ).tolist()
+
+        # Docs already in the persistent index keep their previous decision,
+        # so only new or changed docs need to be hashed
+        index = self._load_minhash_index(threshold, min_unique_tokens)
+        content_hashes: dict[int, str] = {}
+        indices_to_remove = set()
+        # Kept doc id each newly removed doc duplicates, recorded in the index
+        partner_ids: dict[int, str] = {}
+        kept_index_ids: set[str] = set()
+        if index is not None:
+            content_hashes = {
+                i: hash_text(docs[i].original_text) for i in valid_indices
+            }
+            forgotten = index.prune(
+                {docs[i].doc_id: content_hashes[i] for i in valid_indices}
+            )
+            new_indices = []
+            for i in valid_indices:
+                status = index.get_status(docs[i].doc_id, content_hashes[i])
+                if status == "removed":
+                    indices_to_remove.add(i)
+                elif status == "kept":
+                    kept_index_ids.add(docs[i].doc_id)
+                else:
+                    new_indices.append(i)
+            self.logger.log_and_print(
+                f"MinHash index: {len(valid_indices) - len(new_indices)} known docs, {len(new_indices)} new docs, "
+                f"{forgotten} changed docs forgotten"
+            )
+            valid_indices = new_indices
 
         # Process only valid docs with MinHash
-        minhashes = MinHash.bulk(
-            [doc.get_encoded_tokens(ngram=2) for doc in valid_docs], num_perm=1024
+        minhashes = corpus.get_minhash_signatures(
+            corpus_indices[valid_indices], ngram=2, num_perm=1024
         )
         # Shift the minhashes by 1 word to account for bigram shifted overlap issue
-        shifted_minhashes = MinHash.bulk(
-            [doc.get_encoded_tokens(ngram=2, shift=1) for doc in valid_docs],
-            num_perm=1024,
+        shifted_minhashes = corpus.get_minhash_signatures(
+            corpus_indices[valid_indices], ngram=2, shift=1, num_perm=1024
         )
         # initialize the lsh
         lsh = MinHashLSH(threshold=threshold, num_perm=1024)
 
-        to_remove = []
-        for i, m in enumerate(minhashes):
+        groups = DisjointSet(len(minhashes))
+        for i, hashvalues in enumerate(minhashes):
+            # New docs matching a doc kept in a previous run are removed outright
+            if index is not None:
+                index_hits = sorted(
+                    (
+                        set(index.query(hashvalues))
+                        | set(index.query(shifted_minhashes[i]))
+                    )
+                    & kept_index_ids
+                )
+                if index_hits:
+                    indices_to_remove.add(valid_indices[i])
+                    partner_ids[valid_indices[i]] = index_hits[0]
+                    self.diagnostics.log(
+                        "filter",
+                        "Duplicate of indexed docs {}: {}".format,
+                        index_hits,
+                        docs[valid_indices[i]].doc_id,
+                    )
+                    continue
+
+            m = MinHashSignature(hashvalues)
             result = lsh.query(m)
             # if no result check if there is a match when shifted by 1 word to compensate for bigram shift issue
             if not result:
-                shifted_m = shifted_minhashes[i]
+                shifted_m = MinHashSignature(shifted_minhashes[i])
                 result = lsh.query(shifted_m)
                 if result:
                     lsh.insert(i, shifted_m)
@@ -111,26 +307,30 @@ class DeduplicationPipeline:
                 # insert lazily for efficiency
                 lsh.insert(i, m)
 
-            # a result of length >0 means there are duplicates
-            if result:
-                result = set(result)
-                # check if any of the existing sets in to_remove are a subset of the result
-                # this allows us to insert lazily above
-                for existing_set in to_remove:
-                    if result == existing_set:
-                        existing_set.add(i)
-                        break
-                else:
-                    to_remove.append(result | {i})
+            # every hit joins this doc's connected component
+            for j in result:
+                groups.union(i, j)
 
         # Map back to original indices for removal
-        indices_to_remove = set()
-        for group in to_remove:
+        duplicate_groups = groups.groups()
+        for group in duplicate_groups:
             # Convert group indices back to original doc indices
-            original_group = {valid_indices[i] for i in group}
+            original_group = [valid_indices[i] for i in group]
             self._log_duplicate_group(original_group, docs)
-            original_group.pop()  # Keep one representative
-            indices_to_remove.update(original_group)
+            representative = self._choose_representative(original_group, docs, keep)
+            for i in original_group:
+                if i != representative:
+                    indices_to_remove.add(i)
+                    partner_ids[i] = docs[representative].doc_id
+        self._log_group_sizes(duplicate_groups)
+
+        if index is not None:
+            for i, hashvalues in zip(valid_indices, minhashes):
+                if i in indices_to_remove:
+                    index.add_removed(docs[i].doc_id, content_hashes[i], partner_ids[i])
+                else:
+                    index.add_kept(docs[i].doc_id, content_hashes[i], hashvalues)
+            index.save()
 
         # Return filtered corpus
         filtered_corpus = [
@@ -150,42 +350,53 @@ class DeduplicationPipeline:
         ngram: int = 1,
         threshold: float = 0.8,
         report: Literal["plot", "print", None] = None,
+        backend: Literal["index", "sparse"] = "index",
     ) -> List[Tuple[TokenizedDoc, TokenizedDoc]]:
         """
         Returns pairs of documents that are potential duplicates using simple precision.
         This is a set comparison, so word order/count is irrelevant except for the ngram factor.
+        backend="index" uses a prefix-filtered inverted index so only pairs sharing a rare token are scored.
+        backend="sparse" scores all pairs with blocked binary sparse matrix products.
+        When reporting, only the pairs above the threshold are included in the distribution.
         """
         self.logger.log_and_print_header(
             f"Get Candidates (precision) for: {len(docs)} docs"
         )
-        self.logger.log_and_print(f"N-Gram: {ngram}, Threshold: {threshold}")
+        self.logger.log_and_print(
+            f"N-Gram: {ngram}, Threshold: {threshold}, Backend: {backend}"
+        )
+
+        corpus, corpus_indices = get_docs_corpus_indices(docs)
+        if corpus is None:
+            pairs = []
+        elif backend == "sparse":
+            pairs = get_blocked_pairwise_scores(
+                corpus.get_binary_ngram_matrix(corpus_indices, ngram),
+                threshold,
+                metric="precision",
+            )
+        else:
+            pairs = get_simple_precision_join_pairs(
+                corpus.get_ngram_sets(corpus_indices, ngram), threshold
+            )
 
         candidates = []
         similarities = []
-        for i in range(len(docs)):
-            for j in range(i + 1, len(docs)):
-                precision = compute_simple_precision(
-                    docs[i].get_chunked_tokens(ngram),
-                    docs[j].get_chunked_tokens(ngram),
-                )
-
-                if report:
-                    similarities.append(round(precision, 2))
-
-                if precision > threshold:
-                    self.candidate_logger.info(
-                        get_write_pair_log_text(
-                            docs[i].original_text,
-                            docs[j].original_text,
-                            "Candidate Found",
-                        )
-                    )
-                    candidates.append((docs[i], docs[j]))
+        for i, j, precision in pairs:
+            if report:
+                similarities.append(round(precision, 2))
+
+            self.diagnostics.log(
+                "candidates",
+                get_write_pair_log_text,
+                docs[i].original_text,
+                docs[j].original_text,
+                "Candidate Found",
+            )
+            candidates.append((docs[i], docs[j]))
 
         if report:
-            self.logger.log_and_print(
-                f"Simple Precision Comparisons: {len(similarities)}"
-            )
+            self.logger.log_and_print(f"Simple Precision Matches: {len(similarities)}")
             if report == "plot":
                 plot_number_dist(similarities)
             elif report == "print":
@@ -196,86 +407,69 @@ class DeduplicationPipeline:
         )
         return candidates
 
-    def _log_sequence_matches(self, str1: str, str2: str) -> None:
-        # str1 = prep_str_for_matching(str1)
-        # str2 = prep_str_for_matching(str2)
-        matcher = SequenceMatcher(None, str1, str2)
-        matches = []
-        for block in matcher.get_matching_blocks():
-            if block.size > 0:  # Only include non-empty matches
-                match_text = str1[block.a : block.a + block.size]
-                matches.append(match_text)
-
-        joined_matches = "], [".join(matches) if matches else "No matches found"
-        self.duplicate_logger.info(f"Matches: [ {joined_matches} ]")
-
     @timer("Confirm duplicates")
     def _confirm_duplicates(
         self,
         candidate_pairs: List[Tuple[TokenizedDoc, TokenizedDoc]],
         *,
         threshold: int = 90,
+        workers: int = -1,
+        chunk_size: int = 1024,
+        max_chunk_cost: int = 2_000_000_000,
     ) -> Set[str]:
-        """Returns set of document IDs that are duplicates"""
+        """
+        Returns set of document IDs that are duplicates.
+        Pairs are scored with the native fuzz.partial_ratio scorer in length-bucketed chunks
+        (see chunk_pairs_by_length) so rapidfuzz can spread each chunk evenly over its workers.
+        """
 
         if not candidate_pairs:
             return set()
-        call_counter = itertools.count(1)
-        high_scores = 0
-
-        def _progress_scorer(s1: str, s2: str, **kwargs) -> float:
-            # high scores will always be much higher than duplicates found since these will flag the same item several times
-            nonlocal high_scores
-            print_replace(
-                f"Processed {next(call_counter)} comparisons. Flagged comparisons: {high_scores}. Next item lengths: {len(s1)}, {len(s2)}"
-            )
-
-            # start_time = time.time()
-            score = fuzz.partial_ratio(s1, s2)
-            # duration = time.time() - start_time
-
-            if score > threshold:
-                high_scores += 1
-
-            # if duration > 25:
-            #     duplicate_logger.info(
-            #         log_write_pair(
-            #             s1,
-            #             s2,
-            #             msg=f"Slow comparison ({duration:.2f}s).  Lengths: {len(s1)}, {len(s2)}",
-            #         )
-            #     )
-
-            return score
 
         self.logger.log_and_print_header(
             f"Getting duplicates for: {len(candidate_pairs)} pairs"
         )
         self.logger.log_and_print(f"Threshold: {threshold}")
-        tokenized_docs_a, tokenized_docs_b = zip(*candidate_pairs)
-        strings_a = [" ".join(doc.tokens) for doc in tokenized_docs_a]
-        strings_b = [" ".join(doc.tokens) for doc in tokenized_docs_b]
 
-        distances = process.cpdist(
-            strings_a, strings_b, scorer=_progress_scorer, workers=8
+        joined_tokens: dict[int, str] = {}
+
+        def _get_joined_tokens(doc: TokenizedDoc) -> str:
+            if doc.index not in joined_tokens:
+                joined_tokens[doc.index] = doc.corpus.get_joined_tokens(doc.index)
+            return joined_tokens[doc.index]
+
+        strings_a = [_get_joined_tokens(doc_a) for doc_a, _ in candidate_pairs]
+        strings_b = [_get_joined_tokens(doc_b) for _, doc_b in candidate_pairs]
+
+        chunks = chunk_pairs_by_length(
+            np.array([len(string) for string in strings_a], dtype=np.int64),
+            np.array([len(string) for string in strings_b], dtype=np.int64),
+            chunk_size=chunk_size,
+            max_chunk_cost=max_chunk_cost,
         )
+        distances = np.zeros(len(candidate_pairs), dtype=np.float64)
+        processed = 0
+        for chunk_number, chunk in enumerate(chunks, 1):
+            distances[chunk] = process.cpdist(
+                [strings_a[i] for i in chunk],
+                [strings_b[i] for i in chunk],
+                scorer=fuzz.partial_ratio,
+                score_cutoff=threshold,
+                workers=workers,
+            )
+            processed += len(chunk)
+            # high scores will always be much higher than duplicates found since these will flag the same item several times
+            print_replace(
+                f"Processed {processed} comparisons in {chunk_number}/{len(chunks)} chunks. "
+                f"Flagged comparisons: {int((distances > threshold).sum())}"
+            )
+
         duplicates = set()
         for idx, (doc_a, doc_b) in enumerate(candidate_pairs):
             if distances[idx] > threshold:
-                self.duplicate_logger.info(
-                    get_write_pair_log_text(doc_a.original_text, doc_b.original_text)
-                )
-                self._log_sequence_matches(doc_a.original_text, doc_b.original_text)
-                self.duplicate_logger.info(
-                    get_write_pair_log_text(
-                        " ".join(doc_a.tokens), " ".join(doc_b.tokens), "Tokenized:"
-                    )
-                )
-                self._log_sequence_matches(
-                    " ".join(doc_a.tokens), " ".join(doc_b.tokens)
-                )
+                self.diagnostics.log("duplicates", _format_duplicate_pair, doc_a, doc_b)
 
-                if len(doc_a.tokens) < len(doc_b.tokens):
+                if doc_a.token_count < doc_b.token_count:
                     duplicates.add(doc_a.doc_id)
                 else:
                     duplicates.add(doc_b.doc_id)
@@ -301,12 +495,14 @@ class DeduplicationPipeline:
         precision_ngram: int = 2,
         duplicate_threshold: int = 95,
         report_candidates: Literal["plot", "print", None] = None,
+        candidate_backend: Literal["index", "sparse"] = "index",
     ) -> pd.DataFrame:
         duplicate_candidates = self.get_duplicate_candidates_simple_precision(
             filtered_docs,
             threshold=precision_threshold,
             ngram=precision_ngram,
             report=report_candidates,
+            backend=candidate_backend,
         )
         duplicate_doc_ids = self._confirm_duplicates(
             duplicate_candidates, threshold=duplicate_threshold
@@ -321,6 +517,11 @@ class DeduplicationPipeline:
 
         df_deduped = df[df["id"].isin(filtered_docs_ids_deduped)]
         self.logger.log_and_print(f"Rows after deduplication: {len(df_deduped)}")
+        self.diagnostics.close()
+        if self.diagnostics.mode != "off":
+            self.logger.log_and_print(
+                f"Diagnostics ({self.diagnostics.mode}) events logged: {self.diagnostics.emitted}"
+            )
         return df_deduped
 
     def run(
@@ -331,6 +532,7 @@ class DeduplicationPipeline:
         precision_ngram: int = 2,
         duplicate_threshold: int = 95,
         report_candidates: Literal["plot", "print", None] = None,
+        candidate_backend: Literal["index", "sparse"] = "index",
     ) -> pd.DataFrame:
         df = df.drop_duplicates(subset=["page_content"], keep="first")
         tokenized_docs = self._tokenize_documents(df)
@@ -344,6 +546,7 @@ class DeduplicationPipeline:
             precision_ngram=precision_ngram,
             duplicate_threshold=duplicate_threshold,
             report_candidates=report_candidates,
+            candidate_backend=candidate_backend,
         )
 
     def run_dedupe_chunks(
@@ -354,6 +557,7 @@ class DeduplicationPipeline:
         precision_ngram: int = 1,
         duplicate_threshold: int = 95,
         report_candidates: Literal["plot", "print", None] = None,
+        candidate_backend: Literal["index", "sparse"] = "index",
     ) -> pd.DataFrame:
         df = df.drop_duplicates(subset=["page_content"], keep="first")
         tokenized_docs = self._tokenize_documents(df)
@@ -364,4 +568,5 @@ class DeduplicationPipeline:
             precision_ngram=precision_ngram,
             duplicate_threshold=duplicate_threshold,
             report_candidates=report_candidates,
+            candidate_backend=candidate_backend,
         )
@@ -0,0 +1,111 @@
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from util.embedding_scheduler import PartialEmbeddingError
+from util.parquet_cache import ParquetCache, hash_text
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper with a persistent cache keyed by hash of (model, dimensions, text).
+
+    Callers pass the text exactly as it is embedded (i.e. after cleaning), so an unchanged
+    document is never sent to the API twice. Only cache misses are embedded, duplicates
+    within a call are embedded once, and vectors are stored as float32.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: ParquetCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        model = getattr(embeddings, "model", type(embeddings).__name__)
+        dimensions = getattr(embeddings, "dimensions", None) or "default"
+        self._key_prefix = f"{model}\n{dimensions}\n"
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return hash_text(self._key_prefix + str(text))
+
+    def _lookup(self, texts: List[str]) -> tuple[List[str], dict, dict[str, str]]:
+        """Keys of texts, the cached vectors and the {key: text} misses to embed."""
+        keys = [self._key(text) for text in texts]
+        vectors = self.cache.get_many(set(keys))
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        return keys, vectors, missing
+
+    def _store(
+        self,
+        keys: List[str],
+        vectors: dict,
+        missing: dict[str, str],
+        embeddings: List[List[float]],
+    ) -> List[List[float]]:
+        if missing:
+            new_vectors = {
+                key: np.asarray(vector, dtype=np.float32)
+                for key, vector in zip(missing, embeddings)
+            }
+            self.cache.update(new_vectors)
+            self.cache.save()
+            vectors.update(new_vectors)
+
+        hits = sum(key not in missing for key in keys)
+        self.hits += hits
+        self.misses += len(missing)
+        print(
+            f"Embedding cache: {hits}/{len(keys)} hits ({hits / max(len(keys), 1):.1%}), "
+            f"embedded {len(missing)} texts"
+        )
+        return [np.asarray(vectors[key], dtype=np.float32).tolist() for key in keys]
+
+    def _store_partial(self, missing: dict[str, str], error: PartialEmbeddingError):
+        """Cache the embeddings that did arrive before a failed call is re-raised."""
+        new_vectors = {
+            key: np.asarray(vector, dtype=np.float32)
+            for key, vector in zip(missing, error.embeddings)
+            if vector is not None
+        }
+        self.cache.update(new_vectors)
+        self.cache.save()
+        print(f"Embedding cache: kept {len(new_vectors)} embeddings of a failed call")
+
+    def embed_documents(
+        self, texts: List[str], chunk_size: int | None = None
+    ) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        embeddings = []
+        if missing:
+            try:
+                embeddings = self.embeddings.embed_documents(
+                    list(missing.values()), chunk_size=chunk_size
+                )
+            except PartialEmbeddingError as e:
+                self._store_partial(missing, e)
+                raise
+        return self._store(keys, vectors, missing, embeddings)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        embeddings = []
+        if missing:
+            try:
+                embeddings = await self.embeddings.aembed_documents(
+                    list(missing.values())
+                )
+            except PartialEmbeddingError as e:
+                self._store_partial(missing, e)
+                raise
+        return self._store(keys, vectors, missing, embeddings)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def print_stats(self) -> None:
+        print(
+            f"Embedding cache totals: {self.hits} hits, {self.misses} embedded, "
+            f"hit rate {self.hit_rate():.1%}, {len(self.cache)} vectors cached"
+        )
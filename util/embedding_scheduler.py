@@ -0,0 +1,282 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Sequence
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from openai import AsyncOpenAI
+from util.async_runner import run_sync
+from util.token_counting import get_encoder, get_token_counter
+
+# OpenAI embeddings API limits
+EMBEDDING_INPUT_TOKEN_LIMIT = 8191
+EMBEDDING_REQUEST_TOKEN_LIMIT = 300_000
+EMBEDDING_REQUEST_INPUT_LIMIT = 2048
+
+
+class PartialEmbeddingError(Exception):
+    """
+    Some embedding requests failed after retries. embeddings holds a vector for every
+    text whose requests succeeded and None for the others, so callers can keep them.
+    """
+
+    def __init__(
+        self, embeddings: List[List[float] | None], errors: List[BaseException]
+    ):
+        failed = sum(embedding is None for embedding in embeddings)
+        super().__init__(
+            f"{len(errors)} embedding requests failed, {failed}/{len(embeddings)} "
+            f"texts without embeddings: {errors[0]!r}"
+        )
+        self.embeddings = embeddings
+        self.errors = errors
+
+
+class TokenBudget:
+    """
+    Token bucket for a tokens-per-minute limit shared by concurrent requests. The bucket
+    starts full and refills continuously. Waiters are served in arrival order.
+    """
+
+    def __init__(
+        self, tokens_per_minute: int, clock: Callable[[], float] = time.monotonic
+    ):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60
+        self.clock = clock
+        self._available = float(tokens_per_minute)
+        self._updated = clock()
+        self._lock: asyncio.Lock | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self._available = min(
+            self.capacity, self._available + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self, tokens: int) -> None:
+        # asyncio primitives belong to one event loop, every asyncio.run gets a new one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._lock, self._loop = asyncio.Lock(), loop
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._available < tokens:
+                await asyncio.sleep((tokens - self._available) / self.rate)
+                self._refill()
+            self._available -= tokens
+
+
+def pack_requests(
+    token_counts: Sequence[int],
+    max_request_tokens: int = EMBEDDING_REQUEST_TOKEN_LIMIT,
+    max_inputs: int = EMBEDDING_REQUEST_INPUT_LIMIT,
+) -> List[List[int]]:
+    """
+    Greedily pack inputs, in order, into requests of at most max_request_tokens tokens and
+    max_inputs inputs. Returns the input positions of each request.
+    """
+    requests: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, count in enumerate(token_counts):
+        if current and (
+            current_tokens + count > max_request_tokens or len(current) >= max_inputs
+        ):
+            requests.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += count
+    if current:
+        requests.append(current)
+    return requests
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    Async OpenAI embeddings client that packs texts into requests by their actual token
+    counts and keeps up to max_concurrency requests in flight under a tokens-per-minute
+    budget. The budget is shared by every call on the scheduler, so columns embedded
+    concurrently (embed_columns) together stay under the limit.
+
+    Texts over the per-input limit are split into token windows whose embeddings are
+    averaged (weighted by window length) and normalized, as langchain's OpenAIEmbeddings does.
+    """
+
+    def __init__(
+        self,
+        model: str = "text-embedding-3-large",
+        *,
+        dimensions: int | None = None,
+        tokens_per_minute: int = 1_000_000,
+        max_concurrency: int = 8,
+        max_request_tokens: int = EMBEDDING_REQUEST_TOKEN_LIMIT,
+        max_inputs_per_request: int = EMBEDDING_REQUEST_INPUT_LIMIT,
+        encoding_name: str = "cl100k_base",
+        client_factory: Callable[[], AsyncOpenAI] | None = None,
+        count_tokens: Callable[[List[str]], List[int]] | None = None,
+    ):
+        """
+        Args:
+            model: OpenAI embedding model
+            dimensions: Output dimensions for models that support shortening
+            tokens_per_minute: Token budget shared by all requests
+            max_concurrency: Requests in flight at once
+            max_request_tokens: Tokens per request
+            max_inputs_per_request: Texts per request
+            encoding_name: tiktoken encoding used to count and split texts
+            client_factory: Creates the AsyncOpenAI client, e.g. pointed at a test server
+            count_tokens: Batch token counter. Defaults to the shared TokenCounter.
+        """
+        self.model = model
+        self.dimensions = dimensions
+        self.budget = TokenBudget(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_request_tokens = max_request_tokens
+        self.max_inputs_per_request = max_inputs_per_request
+        self.encoding_name = encoding_name
+        self.client_factory = client_factory or (lambda: AsyncOpenAI(max_retries=6))
+        self.count_tokens = count_tokens or (
+            lambda texts: get_token_counter(encoding_name).count_batch(texts)
+        )
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._client: AsyncOpenAI | None = None
+
+    def _loop_resources(self) -> tuple[asyncio.Semaphore, AsyncOpenAI]:
+        """The semaphore and HTTP client are bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._client = self.client_factory()
+        return self._semaphore, self._client
+
+    def _split(self, texts: List[str]) -> tuple[List[str], List[int], List[int]]:
+        """
+        Split texts into API inputs of at most EMBEDDING_INPUT_TOKEN_LIMIT tokens.
+        Returns the inputs, their token counts and the text position of each input.
+        """
+        counts = self.count_tokens(texts)
+        inputs, input_counts, owners = [], [], []
+        for i, (text, count) in enumerate(zip(texts, counts)):
+            if count <= EMBEDDING_INPUT_TOKEN_LIMIT:
+                inputs.append(text)
+                input_counts.append(count)
+                owners.append(i)
+                continue
+            encoder = get_encoder(self.encoding_name)
+            tokens = encoder.encode_ordinary(text)
+            for start in range(0, len(tokens), EMBEDDING_INPUT_TOKEN_LIMIT):
+                window = tokens[start : start + EMBEDDING_INPUT_TOKEN_LIMIT]
+                inputs.append(encoder.decode(window))
+                input_counts.append(len(window))
+                owners.append(i)
+        return inputs, input_counts, owners
+
+    async def _embed_request(self, inputs: List[str], tokens: int) -> List[List[float]]:
+        semaphore, client = self._loop_resources()
+        await self.budget.acquire(tokens)
+        async with semaphore:
+            kwargs = {"dimensions": self.dimensions} if self.dimensions else {}
+            response = await client.embeddings.create(
+                model=self.model, input=inputs, **kwargs
+            )
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Raises PartialEmbeddingError once all requests are done if any of them failed,
+        carrying the embeddings of the requests that succeeded.
+        """
+        if not texts:
+            return []
+        start_time = time.perf_counter()
+        texts = [str(text) for text in texts]
+        inputs, input_counts, owners = self._split(texts)
+        requests = pack_requests(
+            input_counts, self.max_request_tokens, self.max_inputs_per_request
+        )
+        responses = await asyncio.gather(
+            *(
+                self._embed_request(
+                    [inputs[i] for i in request], sum(input_counts[i] for i in request)
+                )
+                for request in requests
+            ),
+            return_exceptions=True,
+        )
+        errors = [
+            response for response in responses if isinstance(response, BaseException)
+        ]
+        input_embeddings = []
+        for request, response in zip(requests, responses):
+            if isinstance(response, BaseException):
+                input_embeddings.extend([None] * len(request))
+            else:
+                input_embeddings.extend(response)
+
+        if len(inputs) == len(texts):
+            embeddings = input_embeddings
+        else:
+            # Weighted average of the windows of each split text
+            windows: Dict[int, list] = {}
+            for owner, count, vector in zip(owners, input_counts, input_embeddings):
+                windows.setdefault(owner, []).append((count, vector))
+            embeddings = []
+            for i in range(len(texts)):
+                if any(vector is None for _, vector in windows[i]):
+                    embeddings.append(None)
+                elif len(windows[i]) == 1:
+                    embeddings.append(windows[i][0][1])
+                else:
+                    average = sum(
+                        np.asarray(vector) * count for count, vector in windows[i]
+                    )
+                    embeddings.append((average / np.linalg.norm(average)).tolist())
+
+        if errors:
+            raise PartialEmbeddingError(embeddings, errors) from errors[0]
+
+        print(
+            f"Embedded {len(texts)} texts in {len(requests)} requests "
+            f"({sum(input_counts)} tokens) in {time.perf_counter() - start_time:.1f}s"
+        )
+        return embeddings
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_documents(
+        self, texts: List[str], chunk_size: int | None = None
+    ) -> List[List[float]]:
+        """chunk_size is accepted for OpenAIEmbeddings compatibility and ignored."""
+        return run_sync(self.aembed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def embed_columns(
+    embeddings: Embeddings, columns: Dict[str, List[str]]
+) -> Dict[str, List[List[float]]]:
+    """
+    Embed several columns of texts concurrently with embeddings.aembed_documents.
+    With an EmbeddingScheduler (or a cache in front of one) all columns share its
+    token budget and request limit. Every column runs to completion (and is cached)
+    before the first error is raised.
+    """
+
+    async def run() -> List[List[List[float]] | BaseException]:
+        tasks: List[Awaitable] = [
+            embeddings.aembed_documents(texts) for texts in columns.values()
+        ]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = run_sync(run())
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return dict(zip(columns, results))
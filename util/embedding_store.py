@@ -0,0 +1,150 @@
+from pathlib import Path
+from typing import Iterable, List
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from util.parquet_schema import embedding_matrix, is_embedding_column
+
+EMBEDDING_COLUMNS = (
+    "page_content_embedding",
+    "technical_summary_embedding",
+    "primary_content_embedding",
+    "title_embedding",
+)
+
+
+class EmbeddingStore:
+    """
+    Directory of embedding matrices that share one id -> row index:
+
+        ids.parquet          id, plus a has_<column> flag per column (False for missing vectors)
+        <column>.npy         contiguous (rows, dimensions) float32 matrix, NaN rows for missing
+
+    Matrices are opened with np.load(mmap_mode="r"), so only the pages that are touched are
+    read from disk. Slicing by id copies just the selected rows.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        if not (path / "ids.parquet").exists():
+            raise FileNotFoundError(f"No embedding store at {path}")
+        index = pd.read_parquet(path / "ids.parquet")
+        self.ids = pd.Index(index["id"].astype(str), name="id")
+        self._present = {
+            column.removeprefix("has_"): index[column].to_numpy(dtype=bool)
+            for column in index.columns
+            if column.startswith("has_")
+        }
+        self._matrices: dict[str, np.ndarray] = {}
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._present)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def matrix(self, column: str) -> np.ndarray:
+        """The whole memory-mapped (read-only) matrix for column, in ids order."""
+        if column not in self._present:
+            raise KeyError(f"{column} is not in the embedding store {self.path}")
+        if column not in self._matrices:
+            self._matrices[column] = np.load(self.path / f"{column}.npy", mmap_mode="r")
+        return self._matrices[column]
+
+    def present(self, column: str) -> np.ndarray:
+        """Boolean mask over rows that have a vector for column."""
+        return self._present[column]
+
+    def rows(self, ids: Iterable[str]) -> np.ndarray:
+        """Row positions of ids. Raises KeyError for unknown ids."""
+        ids = [str(id) for id in ids]
+        positions = self.ids.get_indexer(ids)
+        if (positions < 0).any():
+            missing = [id for id, position in zip(ids, positions) if position < 0]
+            raise KeyError(f"{len(missing)} ids not in embedding store: {missing[:5]}")
+        return positions
+
+    def get(self, column: str, ids: Iterable[str]) -> np.ndarray:
+        """(len(ids), dimensions) float32 array of the vectors for ids. Missing vectors are NaN."""
+        return np.asarray(self.matrix(column)[self.rows(ids)])
+
+    def get_vectors(self, column: str, ids: Iterable[str]) -> List[np.ndarray | None]:
+        """Per-id vectors, None where the id has no vector for column."""
+        positions = self.rows(ids)
+        vectors = np.asarray(self.matrix(column)[positions])
+        present = self._present[column][positions]
+        return [
+            vector if has_vector else None
+            for vector, has_vector in zip(vectors, present)
+        ]
+
+    @classmethod
+    def from_parquet(
+        cls,
+        parquet_path: Path,
+        path: Path,
+        columns: Iterable[str] = EMBEDDING_COLUMNS,
+        batch_size: int = 4096,
+    ) -> "EmbeddingStore":
+        """
+        Build a store from the embedding columns of a parquet file written with
+        util.parquet_schema. Row batches are streamed into preallocated .npy files, so the
+        full matrices are never held in memory. Columns missing from the file are skipped.
+        """
+        parquet_file = pq.ParquetFile(parquet_path)
+        names = set(parquet_file.schema_arrow.names)
+        columns = [
+            column
+            for column in columns
+            if column in names and is_embedding_column(column)
+        ]
+        ids = pq.read_table(parquet_path, columns=["id"]).column("id").to_pylist()
+        path.mkdir(parents=True, exist_ok=True)
+
+        index = pd.DataFrame({"id": [str(id) for id in ids]})
+        for column in columns:
+            field_type = parquet_file.schema_arrow.field(column).type
+            dimensions = getattr(field_type, "list_size", None)
+            matrix = None
+            present = []
+            start = 0
+            for batch in parquet_file.iter_batches(
+                batch_size=batch_size, columns=[column]
+            ):
+                values = embedding_matrix(batch.column(0))
+                if matrix is None:
+                    dimensions = dimensions or values.shape[1]
+                    matrix = np.lib.format.open_memmap(
+                        path / f"{column}.npy",
+                        mode="w+",
+                        dtype=np.float32,
+                        shape=(len(ids), dimensions),
+                    )
+                matrix[start : start + len(values)] = values
+                present.append(~np.isnan(values).any(axis=1))
+                start += len(values)
+            if matrix is None:
+                continue
+            matrix.flush()
+            del matrix
+            index[f"has_{column}"] = np.concatenate(present)
+            print(f"Wrote {column} ({len(ids)} x {dimensions}) to {path}")
+
+        index.to_parquet(path / "ids.parquet")
+        return cls(path)
+
+    @classmethod
+    def open_or_build(cls, parquet_path: Path, path: Path) -> "EmbeddingStore":
+        """
+        Open the store at path, first (re)building it with from_parquet if it is missing or
+        older than parquet_path, e.g. on an install that predates the store.
+        """
+        ids_path = path / "ids.parquet"
+        if (
+            not ids_path.exists()
+            or ids_path.stat().st_mtime < parquet_path.stat().st_mtime
+        ):
+            print(f"Building embedding store {path} from {parquet_path}")
+            return cls.from_parquet(parquet_path, path)
+        return cls(path)
@@ -0,0 +1,181 @@
+import json
+import logging
+import pickle
+from pathlib import Path
+from typing import List, Literal
+import numpy as np
+import pandas as pd
+from datasketch import MinHashLSH
+from util.nlp import MinHashSignature
+
+# Bump when the signature scheme changes so stale indexes are rebuilt
+MINHASH_INDEX_VERSION = "v3"
+
+DocStatus = Literal["kept", "removed"]
+
+
+class PersistentMinHashIndex:
+    """
+    MinHash LSH index persisted to a folder so deduplication can be incremental across runs.
+
+    Every doc that went through filter_exact_duplicates_minhash is recorded with the hash of
+    its page_content and whether it was kept or removed. Kept docs also have their signature
+    stored and are inserted in the LSH buckets, so later runs only hash the new docs and query
+    them against this index instead of rebuilding MinHashes for the whole corpus. Removed docs
+    record the kept doc they duplicate, and are re-evaluated once that partner is not in the
+    run, changed or removed itself. Docs of other frames are kept, so one index can serve
+    several frames deduplicated separately.
+
+    Files:
+    - meta.json: index version, num_perm, threshold and min_unique_tokens. A mismatch discards
+      the index.
+    - documents.parquet: doc_id, content_hash, status, signature_row (-1 for removed docs),
+      partner_id (None for kept docs)
+    - signatures.npy: kept docs' signatures, one row per signature_row
+    - lsh.pkl: the pickled MinHashLSH with its buckets
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        threshold: float,
+        min_unique_tokens: int,
+        num_perm: int = 1024,
+        logger: logging.Logger | None = None,
+    ):
+        self.path = path
+        self.logger = logger or logging.getLogger(__name__)
+        self.meta = {
+            "version": MINHASH_INDEX_VERSION,
+            "threshold": threshold,
+            "min_unique_tokens": min_unique_tokens,
+            "num_perm": num_perm,
+        }
+        self.documents: dict[str, dict] = {}
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint64)
+        self.lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self._new_signatures: List[np.ndarray] = []
+        # Doc ids of the current run, set by prune()
+        self._run_ids: set[str] | None = None
+
+        meta_path = path / "meta.json"
+        if meta_path.exists():
+            with open(meta_path) as f:
+                stored_meta = json.load(f)
+            if stored_meta == self.meta:
+                self._load()
+            else:
+                self.logger.info(
+                    f"Discarding MinHash index at {path}: parameters changed from {stored_meta} to {self.meta}"
+                )
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def _load(self) -> None:
+        df = pd.read_parquet(self.path / "documents.parquet")
+        self.documents = {
+            row["doc_id"]: {
+                "content_hash": row["content_hash"],
+                "status": row["status"],
+                "signature_row": int(row["signature_row"]),
+                "partner_id": row["partner_id"],
+            }
+            for row in df.to_dict("records")
+        }
+        self.signatures = np.load(self.path / "signatures.npy")
+        with open(self.path / "lsh.pkl", "rb") as f:
+            self.lsh = pickle.load(f)
+
+    def prune(self, content_hashes: dict[str, str]) -> int:
+        """
+        Start a run over content_hashes ({doc_id: content hash}) and forget the docs of the
+        run whose content changed. Returns how many were forgotten.
+
+        Docs not in the run are left alone, so one index can serve runs over different
+        frames (e.g. one per source file). They are not used as partners in this run.
+        """
+        self._run_ids = set(content_hashes)
+        changed = [
+            doc_id
+            for doc_id, content_hash in content_hashes.items()
+            if doc_id in self.documents
+            and self.documents[doc_id]["content_hash"] != content_hash
+        ]
+        for doc_id in changed:
+            self._forget(doc_id)
+        return len(changed)
+
+    def get_status(self, doc_id: str, content_hash: str) -> DocStatus | None:
+        """
+        Previous decision for this doc, or None if it is new, its content changed or it was
+        removed as a duplicate of a doc that is no longer kept or not in the current run.
+        """
+        entry = self.documents.get(doc_id)
+        if entry is None or entry["content_hash"] != content_hash:
+            return None
+        if entry["status"] == "removed":
+            partner_id = entry["partner_id"]
+            partner = self.documents.get(partner_id)
+            if partner is None or partner["status"] != "kept":
+                return None
+            if self._run_ids is not None and partner_id not in self._run_ids:
+                return None
+        return entry["status"]
+
+    def query(self, hashvalues: np.ndarray) -> List[str]:
+        """Doc ids of kept docs whose LSH buckets collide with the signature."""
+        return self.lsh.query(MinHashSignature(hashvalues))
+
+    def _forget(self, doc_id: str) -> None:
+        entry = self.documents.pop(doc_id, None)
+        if entry and entry["status"] == "kept":
+            self.lsh.remove(doc_id)
+
+    def add_kept(self, doc_id: str, content_hash: str, hashvalues: np.ndarray) -> None:
+        self._forget(doc_id)
+        self.lsh.insert(doc_id, MinHashSignature(hashvalues))
+        self.documents[doc_id] = {
+            "content_hash": content_hash,
+            "status": "kept",
+            "signature_row": len(self.signatures) + len(self._new_signatures),
+            "partner_id": None,
+        }
+        self._new_signatures.append(hashvalues)
+
+    def add_removed(self, doc_id: str, content_hash: str, partner_id: str) -> None:
+        """Record doc_id as a duplicate of partner_id, the kept doc it was removed for."""
+        self._forget(doc_id)
+        self.documents[doc_id] = {
+            "content_hash": content_hash,
+            "status": "removed",
+            "signature_row": -1,
+            "partner_id": partner_id,
+        }
+
+    def save(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        if self._new_signatures:
+            self.signatures = np.vstack([self.signatures, *self._new_signatures])
+            self._new_signatures = []
+
+        # Compact away signature rows of docs that were re-indexed or removed since
+        kept = [e for e in self.documents.values() if e["status"] == "kept"]
+        self.signatures = self.signatures[[e["signature_row"] for e in kept]]
+        for row, entry in enumerate(kept):
+            entry["signature_row"] = row
+
+        df = pd.DataFrame(
+            [{"doc_id": doc_id, **entry} for doc_id, entry in self.documents.items()],
+            columns=["doc_id", "content_hash", "status", "signature_row", "partner_id"],
+        )
+        df.to_parquet(self.path / "documents.parquet", index=False)
+        np.save(self.path / "signatures.npy", self.signatures)
+        with open(self.path / "lsh.pkl", "wb") as f:
+            pickle.dump(self.lsh, f)
+        with open(self.path / "meta.json", "w") as f:
+            json.dump(self.meta, f, indent=2)
+        self.logger.info(
+            f"Saved MinHash index with {len(self.documents)} docs to {self.path}"
+        )
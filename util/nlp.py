@@ -3,19 +3,24 @@ import time
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 from datasketch import MinHash
-from typing import List, Literal, Tuple
+from typing import Iterable, List, Literal, Sequence, Tuple
 from nltk.stem import WordNetLemmatizer
 from nltk.corpus import stopwords
 from nltk.corpus import wordnet
 from nltk.corpus import brown
-from rapidfuzz import distance
+from rapidfuzz import distance, process
 import spacy
 import random
 import json
 from textwrap import dedent
 import pandas as pd
-from functools import wraps
-from dataclasses import dataclass
+from functools import lru_cache, wraps
+from concurrent.futures import ProcessPoolExecutor
+import os
+import hashlib
+from pathlib import Path
+import numpy as np
+from scipy.sparse import csr_matrix
 
 ####### ANALYSIS TOOLS #########################################################
 
@@ -113,30 +118,40 @@ def nltk_tokenize(text: str, stop_words: set[str] = DEFAULT_STOPWORDS) -> list[s
     ]
 
 
+LEMMATIZER_STOPWORDS = [
+    "um",
+    "uh",
+    "uhm",
+    "let",
+    "go",
+    "yeah",
+    "ok",
+    "okay",
+    "stuff",
+    "really",
+    "alot",
+    "lot",
+    "thing",
+    "well",
+]
+# Bump when nltk_get_lemmatized_tokens changes so on-disk token caches are invalidated
+LEMMATIZER_VERSION = "v1"
+
+
+@lru_cache(maxsize=1)
+def _get_lemmatizer_resources() -> tuple[frozenset[str], WordNetLemmatizer]:
+    """Build the stopword set and lemmatizer once per process."""
+    stop_words = set(stopwords.words("english"))
+    stop_words.update(LEMMATIZER_STOPWORDS)
+    return frozenset(stop_words), WordNetLemmatizer()
+
+
 def nltk_get_lemmatized_tokens(text: str) -> List[str]:
     """
     Tokenize using NLTK, less strict with stop words
     Significantly faster and less memory intensive than spaCy
     """
-    stop_words = set(stopwords.words("english"))
-    stop_words.update(
-        [
-            "um",
-            "uh",
-            "uhm",
-            "let",
-            "go",
-            "yeah",
-            "ok",
-            "okay",
-            "stuff",
-            "really",
-            "alot",
-            "lot",
-            "thing",
-            "well",
-        ]
-    )
+    stop_words, lemmatizer = _get_lemmatizer_resources()
 
     tokens = nltk.wordpunct_tokenize(text.lower())
     tokens = [
@@ -146,7 +161,6 @@ def nltk_get_lemmatized_tokens(text: str) -> List[str]:
     ]
 
     pos_tagged_tokens = nltk.pos_tag(tokens)
-    lemmatizer = WordNetLemmatizer()
 
     return [
         lemmatizer.lemmatize(token, nltk_get_pos_tag(pos))
@@ -154,6 +168,23 @@ def nltk_get_lemmatized_tokens(text: str) -> List[str]:
     ]
 
 
+def nltk_get_lemmatized_tokens_parallel(
+    texts: List[str], *, workers: int | None = None, chunk_size: int = 64
+) -> List[List[str]]:
+    """
+    Run nltk_get_lemmatized_tokens over many texts in a process pool.
+    Each worker builds its NLTK resources once and receives texts in chunks.
+    Falls back to a plain loop for a single worker or a handful of texts.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(texts) <= chunk_size:
+        return [nltk_get_lemmatized_tokens(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(nltk_get_lemmatized_tokens, texts, chunksize=chunk_size)
+        )
+
+
 def chunk_wordset(wordset: List[str], ngram: int) -> List[str]:
     return [" ".join(wordset[i : i + ngram]) for i in range(0, len(wordset), ngram)]
 
@@ -230,37 +261,497 @@ def compute_simple_jaccard(tokens_a: List[str], tokens_b: List[str]) -> float:
 ###### Dedupe ################################################################
 
 
-def get_duplicate_candidates_cosine(tokenized_corpus: List[List[str]]) -> set[int]:
+class DisjointSet:
+    """Union-find over 0..n-1 with union by size and path halving (near-constant time per op)."""
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int) -> int:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        return root_a
+
+    def groups(self, min_size: int = 2) -> List[List[int]]:
+        """Connected components with at least min_size members, members in ascending order."""
+        components: dict[int, List[int]] = {}
+        for x in range(len(self.parent)):
+            root = self.find(x)
+            if self.size[root] >= min_size:
+                components.setdefault(root, []).append(x)
+        return sorted(components.values())
+
+
+def _min_required_overlap(set_size: int, threshold: float) -> int:
+    """
+    Smallest overlap o such that o / set_size > threshold, using the same float
+    comparison as compute_simple_precision so the join never disagrees with it.
+    """
+    overlap = max(1, int(threshold * set_size))
+    while overlap <= set_size and overlap / set_size <= threshold:
+        overlap += 1
+    while overlap > 1 and (overlap - 1) / set_size > threshold:
+        overlap -= 1
+    return overlap
+
+
+def get_simple_precision_join_pairs(
+    token_sets: List[set],
+    threshold: float,
+) -> List[Tuple[int, int, float]]:
+    """
+    Set-similarity join for simple precision (overlap / min set size).
+
+    Returns every (i, j, precision) with i < j and precision > threshold, exactly
+    matching the pairwise loop over compute_simple_precision, but only verifying
+    pairs that share a token in a filtering prefix.
+
+    Tokens are ordered globally by document frequency (rarest first). Docs are
+    processed by ascending set size, so when a doc is probed every indexed doc is
+    the smaller side of the pair and determines the min in the denominator. If
+    |s & r| >= o then the first |s| - o + 1 tokens of s must contain a shared
+    token, so only that prefix of s needs to be in the inverted index.
+    """
+    doc_freq: dict = {}
+    for token_set in token_sets:
+        for token in token_set:
+            doc_freq[token] = doc_freq.get(token, 0) + 1
+
+    order = sorted(range(len(token_sets)), key=lambda i: (len(token_sets[i]), i))
+    inverted_index: dict = {}
+    pairs = []
+    for i in order:
+        tokens_i = token_sets[i]
+        if not tokens_i:
+            continue
+
+        # Probe: every indexed doc sharing a prefix token is a candidate
+        candidates = set()
+        for token in tokens_i:
+            posting = inverted_index.get(token)
+            if posting:
+                candidates.update(posting)
+
+        for j in candidates:
+            tokens_j = token_sets[j]
+            precision = len(tokens_i & tokens_j) / min(len(tokens_i), len(tokens_j))
+            if precision > threshold:
+                pairs.append((min(i, j), max(i, j), precision))
+
+        # Index: future partners are at least as large, so this doc is the min side
+        required_overlap = _min_required_overlap(len(tokens_i), threshold)
+        prefix_length = len(tokens_i) - required_overlap + 1
+        if prefix_length <= 0:
+            continue
+        prefix = sorted(tokens_i, key=lambda t: (doc_freq[t], t))[:prefix_length]
+        for token in prefix:
+            inverted_index.setdefault(token, []).append(i)
+
+    pairs.sort()
+    return pairs
+
+
+def build_binary_token_matrix(token_sets: List[set]) -> csr_matrix:
+    """
+    Encode each token set as a row of a binary CSR matrix (docs x vocabulary).
+    Row i dotted with row j is the size of the intersection of the two sets.
+    """
+    vocabulary: dict = {}
+    indptr = [0]
+    indices: List[int] = []
+    for token_set in token_sets:
+        for token in token_set:
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.int32)
+    return csr_matrix(
+        (data, np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+        shape=(len(token_sets), len(vocabulary)),
+    )
+
+
+def get_blocked_pairwise_scores(
+    matrix: csr_matrix,
+    threshold: float,
+    *,
+    metric: Literal["precision", "dot"] = "precision",
+    block_size: int = 2048,
+) -> List[Tuple[int, int, float]]:
+    """
+    Score every pair of rows with one sparse product per row block and return
+    (i, j, score) for i < j where score > threshold.
+
+    metric="precision" expects a binary matrix and divides the intersection
+    counts by the smaller row size. metric="dot" returns the raw dot products,
+    which is cosine similarity for L2-normalized rows (e.g. TfidfVectorizer).
+    Each block is only multiplied against itself and the rows after it, so
+    memory is bounded by block_size x n_docs.
+    """
+    matrix = csr_matrix(matrix)
+    row_sizes = np.diff(matrix.indptr)
+    pairs = []
+    for start in range(0, matrix.shape[0], block_size):
+        stop = min(start + block_size, matrix.shape[0])
+        block = (matrix[start:stop] @ matrix[start:].T).tocoo()
+        rows = block.row + start
+        cols = block.col + start
+        upper = cols > rows
+        rows, cols = rows[upper], cols[upper]
+        values = block.data[upper].astype(np.float64)
+        if metric == "precision":
+            values = values / np.minimum(row_sizes[rows], row_sizes[cols])
+        keep = values > threshold
+        pairs.extend(
+            zip(rows[keep].tolist(), cols[keep].tolist(), values[keep].tolist())
+        )
+    pairs.sort()
+    return pairs
+
+
+def get_blocked_cosine_pairs(
+    vectors: np.ndarray,
+    threshold: float,
+    *,
+    groups: np.ndarray | None = None,
+    block_size: int = 2048,
+) -> List[Tuple[int, int, float]]:
+    """
+    Exact all-pairs cosine search over dense vectors (e.g. embeddings) with blocked
+    matrix products. Returns (i, j, cosine) for i < j where cosine > threshold.
+
+    Rows are L2-normalized into float32 once and every block_size x block_size tile
+    of the upper triangle is one matmul, so memory stays at a few tiles.
+    If groups is given (one label per row), only pairs with different labels are returned.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    n = len(vectors)
+    pairs = []
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        for col_start in range(start, n, block_size):
+            col_stop = min(col_start + block_size, n)
+            scores = vectors[start:stop] @ vectors[col_start:col_stop].T
+            rows, cols = np.nonzero(scores > threshold)
+            values = scores[rows, cols]
+            rows, cols = rows + start, cols + col_start
+            keep = cols > rows
+            if groups is not None:
+                keep &= groups[rows] != groups[cols]
+            pairs.extend(
+                zip(
+                    rows[keep].tolist(),
+                    cols[keep].tolist(),
+                    values[keep].astype(np.float64).tolist(),
+                )
+            )
+    pairs.sort()
+    return pairs
+
+
+def get_duplicate_candidates_cosine(
+    tokenized_corpus: List[List[str]],
+    threshold: float = 0.8,
+    block_size: int = 2048,
+) -> set[int]:
     """
     Use cosine similarity to find duplicate candidates
     """
-    candidates = set()
     # Join tokens back into strings for TfidfVectorizer
     texts = [" ".join(tokens) for tokens in tokenized_corpus]
     vectorizer = TfidfVectorizer()
     tfidf = vectorizer.fit_transform(texts)
 
-    for i in range(len(texts)):
-        for j in range(i + 1, len(texts)):
-            if cosine_similarity(tfidf[i : i + 1], tfidf[j : j + 1])[0, 0] > 0.8:  # type: ignore
-                candidates.add(i)
-                candidates.add(j)
+    # Rows are L2-normalized so the dot product is the cosine similarity
+    candidates = set()
+    for i, j, _ in get_blocked_pairwise_scores(
+        tfidf, threshold, metric="dot", block_size=block_size
+    ):
+        candidates.add(i)
+        candidates.add(j)
     return candidates
 
 
-@dataclass
+MINHASH_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MINHASH_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer. Spreads integer keys uniformly over 64 bits (wraps on overflow)."""
+    x = values.astype(np.uint64, copy=True)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+@lru_cache(maxsize=8)
+def _get_minhash_permutations(
+    num_perm: int, seed: int = 1
+) -> tuple[np.ndarray, np.ndarray]:
+    """Universal hash parameters (a, b) for h -> (a * h + b) mod p, same scheme as datasketch's legacy MinHash."""
+    gen = np.random.RandomState(seed)
+    a = gen.randint(1, MINHASH_MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = gen.randint(0, MINHASH_MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+class MinHashSignature:
+    """Minimal MinHash stand-in accepted by datasketch MinHashLSH insert/query."""
+
+    __slots__ = ("hashvalues",)
+
+    def __init__(self, hashvalues: np.ndarray):
+        self.hashvalues = hashvalues
+
+    def __len__(self) -> int:
+        return len(self.hashvalues)
+
+
+def get_minhash_band_keys(signatures: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    """
+    LSH bucket keys (len(signatures) x bands) for signatures split into bands of rows.
+    Two docs share a datasketch MinHashLSH bucket for a band when its hash values are all
+    equal, which here means equal keys up to 64-bit hash collisions. Band numbers are mixed in
+    so keys of different bands never collide.
+    """
+    keys = np.empty((len(signatures), bands), dtype=np.uint64)
+    for band in range(bands):
+        key = np.full(len(signatures), band, dtype=np.uint64)
+        for column in range(band * rows, (band + 1) * rows):
+            key = _mix64(key ^ signatures[:, column])
+        keys[:, band] = key
+    return keys
+
+
+class TokenizedCorpus:
+    """
+    Corpus-level token store shared by all TokenizedDocs of a dedup run.
+
+    Every distinct token is stored once in the vocabulary and each doc is a slice
+    of one flat int32 buffer of token ids (token_ids[offsets[i]:offsets[i + 1]]).
+    N-gram hash arrays are computed once per (ngram, shift) and reused by MinHash,
+    the precision scorers and the fuzzy confirmation stage.
+    """
+
+    def __init__(
+        self, doc_ids: List[str], texts: List[str], token_lists: Iterable[List[str]]
+    ):
+        vocabulary: dict[str, int] = {}
+        token_ids: List[int] = []
+        offsets = [0]
+        for tokens in token_lists:
+            token_ids.extend(vocabulary.setdefault(t, len(vocabulary)) for t in tokens)
+            offsets.append(len(token_ids))
+
+        self.doc_ids = doc_ids
+        self.texts = texts
+        self.vocabulary = list(vocabulary)
+        self.token_ids = np.array(token_ids, dtype=np.int32)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self._ngram_hashes: dict[
+            tuple[int, int, bool], tuple[np.ndarray, np.ndarray]
+        ] = {}
+        self._stable_token_hashes: np.ndarray | None = None
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def docs(self) -> List["TokenizedDoc"]:
+        return [TokenizedDoc(self, i) for i in range(len(self))]
+
+    def get_token_ids(self, i: int) -> np.ndarray:
+        return self.token_ids[self.offsets[i] : self.offsets[i + 1]]
+
+    def get_tokens(self, i: int) -> List[str]:
+        return [self.vocabulary[t] for t in self.get_token_ids(i).tolist()]
+
+    def get_joined_tokens(self, i: int) -> str:
+        return " ".join(self.get_tokens(i))
+
+    def get_token_counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def get_unique_token_counts(self) -> np.ndarray:
+        return np.array(
+            [len(np.unique(self.get_token_ids(i))) for i in range(len(self))],
+            dtype=np.int64,
+        )
+
+    def get_stable_token_hashes(self) -> np.ndarray:
+        """
+        One uint64 per vocabulary entry derived from the token text only, so hashes agree
+        between corpora (batches, runs) that assign different token ids to the same token.
+        """
+        if self._stable_token_hashes is None:
+            self._stable_token_hashes = np.array(
+                [
+                    int.from_bytes(
+                        hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(),
+                        "little",
+                    )
+                    for token in self.vocabulary
+                ],
+                dtype=np.uint64,
+            )
+        return self._stable_token_hashes
+
+    def get_ngram_hashes(
+        self, ngram: int = 1, shift: int | None = None, *, stable: bool = False
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (hashes, offsets): one uint64 per chunk of chunk_wordset(tokens[shift:], ngram)
+        for every doc, flattened like token_ids. Equal chunks always get equal hashes, and
+        the hashes are exact (collision free) whenever vocab_size ** ngram fits in 64 bits.
+        With stable=True the hashes are built from get_stable_token_hashes instead of token ids,
+        so they can be compared across corpora (never exact).
+        As with get_chunked_tokens, shift is ignored for unigrams.
+        """
+        shift = (shift or 0) if ngram > 1 else 0
+        key = (ngram, shift, stable)
+        if key in self._ngram_hashes:
+            return self._ngram_hashes[key]
+
+        token_values = (
+            self.get_stable_token_hashes()[self.token_ids]
+            if stable
+            # +1 so padding (0) in a trailing partial chunk never equals a real token
+            else self.token_ids.astype(np.uint64) + np.uint64(1)
+        )
+        if ngram == 1:
+            result = (
+                token_values if stable else self.token_ids.astype(np.uint64),
+                self.offsets,
+            )
+            self._ngram_hashes[key] = result
+            return result
+
+        base = len(self.vocabulary) + 1
+        exact = not stable and base**ngram < 2**64
+        chunks: List[np.ndarray] = []
+        offsets = [0]
+        for i in range(len(self)):
+            values = token_values[self.offsets[i] : self.offsets[i + 1]][shift:]
+            n_chunks = -(-len(values) // ngram)
+            padded = np.zeros(n_chunks * ngram, dtype=np.uint64)
+            padded[: len(values)] = values
+            padded = padded.reshape(n_chunks, ngram)
+            hashes = np.zeros(n_chunks, dtype=np.uint64)
+            for col in range(ngram):
+                if exact:
+                    hashes = hashes * np.uint64(base) + padded[:, col]
+                elif stable:
+                    hashes = _mix64(hashes ^ padded[:, col])
+                else:
+                    hashes = _mix64(hashes * np.uint64(base) + padded[:, col])
+            chunks.append(hashes)
+            offsets.append(offsets[-1] + n_chunks)
+
+        result = (
+            np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint64),
+            np.array(offsets, dtype=np.int64),
+        )
+        self._ngram_hashes[key] = result
+        return result
+
+    def get_ngram_sets(self, indices: Iterable[int], ngram: int = 1) -> List[set]:
+        hashes, offsets = self.get_ngram_hashes(ngram)
+        return [set(hashes[offsets[i] : offsets[i + 1]].tolist()) for i in indices]
+
+    def get_binary_ngram_matrix(
+        self, indices: Sequence[int], ngram: int = 1
+    ) -> csr_matrix:
+        """Binary docs x n-grams CSR matrix for the given docs (see build_binary_token_matrix)."""
+        hashes, offsets = self.get_ngram_hashes(ngram)
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = offsets[indices + 1] - offsets[indices]
+        rows = np.repeat(np.arange(len(indices)), lengths)
+        segments = [hashes[offsets[i] : offsets[i + 1]] for i in indices]
+        values = np.concatenate(segments) if segments else np.zeros(0, np.uint64)
+        _, cols = np.unique(values, return_inverse=True)
+        matrix = csr_matrix(
+            (np.ones(len(values), dtype=np.int32), (rows, cols.ravel())),
+            shape=(len(indices), int(cols.max()) + 1 if len(cols) else 0),
+        )
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return matrix
+
+    def get_minhash_signatures(
+        self,
+        indices: Sequence[int],
+        *,
+        ngram: int = 2,
+        shift: int | None = None,
+        num_perm: int = 1024,
+        seed: int = 1,
+        rows_per_step: int = 4096,
+    ) -> np.ndarray:
+        """
+        MinHash signatures (len(indices) x num_perm) computed straight from the n-gram hash arrays.
+        Uses the stable n-gram hashes, so signatures of different corpora are comparable.
+        Docs without n-grams get the empty signature (all MINHASH_MAX_HASH), like an empty MinHash.
+        """
+        a, b = _get_minhash_permutations(num_perm, seed)
+        hashes, offsets = self.get_ngram_hashes(ngram, shift, stable=True)
+        signatures = np.full(
+            (len(indices), num_perm), MINHASH_MAX_HASH, dtype=np.uint64
+        )
+        for row, i in enumerate(indices):
+            hv = _mix64(hashes[offsets[i] : offsets[i + 1]]) & MINHASH_MAX_HASH
+            for start in range(0, len(hv), rows_per_step):
+                step = hv[start : start + rows_per_step, None]
+                phv = ((step * a + b) % MINHASH_MERSENNE_PRIME) & MINHASH_MAX_HASH
+                signatures[row] = np.minimum(signatures[row], phv.min(axis=0))
+        return signatures
+
+
 class TokenizedDoc:
-    """Associates tokenized text with original document ID"""
+    """Associates tokenized text with original document ID. A view of one doc in a TokenizedCorpus."""
+
+    __slots__ = ("corpus", "index")
+
+    def __init__(self, corpus: TokenizedCorpus, index: int):
+        self.corpus = corpus
+        self.index = index
 
-    doc_id: str
-    tokens: List[str]
+    def __repr__(self) -> str:
+        return f"TokenizedDoc(doc_id={self.doc_id!r}, token_count={self.token_count})"
+
+    @property
+    def doc_id(self) -> str:
+        return self.corpus.doc_ids[self.index]
+
+    @property
+    def original_text(self) -> str:
+        return self.corpus.texts[self.index]
+
+    @property
+    def tokens(self) -> List[str]:
+        return self.corpus.get_tokens(self.index)
+
+    @property
+    def token_count(self) -> int:
+        return int(
+            self.corpus.offsets[self.index + 1] - self.corpus.offsets[self.index]
+        )
 
-    def __init__(self, df_row: pd.Series):
-        self.doc_id = df_row["id"]
-        self.original_text = df_row["page_content"]
-        self.df_row = df_row
-        self.tokens = nltk_get_lemmatized_tokens(self.original_text)
-        
     def get_chunked_tokens(self, ngram: int = 1, shift: int | None = None) -> list[str]:
         if ngram == 1:
             return self.tokens
@@ -277,6 +768,18 @@ class TokenizedDoc:
         return [token.encode("utf8") for token in self.get_chunked_tokens(ngram, shift)]
 
 
+def get_docs_corpus_indices(
+    docs: List[TokenizedDoc],
+) -> tuple[TokenizedCorpus | None, np.ndarray]:
+    """Return the shared corpus of a list of TokenizedDocs and their row indices in it."""
+    if not docs:
+        return None, np.zeros(0, dtype=np.int64)
+    corpus = docs[0].corpus
+    if any(doc.corpus is not corpus for doc in docs):
+        raise ValueError("All TokenizedDocs must belong to the same TokenizedCorpus")
+    return corpus, np.array([doc.index for doc in docs], dtype=np.int64)
+
+
 # currently unused
 @timer("Candidates Minhash")
 def get_duplicate_candidates_minhash_precision(
@@ -311,128 +814,182 @@ def get_duplicate_candidates_minhash_precision(
 STOP_ENTITIES = ["pepwave", "peplink"]
 
 
+def _min_length_ratio(similarity_threshold: float) -> float:
+    """
+    Smallest len(shorter) / len(longer) two strings can have and still reach the Jaro-Winkler
+    similarity threshold. Jaro is at most (2 + ratio) / 3 and the Winkler prefix bonus adds at
+    most 0.4 * (1 - jaro), so pairs below this ratio can be skipped without changing results.
+    """
+    min_jaro = (similarity_threshold - 0.4) / 0.6
+    return max(0.0, 3 * min_jaro - 2)
+
+
+def build_canonical_mapping(
+    values: Iterable[str],
+    *,
+    similarity_threshold: float = 0.95,
+    stop_entities: Sequence[str] = (),
+    stop_threshold: float = 0.9,
+    prefix_length: int = 1,
+    tile_size: int = 2048,
+) -> dict[str, str | None]:
+    """
+    Map every distinct value of a corpus to a canonical spelling (None for stop entities).
+
+    Near-identical values (Jaro-Winkler similarity >= similarity_threshold) are compared with
+    rapidfuzz process.cdist only within blocks sharing their first prefix_length characters,
+    and within a block only against values whose length ratio can reach the threshold.
+    Values are clustered greedily in order of frequency: the most frequent unassigned value
+    claims its unassigned neighbours, and the shortest member of each cluster is its canonical
+    form. Every row of the corpus then resolves a variant the same way.
+    """
+    counts = pd.Series(list(values), dtype=object).value_counts(sort=False)
+    vocabulary = [str(value) for value in counts.index]
+    frequency = dict(zip(vocabulary, counts.tolist()))
+    mapping: dict[str, str | None] = {}
+
+    if stop_entities and vocabulary:
+        stop_scores = process.cdist(
+            vocabulary,
+            list(stop_entities),
+            scorer=distance.JaroWinkler.normalized_similarity,
+            dtype=np.float64,
+            workers=-1,
+        )
+        is_stop = stop_scores.max(axis=1) > stop_threshold
+        for value in np.array(vocabulary, dtype=object)[is_stop]:
+            mapping[value] = None
+        vocabulary = [value for value in vocabulary if value not in mapping]
+
+    min_ratio = _min_length_ratio(similarity_threshold)
+    blocks: dict[str, List[str]] = {}
+    for value in vocabulary:
+        blocks.setdefault(value[:prefix_length], []).append(value)
+
+    neighbours: dict[str, List[str]] = {value: [] for value in vocabulary}
+    for block in blocks.values():
+        if len(block) < 2:
+            continue
+        block.sort(key=len)
+        lengths = np.array([len(value) for value in block])
+        for start in range(0, len(block), tile_size):
+            stop = min(start + tile_size, len(block))
+            # Longest value in the tile bounds how long a match can be
+            col_stop = int(
+                np.searchsorted(
+                    lengths, lengths[stop - 1] / max(min_ratio, 1e-9), side="right"
+                )
+            )
+            scores = process.cdist(
+                block[start:stop],
+                block[start:col_stop],
+                scorer=distance.JaroWinkler.normalized_similarity,
+                # No score_cutoff: rapidfuzz's Jaro-Winkler early exit can zero scores near it
+                dtype=np.float64,
+                workers=-1,
+            )
+            rows, cols = np.nonzero(scores >= similarity_threshold)
+            for row, col in zip((rows + start).tolist(), (cols + start).tolist()):
+                if row != col:
+                    neighbours[block[row]].append(block[col])
+                    neighbours[block[col]].append(block[row])
+
+    for center in sorted(vocabulary, key=lambda value: (-frequency[value], value)):
+        if center in mapping:
+            continue
+        cluster = [center] + [
+            value for value in neighbours[center] if value not in mapping
+        ]
+        canonical = min(cluster, key=lambda value: (len(value), value))
+        for value in cluster:
+            mapping[value] = canonical
+    return mapping
+
+
+def _parse_list(value) -> list:
+    if isinstance(value, str):
+        return json.loads(value)
+    if value is None or (np.ndim(value) == 0 and pd.isna(value)):
+        return []
+    return list(value)
+
+
+def _map_lists(series: pd.Series, mapping: dict[str, str | None]) -> List[list]:
+    """Replace each element through mapping, dropping None and repeated canonical values."""
+    exploded = series.reset_index(drop=True).explode()
+    mapped = exploded.map(mapping).dropna()
+    grouped = mapped.groupby(level=0, sort=False).agg(lambda x: list(dict.fromkeys(x)))
+    return grouped.reindex(range(len(series))).apply(
+        lambda x: x if isinstance(x, list) else []
+    ).tolist()
+
+
 def normalize_entities_and_themes(
-    df: pd.DataFrame, similarity_threshold: float = 0.95
+    df: pd.DataFrame,
+    similarity_threshold: float = 0.95,
+    mapping_path: Path | None = None,
 ) -> pd.DataFrame:
     """
-    Normalize the entities column by merging nearly identical elements
-    using JARO_WINKLER distance comparison.
+    Normalize the entities (and themes, if present) columns by merging nearly identical
+    elements using JARO_WINKLER similarity over the whole corpus.
+
+    The variant -> canonical mapping is built once per column with build_canonical_mapping,
+    so a variant is normalized the same way in every row, and each row becomes a dictionary
+    lookup. Entities similar to STOP_ENTITIES are dropped. The original lists are kept in
+    <column>_pre_normalization.
 
     Args:
         df: DataFrame with entities column
         similarity_threshold: Threshold for considering two strings similar (default: 0.95)
+        mapping_path: Write the mapping table (column, variant, canonical) to this parquet file
 
     Returns:
         DataFrame with normalized entities
     """
-
-    def skip_stop_entity(entity: str, threshold: float = 0.9) -> bool:
-        should_skip = any(
-            1 - distance.JaroWinkler.distance(entity, stop_entity) > threshold
-            for stop_entity in STOP_ENTITIES
-        )
-        if should_skip:
-            print(f"Skipping stop entity: {entity}")
-        return should_skip
-
-    df["entities_pre_normalization"] = df["entities"]
     df = df.copy()
-    df["entities"] = df["entities"].apply(
-        lambda x: json.loads(x) if pd.notna(x) else []
-    )
-    df["entities"] = df["entities"].apply(lambda x: [str(item).lower() for item in x])
-    df["entities"] = df["entities"].apply(
-        lambda x: [item for item in x if not skip_stop_entity(item, 0.9)]
-    )
-
-    def normalize_list(elements) -> tuple[list, list]:
-        # Track all merges to report later
-        merges = []
-
-        # Step 1: Group similar items
-        similarity_groups = []
-        processed = set()
-
-        # Create groups of similar items
-        for i, item in enumerate(elements):
-            if i in processed or not item:
-                continue
 
-            # Start a new group with this item
-            group = [item]
-            processed.add(i)
-
-            # Find similar items
-            for j, other_item in enumerate(elements[i + 1 :], i + 1):
-                if j in processed or not other_item:
-                    continue
-
-                # Calculate similarity using JARO_WINKLER
-                try:
-                    similarity = 1 - distance.JaroWinkler.distance(
-                        str(item).lower(), str(other_item).lower()
-                    )
+    tables = []
+    for column, stop_entities in [("entities", STOP_ENTITIES), ("themes", [])]:
+        if column not in df.columns:
+            continue
+        df[f"{column}_pre_normalization"] = df[column]
+        lists = df[column].apply(_parse_list).apply(
+            lambda x: [str(item).lower() for item in x]
+        )
+        mapping = build_canonical_mapping(
+            (item for items in lists for item in items),
+            similarity_threshold=similarity_threshold,
+            stop_entities=stop_entities,
+        )
+        df[column] = _map_lists(lists, mapping)
+
+        merged = {
+            variant: canonical
+            for variant, canonical in mapping.items()
+            if canonical is not None and variant != canonical
+        }
+        dropped = [variant for variant, canonical in mapping.items() if canonical is None]
+        print(f"\n===== {column.capitalize()} Normalization Report =====")
+        print(f"Using similarity threshold: {similarity_threshold}")
+        print(f"Vocabulary: {len(mapping)}, merged variants: {len(merged)}")
+        if dropped:
+            print(f"Skipped stop entities: {dropped}")
+        for i, (variant, canonical) in enumerate(sorted(merged.items()), 1):
+            print(f'  {i}. Merged "{variant}" → "{canonical}"')
+        print("===============================================\n")
+
+        tables.append(
+            pd.DataFrame(
+                {
+                    "column": column,
+                    "variant": list(mapping.keys()),
+                    "canonical": list(mapping.values()),
+                }
+            )
+        )
 
-                    if similarity >= similarity_threshold:
-                        group.append(other_item)
-                        processed.add(j)
-                except Exception as e:
-                    print(f"Error comparing {item} and {other_item}: {str(e)}")
-                    continue
-
-            similarity_groups.append(group)
-
-        # Step 2: Merge each group, keeping the shortest lowercase version
-        normalized = []
-        for group in similarity_groups:
-            if len(group) == 1:
-                normalized.append(group[0])
-            else:
-                # Find item with shortest lowercase form
-                try:
-                    shortest = min(group, key=lambda x: len(str(x).lower()))
-
-                    # Record the merge
-                    if len(group) > 1:
-                        merges.append(
-                            {
-                                "merged_items": sorted(group, key=lambda x: str(x)),
-                                "into": shortest,
-                                "similarity_threshold": similarity_threshold,
-                            }
-                        )
-                except Exception as e:
-                    print(f"Error finding shortest item in {group}: {str(e)}")
-                    shortest = group[0]  # Fall back to first item
-
-                normalized.append(shortest)
-
-        return normalized, merges
-
-    all_merges = []
-    normalized_entities = []
-
-    # Apply normalization to entities column
-    for idx, row_entities in enumerate(df["entities"]):
-        try:
-            norm_entities, merges = normalize_list(row_entities)
-            normalized_entities.append(norm_entities)
-            all_merges.extend(merges)
-        except Exception as e:
-            print(f"Error normalizing entities in row {idx}: {str(e)}")
-            print(f"Value: {row_entities}")
-            normalized_entities.append(row_entities)  # Keep original on error
-
-    df["entities"] = normalized_entities
-
-    print(f"\n===== Entity Normalization Report =====")
-    print(f"Using similarity threshold: {similarity_threshold}")
-    print(f"Total merges performed: {len(all_merges)}")
-
-    for i, merge in enumerate(all_merges, 1):
-        items_str = ", ".join(f'"{item}"' for item in merge["merged_items"])
-        print(f"  {i}. Merged [{items_str}] → \"{merge['into']}\"")
-
-    print("===============================================\n")
+    if mapping_path is not None and tables:
+        pd.concat(tables, ignore_index=True).to_parquet(mapping_path, index=False)
+        print(f"Saved canonical mapping to {mapping_path}")
 
     return df
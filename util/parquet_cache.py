@@ -0,0 +1,175 @@
+import bisect
+import hashlib
+from pathlib import Path
+from typing import Any, Iterable
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+def hash_text(text: str) -> str:
+    """Deterministic content hash used as a cache key for a piece of text."""
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()
+
+
+class ParquetCache:
+    """
+    Dict-like on-disk cache stored as a directory of append-only parquet shards of
+    (key, value) rows. Values can be anything pyarrow can store in a column (strings,
+    lists of strings, lists of floats).
+
+    New entries are held in memory until save() writes them as one new shard sorted by
+    key, so existing data is never rewritten. When a key is in several shards the newest
+    one wins.
+
+    With load_values (small values such as token lists) every value is read on init. Without
+    it only the keys are, and values are read on demand from the row groups whose key range
+    can contain them (embeddings, batch results), so memory does not grow with the cache.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        load_values: bool = True,
+        row_group_size: int = 1024,
+        max_shards: int = 16,
+    ):
+        """
+        Args:
+            path: Cache directory. A single-file cache from older versions is moved into it.
+            load_values: Keep every value in memory instead of reading them on demand
+            row_group_size: Rows per row group of a shard, the unit of on-demand reads
+            max_shards: With load_values, shards are compacted into one above this count
+        """
+        self.path = path
+        self.load_values = load_values
+        self.row_group_size = row_group_size
+        self.max_shards = max_shards
+        self._entries: dict[str, Any] = {}
+        self._key_shards: dict[str, int] = {}
+        self._pending: dict[str, Any] = {}
+        self.hits = 0
+        self.misses = 0
+
+        if path.is_file():
+            legacy_path = path.with_name(path.name + ".legacy")
+            path.rename(legacy_path)
+            path.mkdir()
+            legacy_path.rename(path / "part-00000.parquet")
+        self._shards = sorted(path.glob("part-*.parquet")) if path.exists() else []
+        for index, shard in enumerate(self._shards):
+            if load_values:
+                df = pd.read_parquet(shard)
+                self._entries.update(zip(df["key"], df["value"]))
+            else:
+                keys = pq.read_table(shard, columns=["key"]).column("key").to_pylist()
+                self._key_shards.update(dict.fromkeys(keys, index))
+
+    def __len__(self) -> int:
+        stored = self._entries if self.load_values else self._key_shards
+        return len(stored) + sum(key not in stored for key in self._pending)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._pending or key in self._entries or key in self._key_shards
+
+    @property
+    def pending_count(self) -> int:
+        """Entries not yet written by save()."""
+        return len(self._pending)
+
+    def _read_shard(self, index: int, keys: list[str]) -> dict[str, Any]:
+        """Values of keys (sorted) from the row groups of a shard that can hold them."""
+        shard = pq.ParquetFile(self._shards[index])
+        key_column = shard.schema_arrow.get_field_index("key")
+        row_groups = []
+        for i in range(shard.metadata.num_row_groups):
+            stats = shard.metadata.row_group(i).column(key_column).statistics
+            if stats is None or not stats.has_min_max:
+                row_groups.append(i)
+                continue
+            position = bisect.bisect_left(keys, stats.min)
+            if position < len(keys) and keys[position] <= stats.max:
+                row_groups.append(i)
+        if not row_groups:
+            return {}
+        table = shard.read_row_groups(row_groups, columns=["key", "value"])
+        table = table.filter(pc.is_in(table["key"], pa.array(keys)))
+        return dict(
+            zip(table.column("key").to_pylist(), table.column("value").to_pandas())
+        )
+
+    def _lookup(self, keys: list[str]) -> dict[str, Any]:
+        found = {key: self._pending[key] for key in keys if key in self._pending}
+        rest = [key for key in keys if key not in found]
+        if self.load_values:
+            found.update(
+                {key: self._entries[key] for key in rest if key in self._entries}
+            )
+            return found
+        by_shard: dict[int, list[str]] = {}
+        for key in rest:
+            if key in self._key_shards:
+                by_shard.setdefault(self._key_shards[key], []).append(key)
+        for index, shard_keys in by_shard.items():
+            found.update(self._read_shard(index, sorted(shard_keys)))
+        return found
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Any]:
+        """Return the cached values for the keys that are present."""
+        keys = list(dict.fromkeys(keys))
+        found = self._lookup(keys)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key: str, value: Any) -> None:
+        self._pending[key] = value
+
+    def update(self, entries: dict[str, Any]) -> None:
+        self._pending.update(entries)
+
+    def _write_shard(self, entries: dict[str, Any]) -> Path:
+        self.path.mkdir(parents=True, exist_ok=True)
+        number = int(self._shards[-1].stem.split("-")[1]) + 1 if self._shards else 0
+        shard = self.path / f"part-{number:05d}.parquet"
+        keys = sorted(entries)
+        df = pd.DataFrame({"key": keys, "value": [entries[key] for key in keys]})
+        tmp_path = shard.with_suffix(".tmp")
+        pq.write_table(
+            pa.Table.from_pandas(df, preserve_index=False),
+            tmp_path,
+            row_group_size=self.row_group_size,
+        )
+        tmp_path.replace(shard)
+        self._shards.append(shard)
+        return shard
+
+    def save(self) -> None:
+        """Write pending entries to a new shard. A no-op when nothing changed."""
+        if not self._pending:
+            return
+        self._write_shard(self._pending)
+        index = len(self._shards) - 1
+        if self.load_values:
+            self._entries.update(self._pending)
+        else:
+            self._key_shards.update(dict.fromkeys(self._pending, index))
+        self._pending = {}
+        if self.load_values and len(self._shards) > self.max_shards:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite a cache with load_values as a single shard."""
+        compacted = self._write_shard(self._entries)
+        for shard in self._shards[:-1]:
+            shard.unlink()
+        self._shards = [compacted.rename(self.path / "part-00000.parquet")]
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,275 @@
+import json
+from pathlib import Path
+from typing import Iterable, List
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# text-embedding-3-large
+EMBEDDING_DIMENSIONS = 3072
+STRING_LIST_COLUMNS = (
+    "entities",
+    "entities_pre_normalization",
+    "themes",
+    "themes_pre_normalization",
+)
+STRING_LIST_TYPE = pa.list_(pa.string())
+
+
+def is_embedding_column(column: str) -> bool:
+    """Embedding vectors live in <source>_embedding columns, e.g. page_content_embedding."""
+    return column.endswith("_embedding")
+
+
+def get_native_columns(df: pd.DataFrame) -> List[str]:
+    """Columns stored as native Arrow lists instead of JSON strings."""
+    return [
+        column
+        for column in df.columns
+        if isinstance(column, str)
+        and (is_embedding_column(column) or column in STRING_LIST_COLUMNS)
+    ]
+
+
+def _is_string_type(type: pa.DataType) -> bool:
+    return pa.types.is_string(type) or pa.types.is_large_string(type)
+
+
+def _is_missing(value) -> bool:
+    return value is None or (np.ndim(value) == 0 and pd.isna(value))
+
+
+def _parse(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def to_embedding_array(
+    values: Iterable, dimensions: int | None = None
+) -> pa.FixedSizeListArray:
+    """
+    Pack vectors (lists, arrays or legacy JSON strings) into one fixed_size_list<float32>
+    array. Missing vectors become nulls.
+
+    Args:
+        values: One vector per row
+        dimensions: Vector length. Defaults to the length of the first vector, or
+            EMBEDDING_DIMENSIONS if there is none.
+    """
+    values = [None if _is_missing(value) else _parse(value) for value in values]
+    if dimensions is None:
+        dimensions = next(
+            (len(value) for value in values if value is not None), EMBEDDING_DIMENSIONS
+        )
+    matrix = np.zeros((len(values), dimensions), dtype=np.float32)
+    mask = np.zeros(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        if value is None:
+            mask[i] = True
+            continue
+        vector = np.asarray(value, dtype=np.float32)
+        if vector.shape != (dimensions,):
+            raise ValueError(
+                f"Expected a {dimensions}-dim embedding at row {i}, got shape {vector.shape}"
+            )
+        matrix[i] = vector
+    return pa.FixedSizeListArray.from_arrays(
+        pa.array(matrix.ravel()), dimensions, mask=pa.array(mask)
+    )
+
+
+def to_string_list_array(values: Iterable) -> pa.ListArray:
+    """Pack lists of strings (or legacy JSON strings) into a list<string> array."""
+    return pa.array(
+        [None if _is_missing(value) else list(_parse(value)) for value in values],
+        type=STRING_LIST_TYPE,
+    )
+
+
+def to_arrow_table(df: pd.DataFrame) -> pa.Table:
+    """
+    Convert a dataframe to an Arrow table with embedding columns as
+    fixed_size_list<float32, 3072> and entity/theme columns as list<string>.
+    All other columns (and the index) are converted the way pandas.to_parquet does, so
+    complex values in them must already be serialized (serialize_df_for_parquet).
+    """
+    native_columns = get_native_columns(df)
+    table = pa.Table.from_pandas(df.drop(columns=native_columns))
+    # Inserting in column order puts every native column back at its original position
+    for position, column in enumerate(df.columns):
+        if column not in native_columns:
+            continue
+        if is_embedding_column(column):
+            array = to_embedding_array(df[column])
+        else:
+            array = to_string_list_array(df[column])
+        table = table.add_column(position, column, array)
+    return table
+
+
+def write_parquet(df: pd.DataFrame, path: Path) -> None:
+    pq.write_table(to_arrow_table(df), path)
+
+
+def _conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Reorder and cast table to schema. Missing columns are nulls, extra ones raise."""
+    extra = set(table.column_names) - set(schema.names)
+    if extra:
+        raise ValueError(f"Columns not in the first batch: {sorted(extra)}")
+    columns = [
+        (
+            table.column(field.name).cast(field.type)
+            if field.name in table.column_names
+            else pa.nulls(len(table), field.type)
+        )
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def write_parquet_batches(frames: Iterable[pd.DataFrame], path: Path) -> int:
+    """
+    Write dataframes to one parquet file as consecutive row groups, so only one frame
+    is in memory at a time. The first frame fixes the schema and a later frame with a
+    column it lacks raises ValueError. Columns that are all null in it are stored as
+    strings. The file is written next to path and replaces it when complete. Without
+    any frames an existing file at path is deleted. Returns the number of rows written.
+    """
+    tmp_path = path.with_suffix(".tmp")
+    writer = None
+    rows = 0
+    try:
+        for df in frames:
+            table = to_arrow_table(df)
+            if writer is None:
+                fields = [
+                    (
+                        field.with_type(pa.string())
+                        if pa.types.is_null(field.type)
+                        else field
+                    )
+                    for field in table.schema
+                ]
+                writer = pq.ParquetWriter(
+                    tmp_path, pa.schema(fields, metadata=table.schema.metadata)
+                )
+            writer.write_table(_conform(table, writer.schema))
+            rows += len(table)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if writer is None:
+        path.unlink(missing_ok=True)
+        return 0
+    writer.close()
+    tmp_path.replace(path)
+    return rows
+
+
+def embedding_matrix(column: pa.ChunkedArray | pa.Array) -> np.ndarray:
+    """
+    (rows, dimensions) float32 matrix of an embedding column. For a single chunk without
+    nulls this is a zero-copy, read-only view of the Arrow buffer. Null rows are NaN.
+    Legacy JSON string columns are parsed.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if _is_string_type(column.type):
+        values = column.to_pylist()
+        dimensions = next(
+            (len(json.loads(value)) for value in values if value is not None),
+            EMBEDDING_DIMENSIONS,
+        )
+        matrix = np.full((len(values), dimensions), np.nan, dtype=np.float32)
+        for i, value in enumerate(values):
+            if value is not None:
+                matrix[i] = json.loads(value)
+        return matrix
+    dimensions = column.type.list_size
+    flat = column.values.slice(column.offset * dimensions, len(column) * dimensions)
+    matrix = flat.to_numpy(zero_copy_only=False).reshape(len(column), dimensions)
+    if column.null_count:
+        # Null vectors may be backed by zeros or by null children (read as NaN)
+        matrix = matrix.astype(np.float32, copy=True)
+        matrix[column.is_null().to_numpy(zero_copy_only=False)] = np.nan
+    return matrix
+
+
+def read_embedding_matrix(path: Path, column: str) -> np.ndarray:
+    """Read only one embedding column of a parquet file as a (rows, dimensions) matrix."""
+    return embedding_matrix(pq.read_table(path, columns=[column]).column(column))
+
+
+def read_parquet(path: Path, columns: List[str] | None = None) -> pd.DataFrame:
+    """
+    pandas.read_parquet for files written with write_parquet (or legacy JSON-string files).
+
+    String list columns come back as Python lists. Each embedding column is read into a
+    single matrix (see embedding_matrix) and its cells are row views into it, or None.
+    """
+    table = pq.read_table(path, columns=columns, use_pandas_metadata=True)
+    embedding_columns = [
+        name
+        for name in table.column_names
+        if is_embedding_column(name)
+        and (
+            pa.types.is_fixed_size_list(table.schema.field(name).type)
+            or _is_string_type(table.schema.field(name).type)
+        )
+    ]
+    order = table.column_names
+    df = table.drop_columns(embedding_columns).to_pandas()
+    for column in embedding_columns:
+        matrix = embedding_matrix(table.column(column))
+        missing = table.column(column).is_null().to_numpy(zero_copy_only=False)
+        df[column] = pd.Series(
+            [None if miss else row for row, miss in zip(matrix, missing)],
+            index=df.index,
+            dtype=object,
+        )
+    for column in STRING_LIST_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].apply(
+                lambda x: (
+                    json.loads(x)
+                    if isinstance(x, str)
+                    else x.tolist() if isinstance(x, np.ndarray) else x
+                )
+            )
+    return df[[name for name in order if name in df.columns]]
+
+
+def is_legacy_parquet(path: Path) -> bool:
+    """Whether a parquet file still stores embeddings or entity lists as JSON strings."""
+    schema = pq.read_schema(path)
+    return any(
+        (is_embedding_column(field.name) or field.name in STRING_LIST_COLUMNS)
+        and _is_string_type(field.type)
+        for field in schema
+    )
+
+
+def migrate_parquet(path: Path) -> bool:
+    """
+    Rewrite a legacy JSON-string parquet file with the native schema, in place.
+    Returns False if the file did not need migrating.
+    """
+    if not is_legacy_parquet(path):
+        return False
+    df = read_parquet(path)
+    tmp_path = path.with_suffix(".migrating.parquet")
+    write_parquet(df, tmp_path)
+    tmp_path.replace(path)
+    return True
+
+
+def migrate_parquet_artifacts(root: Path) -> List[Path]:
+    """Migrate every legacy parquet file under root. Returns the migrated paths."""
+    migrated = []
+    for path in sorted(root.rglob("*.parquet")):
+        if migrate_parquet(path):
+            print(f"Migrated {path}")
+            migrated.append(path)
+    return migrated
@@ -0,0 +1,127 @@
+from typing import List, Literal
+import numpy as np
+import pandas as pd
+from config.logger import RotatingFileLogWriter
+from util.dedup_diagnostics import DedupDiagnostics, DiagnosticsMode
+from util.nlp import (
+    get_blocked_cosine_pairs,
+    get_write_pair_log_text,
+    timer,
+)
+
+
+class SemanticDeduplicationPipeline:
+    """
+    Remove near-duplicates that lexical dedup misses (paraphrased reposts) by cosine
+    similarity of precomputed embeddings.
+
+    Pairs above the threshold are found with get_blocked_cosine_pairs. Docs are visited in
+    keep order and a doc is dropped only when it is paired with a doc that was already kept,
+    so a doc is never removed for a transitive match it was not compared with. Like
+    DeduplicationPipeline.run, it returns the input DataFrame filtered to the kept rows.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        silent: bool = False,
+        *,
+        diagnostics: DiagnosticsMode = "sampled",
+    ):
+        """
+        Args:
+            name: Used to name the log files
+            silent: Disable logging
+            diagnostics: Sampling of the duplicate pair log, see DedupDiagnostics
+        """
+        self.logger = RotatingFileLogWriter(
+            f"semantic_deduplication-{name}", silent=silent
+        )
+        self.diagnostics = DedupDiagnostics(
+            f"semantic-{name}", "off" if silent else diagnostics
+        )
+
+    @staticmethod
+    def _select_removed(
+        pairs: List[tuple[int, int, float]],
+        lengths: np.ndarray,
+        keep: Literal["first", "longest"],
+    ) -> set[int]:
+        """
+        Greedily keep docs in preference order and remove the ones directly paired with a
+        kept doc. With A~B and B~C where A is preferred, B is removed and C is kept.
+        """
+        neighbors: dict[int, list[int]] = {}
+        for i, j, _ in pairs:
+            neighbors.setdefault(i, []).append(j)
+            neighbors.setdefault(j, []).append(i)
+        if keep == "longest":
+            order = sorted(neighbors, key=lambda i: (-lengths[i], i))
+        else:
+            order = sorted(neighbors)
+        kept: set[int] = set()
+        removed: set[int] = set()
+        for i in order:
+            if any(j in kept for j in neighbors[i]):
+                removed.add(i)
+            else:
+                kept.add(i)
+        return removed
+
+    @timer("Semantic deduplication")
+    def run(
+        self,
+        df: pd.DataFrame,
+        *,
+        threshold: float = 0.95,
+        embedding_column: str = "page_content_embedding",
+        source_column: str | None = "type",
+        keep: Literal["first", "longest"] = "longest",
+        block_size: int = 2048,
+    ) -> pd.DataFrame:
+        """
+        Args:
+            df: Documents with page_content and an embedding column of equal-length vectors
+            threshold: Cosine similarity a pair must exceed to count as duplicates
+            embedding_column: Column holding the vectors
+            source_column: Only pairs from different sources are compared when set,
+                since same-source duplicates are handled by the lexical DeduplicationPipeline.
+                None compares all pairs.
+            keep: Which doc of a duplicate pair is preferred: first row or longest page_content
+            block_size: Rows per matrix-product tile
+        """
+        self.logger.log_and_print_header(f"Semantic dedup of {len(df)} docs")
+        self.logger.log_and_print(
+            f"Threshold: {threshold}, cross-source only: {source_column is not None}"
+        )
+        if df.empty:
+            return df
+
+        vectors = np.asarray(df[embedding_column].tolist(), dtype=np.float32)
+        groups = (
+            pd.factorize(df[source_column])[0] if source_column is not None else None
+        )
+        pairs = get_blocked_cosine_pairs(
+            vectors, threshold, groups=groups, block_size=block_size
+        )
+        self.logger.log_and_print(f"Pairs above threshold: {len(pairs)}")
+
+        texts = df["page_content"].tolist()
+        for i, j, score in pairs:
+            self.diagnostics.log(
+                "duplicates",
+                get_write_pair_log_text,
+                texts[i],
+                texts[j],
+                f"Semantic duplicate ({score:.3f})",
+            )
+        self.diagnostics.close()
+
+        lengths = df["page_content"].str.len().to_numpy()
+        removed = self._select_removed(pairs, lengths, keep)
+
+        df_deduped = df[~np.isin(np.arange(len(df)), list(removed))]
+        self.logger.log_and_print(
+            f"*Semantic dedup complete. Removed {len(removed)}, rows after: {len(df_deduped)}"
+        )
+        return df_deduped
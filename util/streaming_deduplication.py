@@ -0,0 +1,313 @@
+import shutil
+from pathlib import Path
+from typing import Iterator, List, Literal, Tuple
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from datasketch import MinHashLSH
+from rapidfuzz import fuzz, process
+from config.logger import RotatingFileLogWriter
+from util.deduplication_pipeline import chunk_pairs_by_length
+from util.nlp import (
+    DisjointSet,
+    TokenizedCorpus,
+    get_minhash_band_keys,
+    nltk_get_lemmatized_tokens_parallel,
+    timer,
+)
+from util.util_main import print_replace
+
+# One spilled LSH bucket entry: band key and the global sequence number of the doc
+BAND_RECORD_DTYPE = np.dtype([("key", "<u8"), ("doc", "<u4")])
+
+
+class StreamingDeduplicationPipeline:
+    """
+    Out-of-core near-duplicate removal for a folder of parquet files (data/<source>/documents).
+
+    Memory is bounded by batch_size rather than by the corpus:
+    1. Row groups are read batch_size rows at a time. Each batch is tokenized, MinHashed
+       (plain and shifted by one word, like filter_exact_duplicates_minhash) and the LSH band
+       keys are appended to num_partitions spill files, partitioned by key.
+    2. Each partition is sorted on its own and every run of equal keys becomes candidate pairs
+       (all pairs within the run, capped by max_bucket_size), which are spilled to
+       num_partitions pair files, partitioned by their first doc.
+    3. Pair files are confirmed one at a time with fuzz.partial_ratio, reading back only the row
+       groups that hold the texts of that partition's docs. Confirmed pairs are grouped with
+       union-find and one doc per group is kept.
+
+    Only per-doc ids, token counts and the union-find parents stay in memory for the whole run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        work_dir: Path,
+        *,
+        threshold: float = 0.95,
+        num_perm: int = 1024,
+        duplicate_threshold: int = 95,
+        min_unique_tokens: int = 50,
+        keep: Literal["first", "longest"] = "first",
+        batch_size: int = 2048,
+        num_partitions: int = 64,
+        max_bucket_size: int = 64,
+        tokenize_workers: int | None = None,
+        silent: bool = False,
+    ):
+        """
+        Args:
+            name: Used to name the log file
+            work_dir: Scratch directory for spilled band keys and candidate pairs. Cleared on run.
+            threshold: MinHash LSH Jaccard threshold for candidate pairs
+            num_perm: MinHash permutations
+            duplicate_threshold: fuzz.partial_ratio score a candidate pair must exceed
+            min_unique_tokens: Docs with fewer unique tokens are never treated as duplicates
+            keep: Which doc of a duplicate group survives: lowest read order or most tokens
+            batch_size: Parquet rows tokenized and hashed at a time
+            num_partitions: Number of spill files. Each is sorted in memory on its own.
+            max_bucket_size: Docs sharing a band key are all paired with each other up to this
+                many. In bigger buckets each doc is paired with the next max_bucket_size - 1.
+            tokenize_workers: Process pool size for tokenization (default: cpu count)
+        """
+        self.logger = RotatingFileLogWriter(
+            f"streaming_deduplication-{name}", silent=silent
+        )
+        self.work_dir = work_dir
+        self.num_perm = num_perm
+        self.duplicate_threshold = duplicate_threshold
+        self.min_unique_tokens = min_unique_tokens
+        self.keep = keep
+        self.batch_size = batch_size
+        self.num_partitions = num_partitions
+        self.max_bucket_size = max_bucket_size
+        self.tokenize_workers = tokenize_workers
+
+        lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.bands, self.rows = lsh.b, lsh.r
+
+        self.doc_ids: List[str] = []
+        self.token_counts: List[int] = []
+
+    @staticmethod
+    def _get_parquet_files(documents_dir: Path) -> List[Path]:
+        return sorted(
+            path
+            for path in documents_dir.glob("*.parquet")
+            if not path.name.startswith(".")
+        )
+
+    def _iter_batches(
+        self, documents_dir: Path
+    ) -> Iterator[Tuple[List[str], List[str]]]:
+        for file_path in self._get_parquet_files(documents_dir):
+            parquet_file = pq.ParquetFile(file_path)
+            for batch in parquet_file.iter_batches(
+                batch_size=self.batch_size, columns=["id", "page_content"]
+            ):
+                yield (
+                    batch.column("id").to_pylist(),
+                    batch.column("page_content").to_pylist(),
+                )
+
+    def _partition_path(self, partition: int, kind: Literal["bands", "pairs"]) -> Path:
+        return self.work_dir / f"{kind}_{partition:03d}.bin"
+
+    def _spill_band_keys(self, signatures: np.ndarray, seqs: np.ndarray) -> None:
+        keys = get_minhash_band_keys(signatures, self.bands, self.rows)
+        records = np.empty(keys.size, dtype=BAND_RECORD_DTYPE)
+        records["key"] = keys.ravel()
+        records["doc"] = np.repeat(seqs, self.bands)
+        partitions = records["key"] % np.uint64(self.num_partitions)
+        for partition in np.unique(partitions).tolist():
+            with open(self._partition_path(partition, "bands"), "ab") as f:
+                records[partitions == partition].tofile(f)
+
+    @timer("Streaming dedup: hash batches")
+    def _hash_batches(self, documents_dir: Path) -> None:
+        self.logger.log_and_print_header(f"Hashing documents in {documents_dir}")
+        for ids, texts in self._iter_batches(documents_dir):
+            first_seq = len(self.doc_ids)
+            tokens = nltk_get_lemmatized_tokens_parallel(
+                texts, workers=self.tokenize_workers
+            )
+            corpus = TokenizedCorpus(ids, texts, tokens)
+            self.doc_ids.extend(ids)
+            self.token_counts.extend(corpus.get_token_counts().tolist())
+
+            valid = np.flatnonzero(
+                corpus.get_unique_token_counts() >= self.min_unique_tokens
+            )
+            seqs = (first_seq + valid).astype(np.uint32)
+            for shift in (None, 1):
+                self._spill_band_keys(
+                    corpus.get_minhash_signatures(
+                        valid, ngram=2, shift=shift, num_perm=self.num_perm
+                    ),
+                    seqs,
+                )
+            print_replace(f"Hashed {len(self.doc_ids)} docs")
+        self.logger.log_and_print(f"\nHashed docs: {len(self.doc_ids)}")
+
+    def _get_bucket_pairs(self, records: np.ndarray) -> np.ndarray:
+        """
+        Doc pairs (lower seq first) sharing a band key. records must be sorted by key then doc
+        and free of repeats, so the docs of a bucket are consecutive and ascending.
+        """
+        keys, docs = records["key"], records["doc"]
+        pairs = [np.zeros((0, 2), dtype=np.uint32)]
+        for offset in range(1, min(self.max_bucket_size, len(keys))):
+            same_bucket = keys[offset:] == keys[:-offset]
+            if not same_bucket.any():
+                break
+            pairs.append(
+                np.stack(
+                    [docs[:-offset][same_bucket], docs[offset:][same_bucket]], axis=1
+                )
+            )
+        return np.concatenate(pairs)
+
+    @timer("Streaming dedup: sort buckets")
+    def _write_candidate_pairs(self) -> int:
+        """
+        Sort each spilled partition and spill its colliding doc pairs by first doc.
+        Returns the pair count, where a pair colliding in several partitions counts once per partition.
+        """
+        total = 0
+        for partition in range(self.num_partitions):
+            bands_path = self._partition_path(partition, "bands")
+            if not bands_path.exists():
+                continue
+            # Sorts by key then doc and drops docs repeated in a bucket (plain and shifted)
+            pairs = self._get_bucket_pairs(
+                np.unique(np.fromfile(bands_path, dtype=BAND_RECORD_DTYPE))
+            )
+            pair_partitions = pairs[:, 0] % self.num_partitions
+            for pair_partition in np.unique(pair_partitions).tolist():
+                with open(self._partition_path(pair_partition, "pairs"), "ab") as f:
+                    pairs[pair_partitions == pair_partition].tofile(f)
+            bands_path.unlink()
+            total += len(pairs)
+        return total
+
+    def _get_row_groups(self, documents_dir: Path) -> List[Tuple[Path, int, int]]:
+        """(file, row group, seq of its first row) in the read order of _iter_batches."""
+        row_groups = []
+        seq = 0
+        for file_path in self._get_parquet_files(documents_dir):
+            metadata = pq.ParquetFile(file_path).metadata
+            for row_group in range(metadata.num_row_groups):
+                row_groups.append((file_path, row_group, seq))
+                seq += metadata.row_group(row_group).num_rows
+        return row_groups
+
+    def _load_joined_tokens(
+        self, row_groups: List[Tuple[Path, int, int]], needed: np.ndarray
+    ) -> dict[int, str]:
+        """Read and tokenize the docs in needed (sorted seqs) from the row groups holding them."""
+        starts = np.array([start for _, _, start in row_groups], dtype=np.int64)
+        needed_groups = np.searchsorted(starts, needed, side="right") - 1
+        texts = []
+        for index in np.unique(needed_groups).tolist():
+            file_path, row_group, start = row_groups[index]
+            contents = (
+                pq.ParquetFile(file_path)
+                .read_row_group(row_group, columns=["page_content"])
+                .column("page_content")
+                .to_pylist()
+            )
+            texts.extend(
+                contents[seq - start] for seq in needed[needed_groups == index].tolist()
+            )
+        tokens = nltk_get_lemmatized_tokens_parallel(
+            texts, workers=self.tokenize_workers
+        )
+        return {
+            seq: " ".join(doc_tokens)
+            for seq, doc_tokens in zip(needed.tolist(), tokens)
+        }
+
+    def _confirm_partition(
+        self, pairs: np.ndarray, joined_tokens: dict[int, str], groups: DisjointSet
+    ) -> int:
+        """Union the pairs scoring above duplicate_threshold. Returns how many did."""
+        strings_a = [joined_tokens[i] for i in pairs[:, 0].tolist()]
+        strings_b = [joined_tokens[j] for j in pairs[:, 1].tolist()]
+        chunks = chunk_pairs_by_length(
+            np.array([len(string) for string in strings_a], dtype=np.int64),
+            np.array([len(string) for string in strings_b], dtype=np.int64),
+        )
+        confirmed = 0
+        for chunk in chunks:
+            scores = process.cpdist(
+                [strings_a[i] for i in chunk],
+                [strings_b[i] for i in chunk],
+                scorer=fuzz.partial_ratio,
+                score_cutoff=self.duplicate_threshold,
+                workers=-1,
+            )
+            for idx in chunk[scores > self.duplicate_threshold].tolist():
+                groups.union(int(pairs[idx, 0]), int(pairs[idx, 1]))
+                confirmed += 1
+        return confirmed
+
+    @timer("Streaming dedup: confirm candidates")
+    def _confirm_candidate_pairs(self, documents_dir: Path) -> DisjointSet:
+        groups = DisjointSet(len(self.doc_ids))
+        row_groups = self._get_row_groups(documents_dir)
+        confirmed = candidates = 0
+        for partition in range(self.num_partitions):
+            pairs_path = self._partition_path(partition, "pairs")
+            if not pairs_path.exists():
+                continue
+            # The same pair can collide in several band partitions
+            pairs = np.unique(
+                np.fromfile(pairs_path, dtype=np.uint32).reshape(-1, 2), axis=0
+            ).astype(np.int64)
+            joined_tokens = self._load_joined_tokens(row_groups, np.unique(pairs))
+            confirmed += self._confirm_partition(pairs, joined_tokens, groups)
+            candidates += len(pairs)
+            pairs_path.unlink()
+        self.logger.log_and_print(f"Confirmed pairs: {confirmed} of {candidates}")
+        return groups
+
+    def _choose_representative(self, group: List[int]) -> int:
+        if self.keep == "longest":
+            return max(group, key=lambda i: (self.token_counts[i], -i))
+        return min(group)
+
+    def run(self, documents_dir: Path, lock_path: Path | None = None) -> pd.DataFrame:
+        """
+        Deduplicate every parquet file in documents_dir.
+
+        Returns:
+            DataFrame with the "id" column of the docs to keep. Also written to lock_path if
+            given, in the format DeduplicationLockPipeline reads.
+        """
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        self.work_dir.mkdir(parents=True)
+        self.doc_ids, self.token_counts = [], []
+
+        self._hash_batches(documents_dir)
+        num_pairs = self._write_candidate_pairs()
+        self.logger.log_and_print(f"Candidate pairs: {num_pairs}")
+
+        groups = self._confirm_candidate_pairs(documents_dir)
+        removed = set()
+        for group in groups.groups():
+            keep = self._choose_representative(group)
+            removed.update(i for i in group if i != keep)
+
+        kept = pd.DataFrame(
+            {"id": [d for i, d in enumerate(self.doc_ids) if i not in removed]}
+        )
+        # An id can be in several files, and short copies are never compared. Keep the
+        # first like dedupe_df_ids, since DeduplicationLockPipeline requires unique ids.
+        kept = kept.drop_duplicates(subset=["id"], ignore_index=True)
+        self.logger.log_and_print(
+            f"*Streaming dedup complete. Kept {len(kept)} of {len(self.doc_ids)} docs"
+        )
+        if lock_path is not None:
+            kept.to_parquet(lock_path, index=False)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        return kept
@@ -0,0 +1,120 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Callable, Iterable, List, Literal, NamedTuple
+import pandas as pd
+
+CleaningProfile = Literal["embedding", "inference", "html_primary"]
+
+
+class CleaningStep(NamedTuple):
+    pattern: re.Pattern
+    replacement: str
+    # Cheap check that must pass for the pattern to possibly match, e.g. a substring
+    guard: Callable[[str], bool] | None = None
+
+
+# Markdown image insertions: ![alt](url)
+MARKDOWN_IMAGE = re.compile(r"!\[[^\]]*\]\([^\)]*\)")
+# Markdown headers (lines starting with #), except those starting with '## Title: '
+MARKDOWN_HEADER = re.compile(r"^(?:(?!## Title: ).)#.*$", flags=re.MULTILINE)
+# XML/HTML tags (e.g., <tag> or </tag> or <tag attr="val">)
+XML_TAG = re.compile(r"<[^>]+>")
+# Runs of spaces/tabs (but not newlines)
+HORIZONTAL_WHITESPACE = re.compile(r"[ \t]+")
+# 3+ blank lines (optionally with whitespace)
+BLANK_LINES = re.compile(r"((?:[ \t]*\n){3,})")
+# Entire lines containing [IMG]... image inserts
+IMG_LINE = re.compile(r"^.*\[IMG\]\S*.*$\n?", flags=re.MULTILINE)
+HTML_TABLE = re.compile(r"<table.*?</table>", flags=re.DOTALL)
+HTML_TAG_LAZY = re.compile(r"<.*?>", flags=re.DOTALL)
+
+
+def _has_blank_lines(text: str) -> bool:
+    return text.count("\n") >= 3
+
+
+PROFILES: dict[CleaningProfile, List[CleaningStep]] = {
+    # Markdown headers, tags and images carry no semantic meaning when embedded
+    "embedding": [
+        CleaningStep(MARKDOWN_IMAGE, "", lambda text: "![" in text),
+        CleaningStep(MARKDOWN_HEADER, "", lambda text: "#" in text),
+        CleaningStep(XML_TAG, "", lambda text: "<" in text),
+        CleaningStep(HORIZONTAL_WHITESPACE, " "),
+        CleaningStep(BLANK_LINES, "\n\n", _has_blank_lines),
+    ],
+    # Text of no use for LLM inference
+    "inference": [
+        CleaningStep(MARKDOWN_IMAGE, "", lambda text: "![" in text),
+        CleaningStep(IMG_LINE, "", lambda text: "[IMG]" in text),
+        CleaningStep(BLANK_LINES, "\n\n", _has_blank_lines),
+    ],
+    # User manual HTML: drop settings tables (extracted separately) and all other tags
+    "html_primary": [
+        CleaningStep(HTML_TABLE, "", lambda text: "<table" in text),
+        CleaningStep(HTML_TAG_LAZY, "", lambda text: "<" in text),
+    ],
+}
+
+# Profiles whose result is stripped and whose empty/non-string input becomes ""
+_STRIPPED_PROFILES = {"embedding", "inference"}
+
+
+def clean_text(text, profile: CleaningProfile):
+    """
+    Clean one text with the profile's precompiled steps. Steps whose guard fails are
+    skipped, which is most of them for most texts. Non-string values become "" for the
+    stripped profiles and pass through unchanged for "html_primary".
+    """
+    stripped = profile in _STRIPPED_PROFILES
+    if not text or not isinstance(text, str):
+        return "" if stripped else text
+    for step in PROFILES[profile]:
+        if step.guard is None or step.guard(text):
+            text = step.pattern.sub(step.replacement, text)
+    return text.strip() if stripped else text
+
+
+def _clean_chunk(args: tuple[list, CleaningProfile]) -> list:
+    texts, profile = args
+    return [clean_text(text, profile) for text in texts]
+
+
+@lru_cache(maxsize=1)
+def _default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def clean_texts(
+    texts: Iterable,
+    profile: CleaningProfile,
+    *,
+    workers: int | None = None,
+    chunk_size: int = 5000,
+) -> list:
+    """
+    Clean many texts. Large inputs are split into chunks that run in a process pool,
+    small ones (a single chunk or workers=1) run inline.
+    """
+    texts = list(texts)
+    workers = workers or _default_workers()
+    if workers <= 1 or len(texts) <= chunk_size:
+        return _clean_chunk((texts, profile))
+    chunks = [
+        (texts[i : i + chunk_size], profile) for i in range(0, len(texts), chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [text for chunk in executor.map(_clean_chunk, chunks) for text in chunk]
+
+
+def clean_column(
+    series: pd.Series, profile: CleaningProfile, *, workers: int | None = None
+) -> pd.Series:
+    """clean_texts over a DataFrame column, keeping its index and name."""
+    return pd.Series(
+        clean_texts(series.tolist(), profile, workers=workers),
+        index=series.index,
+        name=series.name,
+        dtype=object,
+    )
@@ -0,0 +1,116 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterable, List
+import pandas as pd
+import tiktoken
+from util.parquet_cache import hash_text
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoder(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    """tiktoken encoders are expensive to build, so each one is created once per process."""
+    return tiktoken.get_encoding(encoding_name)
+
+
+class TokenCounter:
+    """
+    Token counts for one encoding with an LRU memo keyed by hash_text(text), so the memo
+    holds digests rather than pinning the documents themselves in memory.
+
+    Texts are encoded with encode_ordinary, so special-token strings such as
+    "<|endoftext|>" in scraped content count as plain text instead of raising.
+    Batches are deduplicated against the memo first and the misses are encoded with
+    tiktoken's multi-threaded encode_ordinary_batch.
+
+    Safe to share between threads (see get_token_counter). The memo is locked while it is
+    read or updated, but encoding runs outside the lock.
+    """
+
+    def __init__(
+        self,
+        encoding_name: str = DEFAULT_ENCODING,
+        *,
+        memo_size: int = 200_000,
+        num_threads: int = 8,
+    ):
+        self.encoder = get_encoder(encoding_name)
+        self.memo_size = memo_size
+        self.num_threads = num_threads
+        self._memo: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recall(self, keys: Iterable[str]) -> dict[str, int]:
+        """Memoized counts of keys, marked as recently used."""
+        with self._lock:
+            known = {}
+            for key in keys:
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+                    known[key] = self._memo[key]
+            return known
+
+    def _remember(self, counts: dict[str, int]) -> None:
+        with self._lock:
+            self._memo.update(counts)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def count(self, text: str) -> int:
+        text = str(text)
+        key = hash_text(text)
+        known = self._recall([key])
+        if key in known:
+            return known[key]
+        count = len(self.encoder.encode_ordinary(text))
+        self._remember({key: count})
+        return count
+
+    def count_batch(self, texts: Iterable[str]) -> List[int]:
+        texts = [str(text) for text in texts]
+        keys = [hash_text(text) for text in texts]
+        counts = self._recall(dict.fromkeys(keys))
+        missing = {key: text for key, text in zip(keys, texts) if key not in counts}
+        if missing:
+            encoded = self.encoder.encode_ordinary_batch(
+                list(missing.values()), num_threads=self.num_threads
+            )
+            new_counts = {key: len(tokens) for key, tokens in zip(missing, encoded)}
+            self._remember(new_counts)
+            counts.update(new_counts)
+        return [counts[key] for key in keys]
+
+    def count_column(
+        self,
+        df: pd.DataFrame,
+        column: str = "page_content",
+        count_column: str = "token_count",
+    ) -> pd.Series:
+        """
+        Token counts of df[column], reusing the persisted count_column (written by
+        DocumentIndex.create for page_content) where it is present and not null.
+        """
+        if count_column in df.columns and column == "page_content":
+            known = df[count_column].notna()
+            if known.all():
+                return df[count_column].astype(int)
+            counts = df[count_column].copy()
+            counts[~known] = self.count_batch(df.loc[~known, column])
+            return counts.astype(int)
+        return pd.Series(self.count_batch(df[column]), index=df.index, dtype=int)
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(encoding_name: str = DEFAULT_ENCODING) -> TokenCounter:
+    """Process-wide TokenCounter per encoding, so the memo is shared by all callers."""
+    return TokenCounter(encoding_name)
+
+
+def get_model_encoding_name(model: str) -> str:
+    """tiktoken encoding of an OpenAI model, e.g. o200k_base for gpt-4.1-nano."""
+    try:
+        return tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        return DEFAULT_ENCODING
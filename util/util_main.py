@@ -1,13 +1,18 @@
-import re
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable, List
 from langchain_core.documents import Document
 import pandas as pd
 from pathlib import Path
 import json
 from datetime import datetime
 
-import tiktoken
 from itertools import accumulate
+from util.token_counting import get_token_counter
+from util.text_cleaning import BLANK_LINES, clean_text
+from util.parquet_schema import (
+    get_native_columns,
+    write_parquet,
+    write_parquet_batches,
+)
 
 
 def serialize_document(document: Document) -> Dict[str, Any]:
@@ -128,12 +133,15 @@ def dedupe_df_ids(df: pd.DataFrame) -> pd.DataFrame:
     )
 
 
-def serialize_df_for_parquet(df: pd.DataFrame) -> pd.DataFrame:
+def serialize_df_for_parquet(
+    df: pd.DataFrame, exclude: Iterable[str] = ()
+) -> pd.DataFrame:
     """
     Prepare a dataframe for parquet serialization by converting complex data types to JSON strings.
 
         Args:
             df: The dataframe to prepare
+            exclude: Columns to leave as they are
 
         Returns:
         A copy of the dataframe with complex types serialized
@@ -142,7 +150,10 @@ def serialize_df_for_parquet(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
 
     # Convert lists, sets, and other JSON serializable types to JSON strings
+    exclude = set(exclude)
     for col in df.columns:
+        if col in exclude:
+            continue
         if df[col].apply(lambda x: isinstance(x, (list, set, dict))).any():
             df[col] = df[col].apply(
                 lambda x: (
@@ -161,61 +172,65 @@ def drop_embedding_columns(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def to_serialized_parquet(df: pd.DataFrame, path: Path) -> pd.DataFrame:
-    df = serialize_df_for_parquet(df)
-    df.to_parquet(path)
+    """
+    Write df to parquet with embeddings as fixed_size_list<float32> and entities/themes as
+    list<string> (util.parquet_schema). Other complex columns are stored as JSON strings.
+    """
+    df = serialize_df_for_parquet(df, exclude=get_native_columns(df))
+    write_parquet(df, path)
     print(f"Saved {len(df)} documents to {path}")
     return df
 
 
+def to_serialized_parquet_batches(frames: Iterable[pd.DataFrame], path: Path) -> int:
+    """
+    to_serialized_parquet for a stream of dataframes with the same columns, written to
+    one file without concatenating them. Returns the number of rows written.
+    """
+    rows = write_parquet_batches(
+        (serialize_df_for_parquet(df, exclude=get_native_columns(df)) for df in frames),
+        path,
+    )
+    print(f"Saved {rows} documents to {path}")
+    return rows
+
+
 def count_tokens(text: str) -> int:
     """Count the tokens in a text."""
-    tokenizer = tiktoken.get_encoding("cl100k_base")
-    return len(tokenizer.encode(str(text)))
+    return get_token_counter().count(text)
 
 
 def collapse_blank_lines(text: str) -> str:
     """
     Replace experiments of 3 or more consecutive blank lines (optionally with whitespace) with exactly two newlines.
     """
-    return re.sub(r'((?:[ \t]*\n){3,})', '\n\n', text)
+    return BLANK_LINES.sub("\n\n", text)
 
 
 def clean_text_for_embedding(text: str) -> str:
     """
     Remove Markdown headers, XML/HTML tags, and image insertions from the text.
+    Use util.text_cleaning.clean_column for whole columns.
     Args:
         text: The input text to clean.
     Returns:
         Cleaned text with non-semantic content removed.
     """
-    if not text or not isinstance(text, str):
-        return ""
-
-    # Remove Markdown image insertions: ![alt](url)
-    text = re.sub(r"!\[[^\]]*\]\([^\)]*\)", "", text)
-
-    # Remove Markdown headers (lines starting with #), except those starting with '## Title: '
-    text = re.sub(r"^(?:(?!## Title: ).)#.*$", "", text, flags=re.MULTILINE)
-
-    # Remove XML/HTML tags (e.g., <tag> or </tag> or <tag attr="val">)
-    text = re.sub(r"<[^>]+>", "", text)
-
-    # Remove excessive spaces/tabs (but not newlines)
-    text = re.sub(r"[ \t]+", " ", text)
-
-    # Collapse experiments of 3+ blank lines (optionally with whitespace) into exactly 2 newlines
-    text = collapse_blank_lines(text)
-
-    text = text.strip()
-    return text
+    return clean_text(text, "embedding")
 
 
-def get_chunk_size(texts: list[str], token_limit: int = 300_000) -> int:
+def get_chunk_size(
+    texts: list[str],
+    token_limit: int = 300_000,
+    token_counts: list[int] | None = None,
+) -> int:
     """
     Determine the optimal chunk size so that the sum of the largest chunk_size token counts is under the token_limit.
     Returns the largest chunk size that keeps max_possible_tokens < token_limit.
+    Pass token_counts if they are already known to skip tokenizing the texts.
     """
-    token_counts = [count_tokens(text) for text in texts]
+    if token_counts is None:
+        token_counts = get_token_counter().count_batch(texts)
     total_tokens = sum(token_counts)
     if total_tokens < token_limit:
         return len(texts)